@@ -0,0 +1,10 @@
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SocialNetworkApp.settings')
+
+app = Celery('SocialNetworkApp')
+# Đọc các cấu hình CELERY_* trong settings.py
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
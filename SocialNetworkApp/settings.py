@@ -77,6 +77,10 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_THROTTLE_RATES': {
+        # /upload/sign-register/ không cần đăng nhập nên giới hạn theo IP
+        'register_upload': '10/hour',
+    },
 }
 
 #cấu hình mail
@@ -130,6 +134,9 @@ load_dotenv()
 
 DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
 
+# Số luồng upload ảnh Cloudinary chạy song song (xem socialnetwork/uploads.py)
+CLOUDINARY_UPLOAD_WORKERS = int(os.getenv('CLOUDINARY_UPLOAD_WORKERS', 8))
+
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
@@ -230,6 +237,22 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Asia/Ho_Chi_Minh'
 CELERY_IMPORTS = ('socialnetwork.tasks',)
 
+# Kênh realtime (SSE /realtime/stream/): InMemoryBroker cho 1 node, RedisBroker khi chạy nhiều node
+REALTIME_BROKER = os.getenv('REALTIME_BROKER', 'socialnetwork.realtime.InMemoryBroker')
+REALTIME_REDIS_URL = os.getenv('REALTIME_REDIS_URL', 'redis://localhost:6379/2')
+REALTIME_HEARTBEAT_SECONDS = 15
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Lock theo phòng của worker đồng bộ chat lên Firestore, phải dùng chung giữa các process
+    'locks': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_CACHE_URL', 'redis://localhost:6379/1'),
+    },
+}
+
 DRFSO2_URL_NAMESPACE = 'drfso2'
 
 ALLOWED_HOSTS=['localhost','127.0.0.1','192.168.1.3']
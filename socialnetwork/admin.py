@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
 from django.template.response import TemplateResponse
 from django.urls import path
+from django.utils import timezone
 from django.db.models import Count, Q
 from datetime import datetime, timedelta
 from oauth2_provider.models import Application
@@ -10,6 +12,7 @@ from social_django.models import UserSocialAuth
  
 
 from .models import *
+from . import analytics
 
 class MyAdminSite(admin.AdminSite):
     site_header = "Alumni Social Network System"
@@ -20,6 +23,8 @@ class MyAdminSite(admin.AdminSite):
         urls = super().get_urls()
         custom_urls = [
             path('survey-report/', self.admin_view(self.survey_report), name='survey-report'),
+            path('survey-crosstab/', self.admin_view(self.survey_crosstab), name='survey-crosstab'),
+            path('survey-export/<int:pk>/', self.admin_view(self.survey_export), name='survey-export'),
             path('stats-user/', self.admin_view(self.stats_user), name='stats-user'),
             path('stats-post/', self.admin_view(self.stats_post), name='stats-post'),
         ]
@@ -145,23 +150,13 @@ class MyAdminSite(admin.AdminSite):
         survey_id = request.GET.get('pk', None)
         if survey_id:
             survey_post = SurveyPost.objects.get(id=survey_id)
-            questions = SurveyQuestion.objects.filter(survey_post=survey_post)
-
-            report_data = []
-            for question in questions:
-                options = SurveyOption.objects.filter(survey_question=question)
-                options_data = [
-                    {
-                        'text': option.option,
-                        'count': UserSurveyOption.objects.filter(survey_option=option).count()
-                    }
-                    for option in options
-                ]
-                report_data.append({'question': question.question, 'multi_choice': question.multi_choice, 'options': options_data})
+            # Đọc bộ đếm đã tính sẵn: cả báo cáo chỉ tốn 1 câu truy vấn
+            report_data = survey_post.results()
 
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
                 return JsonResponse({
                     'survey_post': survey_post.content,
+                    'respondent_count': survey_post.respondent_count,
                     'data': report_data
                 })
 
@@ -174,6 +169,40 @@ class MyAdminSite(admin.AdminSite):
         else:
             return TemplateResponse(request, 'admin/survey_report.html', {'surveys': surveys})
 
+    def survey_export(self, request, pk, *args, **kwargs):
+        survey_post = get_object_or_404(SurveyPost, pk=pk)
+        try:
+            return analytics.export_survey_responses(survey_post, request.GET.get('type', 'csv'))
+        except analytics.AnalyticsError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+    def survey_crosstab(self, request, *args, **kwargs):
+        questions = SurveyQuestion.objects.select_related('survey_post').order_by('survey_post_id', 'id')
+        context = {'questions': questions, 'options': SurveyOption.objects.filter(survey_question__in=questions)
+                   .select_related('survey_question').order_by('survey_question_id', 'id')}
+
+        row = request.GET.get('row')
+        if row:
+            column = request.GET.get('column')
+            filters = request.GET.getlist('filters')
+            try:
+                result = analytics.crosstab(int(row), int(column) if column else None, [int(f) for f in filters])
+            except (ValueError, analytics.AnalyticsError) as e:
+                context['error'] = str(e)
+            else:
+                # Ghép sẵn từng hàng với các ô để template chỉ việc lặp
+                counts = result.get('counts') or [[] for _ in result['rows']]
+                result['table'] = [
+                    {'option': option, 'total': total, 'counts': row_counts}
+                    for option, total, row_counts in zip(result['rows'], result['row_totals'], counts)
+                ]
+                context['result'] = result
+            context.update(selected_row=int(row) if row.isdigit() else None,
+                           selected_column=int(column) if column and column.isdigit() else None,
+                           selected_filters={int(f) for f in filters if f.isdigit()})
+
+        return TemplateResponse(request, 'admin/survey_crosstab.html', context)
+
 
 my_admin_site = MyAdminSite(name='myadmin')
 
@@ -253,8 +282,37 @@ class SurveyPostAdmin(admin.ModelAdmin):
     inlines = [SurveyQuestionInline]
 
 
+class SurveyVersionMixin:
+    """
+    Sửa/xóa câu hỏi, lựa chọn trực tiếp trong admin phải đổi updated_date của khảo sát
+    để cache cây câu hỏi (key theo updated_date) dùng phiên bản mới.
+    """
+    survey_post_path = None
+
+    def touch_survey_posts(self, survey_post_ids):
+        SurveyPost.objects.filter(pk__in=survey_post_ids).update(updated_date=timezone.now())
+
+    def survey_post_ids(self, queryset):
+        return set(queryset.values_list(self.survey_post_path, flat=True))
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        self.touch_survey_posts(self.survey_post_ids(self.model.objects.filter(pk=form.instance.pk)))
+
+    def delete_model(self, request, obj):
+        survey_post_ids = self.survey_post_ids(self.model.objects.filter(pk=obj.pk))
+        super().delete_model(request, obj)
+        self.touch_survey_posts(survey_post_ids)
+
+    def delete_queryset(self, request, queryset):
+        survey_post_ids = self.survey_post_ids(queryset)
+        super().delete_queryset(request, queryset)
+        self.touch_survey_posts(survey_post_ids)
+
+
 # Quản lý SurveyQuestion và inline SurveyOption
-class SurveyQuestionAdmin(admin.ModelAdmin):
+class SurveyQuestionAdmin(SurveyVersionMixin, admin.ModelAdmin):
+    survey_post_path = 'survey_post_id'
     list_display = ("question", "multi_choice", "survey_post")
     list_filter = ("multi_choice",)
     search_fields = ("question", "survey_post__content")
@@ -262,7 +320,8 @@ class SurveyQuestionAdmin(admin.ModelAdmin):
 
 
 # Quản lý SurveyOption
-class SurveyOptionAdmin(admin.ModelAdmin):
+class SurveyOptionAdmin(SurveyVersionMixin, admin.ModelAdmin):
+    survey_post_path = 'survey_question__survey_post_id'
     list_display = ("option", "survey_question")
     search_fields = ("option", "survey_question__question")
 
@@ -0,0 +1,232 @@
+import csv
+import json
+from dataclasses import dataclass
+from functools import reduce
+
+import numpy as np
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Ma trận được cache theo phiên bản khảo sát, nên chỉ cần hết hạn để dọn các phiên bản cũ
+MATRIX_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+class AnalyticsError(Exception):
+    pass
+
+
+@dataclass
+class SurveyMatrix:
+    """
+    Câu trả lời của 1 khảo sát dạng ma trận người trả lời × lựa chọn (bool).
+    user_ids và option_ids đã sắp xếp tăng dần để tra chỉ số bằng searchsorted.
+    """
+    survey_post_id: int
+    user_ids: np.ndarray
+    option_ids: np.ndarray
+    matrix: np.ndarray
+
+    def option_index(self, option_ids):
+        option_ids = np.asarray(option_ids, dtype=np.int64)
+        index = np.searchsorted(self.option_ids, option_ids)
+        if len(option_ids) and (index.max() >= len(self.option_ids) or (self.option_ids[index] != option_ids).any()):
+            raise AnalyticsError('Lựa chọn không thuộc khảo sát.')
+        return index
+
+    def select(self, user_ids, option_ids):
+        """Ma trận con theo danh sách user (phải có trong khảo sát) và lựa chọn"""
+        rows = np.searchsorted(self.user_ids, user_ids)
+        return self.matrix[np.ix_(rows, self.option_index(option_ids))]
+
+    def pack(self):
+        # Nén bit (8 lựa chọn/byte) để giảm kích thước khi lưu cache
+        return self.survey_post_id, self.user_ids, self.option_ids, np.packbits(self.matrix, axis=1)
+
+    @classmethod
+    def unpack(cls, packed):
+        survey_post_id, user_ids, option_ids, bits = packed
+        matrix = np.unpackbits(bits, axis=1, count=len(option_ids)).astype(bool)
+        return cls(survey_post_id, user_ids, option_ids, matrix)
+
+
+def build_survey_matrix(survey_post_id):
+    from .models import SurveyOption, UserSurveyOption
+
+    option_ids = np.fromiter(
+        SurveyOption.objects.filter(survey_question__survey_post_id=survey_post_id)
+        .order_by('id').values_list('id', flat=True),
+        dtype=np.int64,
+    )
+    answers = UserSurveyOption.objects.filter(survey_option__survey_question__survey_post_id=survey_post_id)\
+        .order_by().values_list('user_id', 'survey_option_id')
+    pairs = np.array(list(answers.iterator(chunk_size=5000)), dtype=np.int64).reshape(-1, 2)
+
+    user_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+    matrix = np.zeros((len(user_ids), len(option_ids)), dtype=bool)
+    matrix[rows, np.searchsorted(option_ids, pairs[:, 1])] = True
+    return SurveyMatrix(survey_post_id, user_ids, option_ids, matrix)
+
+
+def matrix_cache_key(survey_post):
+    # Phiên bản đổi khi có người nộp (respondent_count) hoặc khi sửa câu hỏi (updated_date)
+    return f'survey-matrix:{survey_post.pk}:{survey_post.cache_version}:{survey_post.respondent_count}'
+
+
+def load_survey_matrix(survey_post):
+    key = matrix_cache_key(survey_post)
+    packed = cache.get(key)
+    if packed is not None:
+        return SurveyMatrix.unpack(packed)
+    survey_matrix = build_survey_matrix(survey_post.pk)
+    cache.set(key, survey_matrix.pack(), MATRIX_CACHE_TIMEOUT)
+    return survey_matrix
+
+
+def crosstab(row_question_id, column_question_id=None, filter_option_ids=()):
+    """
+    Bảng chéo số người chọn (lựa chọn của câu hàng) × (lựa chọn của câu cột), có thể thuộc 2 khảo sát khác nhau:
+    chỉ tính những người đã trả lời mọi khảo sát liên quan. Không truyền câu cột thì chỉ trả về phân bố của câu hàng.
+    filter_option_ids: giữ lại người đã chọn ít nhất 1 lựa chọn trong mỗi câu hỏi có mặt trong bộ lọc.
+    """
+    from .models import SurveyOption, SurveyPost, SurveyQuestion
+
+    question_ids = [row_question_id] + ([column_question_id] if column_question_id is not None else [])
+    questions = SurveyQuestion.objects.in_bulk(question_ids)
+    if len(questions) != len(set(question_ids)):
+        raise AnalyticsError('Câu hỏi không tồn tại.')
+
+    filters = list(SurveyOption.objects.filter(pk__in=filter_option_ids)
+                   .values_list('id', 'survey_question_id', 'survey_question__survey_post_id'))
+    if len(filters) != len(set(filter_option_ids)):
+        raise AnalyticsError('Lựa chọn trong bộ lọc không tồn tại.')
+
+    survey_ids = {question.survey_post_id for question in questions.values()} | {f[2] for f in filters}
+    matrices = {
+        survey_post.pk: load_survey_matrix(survey_post)
+        for survey_post in SurveyPost.objects.filter(pk__in=survey_ids)
+    }
+    # Người trả lời chung của các khảo sát, ghép theo user id
+    user_ids = reduce(np.intersect1d, [m.user_ids for m in matrices.values()])
+
+    mask = np.ones(len(user_ids), dtype=bool)
+    filter_groups = {}
+    for option_id, question_id, survey_post_id in filters:
+        filter_groups.setdefault((survey_post_id, question_id), []).append(option_id)
+    for (survey_post_id, _), option_ids in filter_groups.items():
+        mask &= matrices[survey_post_id].select(user_ids, option_ids).any(axis=1)
+    user_ids = user_ids[mask]
+
+    def axis(question):
+        options = list(question.options.order_by('id').values_list('id', 'option'))
+        selected = matrices[question.survey_post_id].select(user_ids, [option_id for option_id, _ in options])
+        return [{'id': option_id, 'text': text} for option_id, text in options], selected
+
+    row_options, rows = axis(questions[row_question_id])
+    result = {
+        'respondents': int(len(user_ids)),
+        'rows': row_options,
+        'row_totals': rows.sum(axis=0).tolist(),
+    }
+    if column_question_id is not None:
+        column_options, columns = axis(questions[column_question_id])
+        # counts[i][j] = số người chọn cả lựa chọn hàng i và lựa chọn cột j
+        result['columns'] = column_options
+        result['column_totals'] = columns.sum(axis=0).tolist()
+        result['counts'] = (rows.T.astype(np.int64) @ columns.astype(np.int64)).tolist()
+    return result
+
+
+class _Echo:
+    """File giả cho csv.writer: trả về dòng vừa ghi thay vì lưu lại"""
+    def write(self, value):
+        return value
+
+
+def iter_survey_responses(survey_post):
+    """
+    Duyệt câu trả lời theo từng người (1 dict/người). Đọc theo lô người trả lời (keyset theo user_id)
+    thay vì 1 cursor lớn vì driver MySQL tải hết kết quả vào bộ nhớ, nhờ vậy bộ nhớ không tăng theo số người.
+    """
+    from .models import SurveyCompletion, SurveyOption, UserSurveyOption
+
+    options = {
+        option_id: (question_id, text)
+        for option_id, question_id, text in SurveyOption.objects.filter(survey_question__survey_post=survey_post)
+        .values_list('id', 'survey_question_id', 'option')
+    }
+    last_user_id = 0
+    while True:
+        respondents = list(
+            SurveyCompletion.objects.filter(survey_post=survey_post, user_id__gt=last_user_id).order_by('user_id')
+            .values_list('user_id', 'user__username', 'user__first_name', 'user__last_name', 'user__alumni__mssv')
+            [:EXPORT_CHUNK_SIZE]
+        )
+        if not respondents:
+            return
+        last_user_id = respondents[-1][0]
+
+        selected = {}
+        answers = UserSurveyOption.objects.filter(user_id__in=[row[0] for row in respondents],
+                                                  survey_option_id__in=options).order_by('survey_option_id')
+        for user_id, option_id in answers.values_list('user_id', 'survey_option_id'):
+            question_id, text = options[option_id]
+            selected.setdefault(user_id, {}).setdefault(question_id, []).append(text)
+
+        for user_id, username, first_name, last_name, mssv in respondents:
+            yield {
+                'user_id': user_id,
+                'username': username,
+                'full_name': f'{first_name} {last_name}'.strip(),
+                'mssv': mssv,
+                'answers': selected.get(user_id, {}),
+            }
+
+
+# Ô bắt đầu bằng các ký tự này bị Excel/Sheets hiểu là công thức (CSV injection); tab/CR đứng trước công thức cũng vậy
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _csv_cell(value):
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _csv_rows(survey_post, questions):
+    writer = csv.writer(_Echo())
+
+    def writerow(row):
+        return writer.writerow([_csv_cell(value) for value in row])
+
+    # BOM để Excel nhận đúng UTF-8
+    yield '\ufeff' + writerow(['user_id', 'username', 'full_name', 'mssv'] + [text for _, text in questions])
+    for response in iter_survey_responses(survey_post):
+        yield writerow(
+            [response['user_id'], response['username'], response['full_name'], response['mssv'] or '']
+            + ['; '.join(response['answers'].get(question_id, [])) for question_id, _ in questions]
+        )
+
+
+def _ndjson_rows(survey_post, questions):
+    for response in iter_survey_responses(survey_post):
+        response['answers'] = {str(question_id): response['answers'].get(question_id, [])
+                               for question_id, _ in questions}
+        yield json.dumps(response, ensure_ascii=False) + '\n'
+
+
+def export_survey_responses(survey_post, export_type='csv'):
+    """StreamingHttpResponse 1 dòng/người trả lời (user, mssv, 1 cột/câu hỏi) dạng csv hoặc ndjson"""
+    if export_type not in EXPORT_TYPES:
+        raise AnalyticsError('Định dạng xuất không hợp lệ (csv hoặc ndjson).')
+    questions = list(survey_post.questions.order_by('id').values_list('id', 'question'))
+    rows = _csv_rows(survey_post, questions) if export_type == 'csv' else _ndjson_rows(survey_post, questions)
+
+    response = StreamingHttpResponse(rows, content_type=EXPORT_TYPES[export_type])
+    response['Content-Disposition'] = f'attachment; filename="survey-{survey_post.pk}.{export_type}"'
+    return response
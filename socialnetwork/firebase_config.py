@@ -1,5 +1,6 @@
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
 from django.conf import settings
 import os
 import time
@@ -21,6 +22,9 @@ cred = credentials.Certificate({
 firebase_admin.initialize_app(cred)
 db = firestore.client()
 
+# Firestore giới hạn 500 thao tác ghi trong 1 WriteBatch
+FIRESTORE_BATCH_LIMIT = 500
+
 def create_chat_room(room_id, users):
     """Tạo phòng chat mới trong Firebase"""
     chat_ref = db.collection('chat_rooms').document(str(room_id))
@@ -32,55 +36,50 @@ def create_chat_room(room_id, users):
     })
     return chat_ref
 
-def send_message(room_id, sender_id, content, user_ids=None, message_id=None):
-    """Gửi tin nhắn đến phòng chat và cập nhật lastMessages. Nếu truyền message_id thì dùng làm id document trên Firestore."""
-    # Kiểm tra phòng chat có tồn tại không
+def replicate_messages(room_id, messages, user_ids, read_state=None):
+    """
+    Ghi 1 loạt tin nhắn đã lưu trong DB (theo thứ tự id) lên Firestore bằng WriteBatch, id document trùng id DB.
+    Phòng chat và lastMessages chỉ cập nhật theo tin nhắn cuối của mỗi batch. Ghi lại nhiều lần vẫn cho cùng kết quả.
+    read_state: {user_id: (last_read_message_id, unread_count)} để mirror con trỏ đã đọc vào lastMessages.
+    """
     chat_ref = db.collection('chat_rooms').document(str(room_id))
-    chat_doc = chat_ref.get()
-    
-    if not chat_doc.exists:
-        chat_ref.set({
-            'users': [str(sender_id)],
-            'created_at': firestore.SERVER_TIMESTAMP,
-            'last_message': None,
-            'last_message_time': None
-        })
-    
-    now = firestore.SERVER_TIMESTAMP
-    # Nếu truyền message_id thì dùng làm id document, ngược lại để Firestore tự sinh
-    if message_id is not None:
-        message_ref = chat_ref.collection('messages').document(str(message_id))
-    else:
-        message_ref = chat_ref.collection('messages').document()
-    message_ref.set({
-        'sender_id': str(sender_id),
-        'content': content,
-        'timestamp': now,
-        'is_read': False
-    })
-    
-    # Cập nhật tin nhắn cuối cùng trong phòng chat (chat_rooms)
-    chat_ref.update({
-        'last_message': content,
-        'last_message_time': now
-    })
-
-    # Cập nhật hoặc tạo document lastMessages/{room_id}
-    if user_ids is None:
-        # Nếu không truyền user_ids, lấy từ chat_ref
-        chat_data = chat_ref.get().to_dict()
-        user_ids = chat_data.get('users', [])
     last_message_ref = db.collection('lastMessages').document(str(room_id))
-    last_message_ref.set({
-        'roomId': str(room_id),
-        'lastMessage': content,
-        'timestamp': now,
-        'senderId': str(sender_id),
-        'is_read': False,
-        'userIds': [str(uid) for uid in user_ids]
-    })
-    
-    return message_ref
+    # Mỗi batch còn 2 lượt ghi cho phòng chat và lastMessages
+    chunk_size = FIRESTORE_BATCH_LIMIT - 2
+
+    for start in range(0, len(messages), chunk_size):
+        chunk = messages[start:start + chunk_size]
+        batch = db.batch()
+        for message in chunk:
+            batch.set(chat_ref.collection('messages').document(str(message['id'])), {
+                'sender_id': str(message['sender_id']),
+                'content': message['content'],
+                'timestamp': message['created_date'],
+                'is_read': message['is_read']
+            })
+        last = chunk[-1]
+        batch.set(chat_ref, {
+            'last_message': last['content'],
+            'last_message_time': last['created_date']
+        }, merge=True)
+        last_message_data = {
+            'roomId': str(room_id),
+            'lastMessage': last['content'],
+            'timestamp': last['created_date'],
+            'senderId': str(last['sender_id']),
+            'is_read': last['is_read'],
+            'userIds': [str(uid) for uid in user_ids]
+        }
+        if read_state is not None:
+            last_message_data['lastReadMessageIds'] = {str(uid): cursor for uid, (cursor, _) in read_state.items()}
+            last_message_data['unreadCounts'] = {str(uid): unread for uid, (_, unread) in read_state.items()}
+        batch.set(last_message_ref, last_message_data)
+        batch.commit()
+
+def get_message_ids(room_id):
+    """Lấy id của toàn bộ document tin nhắn trong phòng (không tải nội dung)"""
+    messages_ref = db.collection('chat_rooms').document(str(room_id)).collection('messages')
+    return [doc.id for doc in messages_ref.select([]).stream()]
 
 def get_last_message(room_id, limit=1):
     """Lấy tin nhắn từ phòng chat, mặc định chỉ lấy 1 tin nhắn mới nhất"""
@@ -89,18 +88,41 @@ def get_last_message(room_id, limit=1):
     messages = messages_ref.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(limit).stream()
     return [msg.to_dict() for msg in messages]
 
-def mark_messages_as_read(room_id, user_id):
-    """Đánh dấu tất cả tin nhắn chưa đọc là đã đọc cho một người dùng cụ thể"""
+def mark_messages_as_read(room_id, user_id, sender_ids=None):
+    """
+    Đánh dấu đã đọc các tin nhắn chưa đọc mà người khác gửi cho user_id.
+    Lọc theo người gửi ngay trên Firestore (sender_ids là những người còn lại trong phòng) và commit
+    theo từng batch dưới giới hạn 500 thao tác ghi. Trả về số tin nhắn đã cập nhật.
+    """
     messages_ref = db.collection('chat_rooms').document(str(room_id)).collection('messages')
-    unread_messages = messages_ref.where('is_read', '==', False).stream()
-    
+    query = messages_ref.where(filter=FieldFilter('is_read', '==', False))
+    if sender_ids is not None:
+        query = query.where(filter=FieldFilter('sender_id', 'in', [str(uid) for uid in sender_ids]))
+    else:
+        query = query.where(filter=FieldFilter('sender_id', '!=', str(user_id)))
+
+    updated = 0
     batch = db.batch()
-    for msg in unread_messages:
-        if int(msg.to_dict().get('sender_id')) != int(user_id):
-            batch.update(msg.reference, {'is_read': True})
-    batch.commit()
+    pending = 0
+    # Chỉ lấy reference, không tải nội dung tin nhắn
+    for msg in query.select([]).stream():
+        batch.update(msg.reference, {'is_read': True})
+        pending += 1
+        if pending == FIRESTORE_BATCH_LIMIT:
+            batch.commit()
+            updated += pending
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+        updated += pending
+    return updated
 
-def update_last_message_is_read(room_id, is_read):
-    """Cập nhật trường is_read trong document lastMessages/{room_id}"""
+def update_read_cursor(room_id, user_id, last_read_message_id):
+    """Mirror con trỏ đã đọc của user vào lastMessages/{room_id} (1 lần ghi)"""
     last_message_ref = db.collection('lastMessages').document(str(room_id))
-    last_message_ref.update({'is_read': is_read})
+    last_message_ref.set({
+        'is_read': True,
+        'lastReadMessageIds': {str(user_id): last_read_message_id},
+        'unreadCounts': {str(user_id): 0}
+    }, merge=True)
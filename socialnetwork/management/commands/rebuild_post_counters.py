@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from socialnetwork.models import Comment, Post, Reaction, ReactionType
+
+
+def count_subquery(queryset):
+    """Subquery đếm số dòng theo post_id, dùng trong UPDATE của bảng Post"""
+    subquery = queryset.filter(post=OuterRef('pk')).order_by().values('post').annotate(total=Count('id')).values('total')
+    return Coalesce(Subquery(subquery), Value(0))
+
+
+class Command(BaseCommand):
+    help = 'Tính lại toàn bộ bộ đếm comment/reaction của bài viết từ dữ liệu gốc'
+
+    def handle(self, *args, **options):
+        counters = {'comment_count': count_subquery(Comment.objects.filter(active=True))}
+        for reaction in ReactionType:
+            counters[Post.reaction_counter_field(reaction)] = count_subquery(
+                Reaction.objects.filter(active=True, reaction=reaction.value)
+            )
+
+        with transaction.atomic():
+            updated = Post.objects.update(**counters)
+
+        self.stdout.write(self.style.SUCCESS(f'Đã cập nhật bộ đếm cho {updated} bài viết.'))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from socialnetwork.models import Post, PostSearchTerm
+from socialnetwork.search import build_terms, post_search_text
+
+
+class Command(BaseCommand):
+    help = 'Xây dựng lại toàn bộ chỉ mục tìm kiếm bài viết'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        posts = Post.objects.filter(active=True).with_subtype().order_by('id')
+        indexed = 0
+        with transaction.atomic():
+            PostSearchTerm.objects.all().delete()
+            # Bỏ qua từ vẫn trùng theo collation của DB, như search.index_post
+            terms = []
+            for post in posts.iterator(chunk_size=batch_size):
+                terms.extend(
+                    PostSearchTerm(post_id=post.pk, term=term, frequency=frequency)
+                    for term, frequency in build_terms(post_search_text(post)).items()
+                )
+                indexed += 1
+                if len(terms) >= batch_size:
+                    PostSearchTerm.objects.bulk_create(terms, batch_size=batch_size, ignore_conflicts=True)
+                    terms = []
+            PostSearchTerm.objects.bulk_create(terms, batch_size=batch_size, ignore_conflicts=True)
+
+        self.stdout.write(self.style.SUCCESS(f'Đã đánh chỉ mục {indexed} bài viết.'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from socialnetwork.models import SurveyCompletion, SurveyOption, SurveyPost, UserSurveyOption
+
+
+def count_subquery(queryset, field):
+    """Subquery đếm số dòng theo field trỏ tới bảng đang UPDATE"""
+    subquery = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field)\
+        .annotate(total=Count('id')).values('total')
+    return Coalesce(Subquery(subquery), Value(0))
+
+
+class Command(BaseCommand):
+    help = 'Tính lại số lượt chọn của từng lựa chọn và số người đã nộp của từng khảo sát từ dữ liệu gốc'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            options_updated = SurveyOption.objects.update(
+                response_count=count_subquery(UserSurveyOption.objects.all(), 'survey_option'),
+            )
+            surveys_updated = SurveyPost.objects.update(
+                respondent_count=count_subquery(SurveyCompletion.objects.all(), 'survey_post'),
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Đã cập nhật bộ đếm cho {options_updated} lựa chọn và {surveys_updated} khảo sát.'
+        ))
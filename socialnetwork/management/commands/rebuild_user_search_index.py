@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from socialnetwork.models import User, UserSearchTerm
+from socialnetwork.search import build_terms, user_search_text
+
+
+class Command(BaseCommand):
+    help = 'Xây dựng lại toàn bộ chỉ mục tìm kiếm họ tên người dùng'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        users = User.objects.only('id', 'first_name', 'last_name').order_by('id')
+        indexed = 0
+        with transaction.atomic():
+            UserSearchTerm.objects.all().delete()
+            # Bỏ qua từ vẫn trùng theo collation của DB, như search.index_user
+            terms = []
+            for user in users.iterator(chunk_size=batch_size):
+                terms.extend(
+                    UserSearchTerm(user_id=user.pk, term=term, frequency=frequency)
+                    for term, frequency in build_terms(user_search_text(user)).items()
+                )
+                indexed += 1
+                if len(terms) >= batch_size:
+                    UserSearchTerm.objects.bulk_create(terms, batch_size=batch_size, ignore_conflicts=True)
+                    terms = []
+            UserSearchTerm.objects.bulk_create(terms, batch_size=batch_size, ignore_conflicts=True)
+
+        self.stdout.write(self.style.SUCCESS(f'Đã đánh chỉ mục {indexed} người dùng.'))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from socialnetwork.firebase_config import get_message_ids
+from socialnetwork.models import ChatOutbox, ChatRoom
+from socialnetwork.tasks import enqueue_chat_replication
+
+
+class Command(BaseCommand):
+    help = 'So sánh tin nhắn trong DB với document trên Firestore của các phòng chat, có thể ghi bù phần thiếu'
+
+    def add_arguments(self, parser):
+        parser.add_argument('room_ids', nargs='*', type=int)
+        parser.add_argument('--all', action='store_true', help='Kiểm tra tất cả phòng chat')
+        parser.add_argument('--repair', action='store_true',
+                            help='Đưa các tin nhắn thiếu trên Firestore vào outbox để đồng bộ lại')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            rooms = ChatRoom.objects.order_by('id')
+        elif options['room_ids']:
+            rooms = ChatRoom.objects.filter(pk__in=options['room_ids']).order_by('id')
+        else:
+            raise CommandError('Vui lòng truyền id phòng chat hoặc --all')
+
+        diverged = 0
+        for room in rooms.iterator():
+            db_ids = set(room.messages.values_list('id', flat=True))
+            firestore_ids = set(get_message_ids(room.id))
+            missing = sorted(db_ids - {int(doc_id) for doc_id in firestore_ids if doc_id.isdigit()})
+            # Document không có trong DB (kể cả id tự sinh từ phiên bản cũ)
+            extra = sorted(doc_id for doc_id in firestore_ids if not doc_id.isdigit() or int(doc_id) not in db_ids)
+            if not missing and not extra:
+                continue
+
+            diverged += 1
+            self.stdout.write(f'Phòng {room.id}: thiếu trên Firestore {len(missing)}, thừa trên Firestore {len(extra)}')
+            if missing:
+                self.stdout.write(f'  thiếu: {missing[:20]}{" ..." if len(missing) > 20 else ""}')
+            if extra:
+                self.stdout.write(f'  thừa: {extra[:20]}{" ..." if len(extra) > 20 else ""}')
+
+            if options['repair'] and missing:
+                # Ghi lại cả tin nhắn mới nhất ở cuối để last_message của phòng không bị lùi về tin cũ
+                latest_id = max(db_ids)
+                message_ids = missing if missing[-1] == latest_id else missing + [latest_id]
+                with transaction.atomic():
+                    ChatOutbox.objects.bulk_create([
+                        ChatOutbox(chat_room=room, kind=ChatOutbox.Kind.MESSAGE, payload={'message_id': message_id})
+                        for message_id in message_ids
+                    ])
+                    enqueue_chat_replication(room.id)
+
+        self.stdout.write(self.style.SUCCESS(f'Có {diverged} phòng chat lệch giữa DB và Firestore.'))
@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from socialnetwork.models import ChatOutbox
+from socialnetwork.tasks import replicate_chat_room
+
+
+class Command(BaseCommand):
+    help = 'Đồng bộ các sự kiện chat còn tồn trong outbox lên Firestore (dùng khi worker/broker bị gián đoạn)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room', type=int, action='append', dest='rooms',
+                            help='Chỉ xử lý các phòng chat này (có thể lặp lại)')
+        parser.add_argument('--sync', action='store_true',
+                            help='Chạy trực tiếp trong process này thay vì đưa vào hàng đợi Celery')
+        parser.add_argument('--purge-days', type=int, default=None,
+                            help='Xóa các sự kiện đã đồng bộ cũ hơn số ngày này')
+
+    def handle(self, *args, **options):
+        pending = ChatOutbox.objects.filter(processed_date__isnull=True)
+        if options['rooms']:
+            pending = pending.filter(chat_room_id__in=options['rooms'])
+        room_ids = list(pending.order_by('chat_room_id').values_list('chat_room_id', flat=True).distinct())
+
+        for room_id in room_ids:
+            if options['sync']:
+                replicate_chat_room.apply(args=(room_id,), throw=True)
+            else:
+                replicate_chat_room.delay(room_id)
+        self.stdout.write(self.style.SUCCESS(f'Đã xử lý outbox của {len(room_ids)} phòng chat.'))
+
+        if options['purge_days'] is not None:
+            cutoff = timezone.now() - timedelta(days=options['purge_days'])
+            deleted, _ = ChatOutbox.objects.filter(processed_date__lt=cutoff).delete()
+            self.stdout.write(self.style.SUCCESS(f'Đã xóa {deleted} sự kiện đã đồng bộ.'))
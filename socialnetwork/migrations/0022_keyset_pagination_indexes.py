@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-18 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('socialnetwork', '0021_alter_user_avatar'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='group',
+            index=models.Index(fields=['active', 'created_date', 'id'], name='socialnetwo_active_a0f3b6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['active', 'created_date', 'id'], name='socialnetwo_active_e75223_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['date_joined', 'id'], name='socialnetwo_date_jo_5769cb_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2 on 2026-10-18 15:02
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_post_counters(apps, schema_editor):
+    Post = apps.get_model('socialnetwork', 'Post')
+    Comment = apps.get_model('socialnetwork', 'Comment')
+    Reaction = apps.get_model('socialnetwork', 'Reaction')
+
+    def count_subquery(queryset):
+        subquery = queryset.filter(post=OuterRef('pk')).order_by().values('post').annotate(total=Count('id')).values('total')
+        return Coalesce(Subquery(subquery), Value(0))
+
+    Post.objects.update(
+        comment_count=count_subquery(Comment.objects.filter(active=True)),
+        like_count=count_subquery(Reaction.objects.filter(active=True, reaction=1)),
+        haha_count=count_subquery(Reaction.objects.filter(active=True, reaction=2)),
+        love_count=count_subquery(Reaction.objects.filter(active=True, reaction=3)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0022_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='haha_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='love_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_post_counters, migrations.RunPython.noop),
+    ]
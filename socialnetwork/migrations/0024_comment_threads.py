@@ -0,0 +1,56 @@
+# Generated by Django 5.2 on 2026-10-18 15:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_comment_threads(apps, schema_editor):
+    Comment = apps.get_model('socialnetwork', 'Comment')
+    parents = dict(Comment.objects.values_list('id', 'parent_id'))
+
+    def find_root(comment_id):
+        root_id = comment_id
+        while parents.get(root_id):
+            root_id = parents[root_id]
+        return root_id
+
+    replies = []
+    reply_counts = {}
+    for comment in Comment.objects.filter(parent__isnull=False).only('id', 'active'):
+        comment.root_id = find_root(comment.id)
+        replies.append(comment)
+        if comment.active:
+            reply_counts[comment.root_id] = reply_counts.get(comment.root_id, 0) + 1
+    Comment.objects.bulk_update(replies, ['root'], batch_size=500)
+
+    roots = [Comment(id=root_id, reply_count=count) for root_id, count in reply_counts.items()]
+    Comment.objects.bulk_update(roots, ['reply_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0023_post_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='root',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='thread_replies', to='socialnetwork.comment'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'root', 'active', 'created_date', 'id'], name='socialnetwo_post_id_3a4b28_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['root', 'active', 'created_date', 'id'], name='socialnetwo_root_id_7dea08_idx'),
+        ),
+        migrations.RunPython(fill_comment_threads, migrations.RunPython.noop),
+    ]
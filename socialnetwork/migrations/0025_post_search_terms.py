@@ -0,0 +1,59 @@
+# Generated by Django 5.2 on 2026-10-18 15:06
+
+import re
+import unicodedata
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Bản sao cố định của tokenizer trong socialnetwork/search.py lúc viết migration,
+# để sửa code tìm kiếm sau này không làm thay đổi migration
+TOKEN_RE = re.compile(r'\w+')
+MAX_TERM_LENGTH = 64
+
+
+def build_terms(text):
+    text = (text or '').replace('đ', 'd').replace('Đ', 'D')
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if unicodedata.category(c) != 'Mn').casefold()
+    return Counter(token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(text))
+
+
+def fill_post_search_terms(apps, schema_editor):
+    Post = apps.get_model('socialnetwork', 'Post')
+    PostSearchTerm = apps.get_model('socialnetwork', 'PostSearchTerm')
+    terms = []
+    posts = Post.objects.filter(active=True).values_list('id', 'content', 'eventinvitepost__title')
+    for post_id, content, title in posts.iterator(chunk_size=500):
+        terms.extend(
+            PostSearchTerm(post_id=post_id, term=term, frequency=frequency)
+            for term, frequency in build_terms(f'{title or ""} {content}').items()
+        )
+        if len(terms) >= 500:
+            PostSearchTerm.objects.bulk_create(terms, ignore_conflicts=True)
+            terms = []
+    PostSearchTerm.objects.bulk_create(terms, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0024_comment_threads'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('frequency', models.PositiveIntegerField(default=1)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='socialnetwork.post')),
+            ],
+            options={
+                'unique_together': {('term', 'post')},
+            },
+        ),
+        migrations.RunPython(fill_post_search_terms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2 on 2026-10-18 15:07
+
+import re
+import unicodedata
+from collections import Counter
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Bản sao cố định của tokenizer trong socialnetwork/search.py lúc viết migration
+TOKEN_RE = re.compile(r'\w+')
+MAX_TERM_LENGTH = 64
+
+
+def build_terms(text):
+    text = (text or '').replace('đ', 'd').replace('Đ', 'D')
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if unicodedata.category(c) != 'Mn').casefold()
+    return Counter(token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(text))
+
+
+def fill_user_search_terms(apps, schema_editor):
+    User = apps.get_model('socialnetwork', 'User')
+    UserSearchTerm = apps.get_model('socialnetwork', 'UserSearchTerm')
+    terms = []
+    for user_id, first_name, last_name in User.objects.values_list('id', 'first_name', 'last_name').iterator(chunk_size=1000):
+        terms.extend(
+            UserSearchTerm(user_id=user_id, term=term, frequency=frequency)
+            for term, frequency in build_terms(f'{first_name} {last_name}').items()
+        )
+    UserSearchTerm.objects.bulk_create(terms, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0025_post_search_terms'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('frequency', models.PositiveIntegerField(default=1)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('term', 'user')},
+            },
+        ),
+        migrations.RunPython(fill_user_search_terms, migrations.RunPython.noop),
+    ]
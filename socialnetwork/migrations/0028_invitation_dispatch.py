@@ -0,0 +1,44 @@
+# Generated by Django 5.2 on 2026-10-18 15:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0027_email_delivery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvitationDispatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Chờ xử lý'), ('running', 'Đang gửi'), ('done', 'Hoàn tất'), ('partial', 'Có người nhận bị lỗi')], default='pending', max_length=10)),
+                ('total', models.IntegerField(default=0)),
+                ('sent_count', models.IntegerField(default=0)),
+                ('failed_count', models.IntegerField(default=0)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('updated_date', models.DateTimeField(auto_now=True)),
+                ('finished_date', models.DateTimeField(blank=True, null=True)),
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='dispatch', to='socialnetwork.eventinvitepost')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InvitationRecipient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Chờ gửi'), ('sent', 'Đã gửi'), ('failed', 'Lỗi')], default='pending', max_length=10)),
+                ('error', models.TextField(blank=True, default='')),
+                ('sent_date', models.DateTimeField(blank=True, null=True)),
+                ('dispatch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipients', to='socialnetwork.invitationdispatch')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='invitation_receipts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['dispatch', 'status', 'id'], name='socialnetwo_dispatc_f6b69d_idx')],
+                'unique_together': {('dispatch', 'user')},
+            },
+        ),
+    ]
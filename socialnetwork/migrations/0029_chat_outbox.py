@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-18 15:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0028_invitation_dispatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('create_room', 'Tạo phòng chat'), ('message', 'Tin nhắn mới'), ('mark_read', 'Đánh dấu đã đọc')], max_length=20)),
+                ('payload', models.JSONField(default=dict)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('processed_date', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('chat_room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbox', to='socialnetwork.chatroom')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['chat_room', 'processed_date', 'id'], name='socialnetwo_chat_ro_5e9230_idx'), models.Index(fields=['processed_date', 'id'], name='socialnetwo_process_7b93c1_idx')],
+            },
+        ),
+    ]
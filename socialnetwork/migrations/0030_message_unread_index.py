@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 15:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0029_chat_outbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat_room', 'is_read', 'sender'], name='socialnetwo_chat_ro_3a812c_idx'),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2 on 2026-10-18 15:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max, Q
+
+
+def fill_read_cursors(apps, schema_editor):
+    ChatRoom = apps.get_model('socialnetwork', 'ChatRoom')
+    ChatParticipant = apps.get_model('socialnetwork', 'ChatParticipant')
+    Message = apps.get_model('socialnetwork', 'Message')
+
+    participants = []
+    for room in ChatRoom.objects.order_by('id').iterator():
+        latest = Message.objects.filter(chat_room_id=room.pk).order_by('-id').first()
+        if latest is not None:
+            room.last_message_id = latest.pk
+            room.last_message_sender_id = latest.sender_id
+            room.save(update_fields=['last_message_id', 'last_message_sender'])
+
+        for user_id, other_id in ((room.user1_id, room.user2_id), (room.user2_id, room.user1_id)):
+            # Đã đọc tới tin nhắn mới nhất mà mình gửi hoặc tin nhắn đã đọc mới nhất của người kia
+            cursor = Message.objects.filter(chat_room_id=room.pk)\
+                .filter(Q(sender_id=user_id) | Q(sender_id=other_id, is_read=True))\
+                .aggregate(cursor=Max('id'))['cursor'] or 0
+            unread = Message.objects.filter(chat_room_id=room.pk, sender_id=other_id, id__gt=cursor).count()
+            participants.append(ChatParticipant(chat_room_id=room.pk, user_id=user_id,
+                                                last_read_message_id=cursor, unread_count=unread))
+        if len(participants) >= 1000:
+            ChatParticipant.objects.bulk_create(participants)
+            participants = []
+    ChatParticipant.objects.bulk_create(participants)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0030_message_unread_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatParticipant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.BigIntegerField(default=0)),
+                ('unread_count', models.IntegerField(default=0)),
+                ('updated_date', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='socialnetwo_chat_ro_3a812c_idx',
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_sender',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='chat_room',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participants', to='socialnetwork.chatroom'),
+        ),
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_participations', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='chatparticipant',
+            unique_together={('chat_room', 'user')},
+        ),
+        migrations.RunPython(fill_read_cursors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,107 @@
+# Generated by Django 5.2 on 2026-10-18 15:20
+
+import unicodedata
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def normalize(text):
+    # Bản sao cố định của socialnetwork.search.normalize lúc viết migration
+    text = (text or '').replace('đ', 'd').replace('Đ', 'D')
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in text if unicodedata.category(c) != 'Mn').casefold()
+
+FILL_FIELDS = ['other_user', 'other_username', 'other_first_name', 'other_last_name', 'other_avatar',
+               'other_search_name', 'last_message', 'last_message_time', 'last_message_id', 'last_message_sender']
+
+
+def fill_inbox(apps, schema_editor):
+    ChatParticipant = apps.get_model('socialnetwork', 'ChatParticipant')
+
+    participants = ChatParticipant.objects.select_related('chat_room__user1', 'chat_room__user2').order_by('id')
+    batch = []
+    for participant in participants.iterator(chunk_size=1000):
+        room = participant.chat_room
+        other = room.user2 if participant.user_id == room.user1_id else room.user1
+        participant.other_user_id = other.pk
+        participant.other_username = other.username
+        participant.other_first_name = other.first_name
+        participant.other_last_name = other.last_name
+        participant.other_avatar = other.avatar.url if other.avatar else None
+        participant.other_search_name = normalize(f'{other.first_name} {other.last_name} {other.username}')
+        participant.last_message = room.last_message
+        participant.last_message_time = room.last_message_time
+        participant.last_message_id = room.last_message_id
+        participant.last_message_sender_id = room.last_message_sender_id
+        batch.append(participant)
+        if len(batch) >= 1000:
+            ChatParticipant.objects.bulk_update(batch, FILL_FIELDS)
+            batch = []
+    ChatParticipant.objects.bulk_update(batch, FILL_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0031_chat_read_cursors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='last_message',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='last_message_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='last_message_sender',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='last_message_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='other_avatar',
+            field=models.CharField(blank=True, max_length=500, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='other_first_name',
+            field=models.CharField(blank=True, default='', max_length=150),
+        ),
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='other_last_name',
+            field=models.CharField(blank=True, default='', max_length=150),
+        ),
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='other_search_name',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='other_user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='other_username',
+            field=models.CharField(blank=True, default='', max_length=150),
+        ),
+        migrations.AddIndex(
+            model_name='chatparticipant',
+            index=models.Index(fields=['user', 'last_message_time', 'id'], name='socialnetwo_user_id_0aaa3e_idx'),
+        ),
+        migrations.RunPython(fill_inbox, migrations.RunPython.noop),
+    ]
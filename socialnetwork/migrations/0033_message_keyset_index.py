@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 15:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0032_chat_inbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat_room', 'id'], name='socialnetwo_chat_ro_925659_idx'),
+        ),
+    ]
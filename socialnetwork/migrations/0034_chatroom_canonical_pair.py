@@ -0,0 +1,84 @@
+# Generated by Django 5.2 on 2026-10-18 15:28
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def merge_duplicate_rooms(apps, schema_editor):
+    """
+    Gộp các phòng trùng cặp user (kể cả lưu ngược thứ tự) vào phòng có id nhỏ nhất,
+    rồi đổi thứ tự user1 < user2. Tin nhắn chuyển sang được đưa vào outbox để đồng bộ lại lên Firestore.
+    """
+    ChatRoom = apps.get_model('socialnetwork', 'ChatRoom')
+    ChatParticipant = apps.get_model('socialnetwork', 'ChatParticipant')
+    ChatOutbox = apps.get_model('socialnetwork', 'ChatOutbox')
+    Message = apps.get_model('socialnetwork', 'Message')
+
+    pairs = defaultdict(list)
+    for room_id, user1_id, user2_id in ChatRoom.objects.order_by('id').values_list('id', 'user1_id', 'user2_id'):
+        pairs[(min(user1_id, user2_id), max(user1_id, user2_id))].append((room_id, user1_id))
+
+    for (user1_id, user2_id), rooms in pairs.items():
+        room_ids = [room_id for room_id, _ in rooms]
+        keeper_id, duplicate_ids = room_ids[0], room_ids[1:]
+        if duplicate_ids:
+            cursors = dict(ChatParticipant.objects.filter(chat_room_id__in=room_ids).values('user_id')
+                           .annotate(cursor=Max('last_read_message_id')).values_list('user_id', 'cursor'))
+            moved_ids = list(Message.objects.filter(chat_room_id__in=duplicate_ids).values_list('id', flat=True))
+            Message.objects.filter(pk__in=moved_ids).update(chat_room_id=keeper_id)
+            # User chưa có dòng hộp thư ở phòng giữ lại thì chuyển dòng của phòng trùng sang, không để mất khi xóa phòng
+            kept_user_ids = set(ChatParticipant.objects.filter(chat_room_id=keeper_id).values_list('user_id', flat=True))
+            for participant in ChatParticipant.objects.filter(chat_room_id__in=duplicate_ids).order_by('id'):
+                if participant.user_id not in kept_user_ids:
+                    ChatParticipant.objects.filter(pk=participant.pk).update(chat_room_id=keeper_id)
+                    kept_user_ids.add(participant.user_id)
+            ChatRoom.objects.filter(pk__in=duplicate_ids).delete()
+
+            keeper = ChatRoom.objects.get(pk=keeper_id)
+            latest = Message.objects.filter(chat_room_id=keeper_id).order_by('-id').first()
+            if latest is not None:
+                keeper.last_message = latest.content
+                keeper.last_message_time = latest.created_date
+                keeper.last_message_id = latest.pk
+                keeper.last_message_sender_id = latest.sender_id
+                keeper.save(update_fields=['last_message', 'last_message_time', 'last_message_id',
+                                           'last_message_sender'])
+            for participant in ChatParticipant.objects.filter(chat_room_id=keeper_id):
+                participant.last_read_message_id = cursors.get(participant.user_id, 0)
+                participant.unread_count = Message.objects.filter(
+                    chat_room_id=keeper_id, id__gt=participant.last_read_message_id,
+                ).exclude(sender_id=participant.user_id).count()
+                participant.last_message = keeper.last_message
+                participant.last_message_time = keeper.last_message_time
+                participant.last_message_id = keeper.last_message_id
+                participant.last_message_sender_id = keeper.last_message_sender_id
+                participant.save()
+
+            ChatOutbox.objects.bulk_create(
+                [ChatOutbox(chat_room_id=keeper_id, kind='message', payload={'message_id': message_id})
+                 for message_id in sorted(moved_ids)] +
+                [ChatOutbox(chat_room_id=keeper_id, kind='mark_read',
+                            payload={'user_id': user_id, 'last_read_message_id': cursor})
+                 for user_id, cursor in cursors.items()],
+                batch_size=1000,
+            )
+
+        if rooms[0][1] != user1_id:
+            ChatRoom.objects.filter(pk=keeper_id).update(user1_id=user1_id, user2_id=user2_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0033_message_keyset_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_rooms, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.CheckConstraint(condition=models.Q(('user1__lt', models.F('user2'))), name='chatroom_user1_lt_user2'),
+        ),
+    ]
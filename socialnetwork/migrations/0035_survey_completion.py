@@ -0,0 +1,40 @@
+# Generated by Django 5.2 on 2026-10-18 15:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_survey_completions(apps, schema_editor):
+    UserSurveyOption = apps.get_model('socialnetwork', 'UserSurveyOption')
+    SurveyCompletion = apps.get_model('socialnetwork', 'SurveyCompletion')
+
+    pairs = UserSurveyOption.objects.values_list('user_id', 'survey_option__survey_question__survey_post_id')\
+        .order_by().distinct()
+    SurveyCompletion.objects.bulk_create(
+        [SurveyCompletion(user_id=user_id, survey_post_id=survey_post_id) for user_id, survey_post_id in pairs],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0034_chatroom_canonical_pair'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SurveyCompletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('completed_date', models.DateTimeField(auto_now_add=True)),
+                ('survey_post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='completions', to='socialnetwork.surveypost')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='survey_completions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'survey_post')},
+            },
+        ),
+        migrations.RunPython(fill_survey_completions, migrations.RunPython.noop),
+    ]
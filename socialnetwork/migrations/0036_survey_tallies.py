@@ -0,0 +1,41 @@
+# Generated by Django 5.2 on 2026-10-18 15:30
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_survey_tallies(apps, schema_editor):
+    SurveyOption = apps.get_model('socialnetwork', 'SurveyOption')
+    SurveyPost = apps.get_model('socialnetwork', 'SurveyPost')
+    UserSurveyOption = apps.get_model('socialnetwork', 'UserSurveyOption')
+    SurveyCompletion = apps.get_model('socialnetwork', 'SurveyCompletion')
+
+    def count_subquery(model, field):
+        subquery = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field)\
+            .annotate(total=Count('id')).values('total')
+        return Coalesce(Subquery(subquery), Value(0))
+
+    SurveyOption.objects.update(response_count=count_subquery(UserSurveyOption, 'survey_option'))
+    SurveyPost.objects.update(respondent_count=count_subquery(SurveyCompletion, 'survey_post'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0035_survey_completion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='surveyoption',
+            name='response_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='surveypost',
+            name='respondent_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_survey_tallies, migrations.RunPython.noop),
+    ]
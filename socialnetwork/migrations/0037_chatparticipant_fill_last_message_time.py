@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-18 16:10
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce, Now
+
+
+def fill_last_message_time(apps, schema_editor):
+    # Phòng chưa có tin nhắn: lấy thời điểm tạo phòng để hộp thư phân trang keyset không bỏ sót dòng NULL
+    ChatParticipant = apps.get_model('socialnetwork', 'ChatParticipant')
+    ChatRoom = apps.get_model('socialnetwork', 'ChatRoom')
+    created_date = ChatRoom.objects.filter(pk=OuterRef('chat_room_id')).values('created_date')[:1]
+    ChatParticipant.objects.filter(last_message_time__isnull=True)\
+        .update(last_message_time=Coalesce(Subquery(created_date), Now()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0036_survey_tallies'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_last_message_time, migrations.RunPython.noop),
+    ]
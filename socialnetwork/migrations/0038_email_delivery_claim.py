@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 16:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0037_chatparticipant_fill_last_message_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emaildelivery',
+            name='claim_token',
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='emaildelivery',
+            name='claimed_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from sys import maxsize
 
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import F, FilteredRelation, Q
+from django.db.models.functions import Greatest
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from cloudinary.models import CloudinaryField
@@ -22,6 +24,10 @@ class User(AbstractUser):
     email = models.EmailField(unique=True,null=False,max_length=255)
     class Meta:
         ordering=['id']
+        indexes = [
+            # Phục vụ phân trang keyset theo (date_joined, id)
+            models.Index(fields=['date_joined', 'id']),
+        ]
 
     def soft_delete(self, using=None, keep_parents=False):
         self.is_active = False
@@ -67,10 +73,36 @@ class Teacher(BaseModel):
     def __str__(self):
         return str(self.user)
 
+class PostQuerySet(models.QuerySet):
+    def with_subtype(self):
+        """Join sẵn bảng con SurveyPost/EventInvitePost để biết loại bài viết (và end_time, title) trong cùng 1 câu SQL"""
+        return self.select_related('surveypost', 'eventinvitepost').annotate(
+            object_type=models.Case(
+                models.When(surveypost__isnull=False, then=models.Value('survey')),
+                models.When(eventinvitepost__isnull=False, then=models.Value('invitation')),
+                default=models.Value('post'),
+                output_field=models.CharField(),
+            )
+        )
+
+
 class Post(BaseModel):
     content=models.TextField()
     lock_comment=models.BooleanField(default=False)
     user=models.ForeignKey(User,on_delete=models.CASCADE,null=False)
+    # Bộ đếm phi chuẩn hóa, cập nhật cùng lúc với comment/reaction (rebuild: manage.py rebuild_post_counters)
+    comment_count=models.IntegerField(default=0)
+    like_count=models.IntegerField(default=0)
+    haha_count=models.IntegerField(default=0)
+    love_count=models.IntegerField(default=0)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta(BaseModel.Meta):
+        indexes = [
+            # Phục vụ phân trang keyset của feed theo (created_date, id)
+            models.Index(fields=['active', 'created_date', 'id']),
+        ]
 
     def __str__(self):
         return self.content
@@ -78,6 +110,89 @@ class Post(BaseModel):
     def can_user_comment(self):
         return not self.lock_comment
 
+    @classmethod
+    def update_counters(cls, post_id, **deltas):
+        """Cộng/trừ bộ đếm bằng 1 câu UPDATE với F() nên an toàn khi nhiều request cùng lúc"""
+        cls.objects.filter(pk=post_id).update(**{
+            field: Greatest(F(field) + delta, 0) for field, delta in deltas.items()
+        })
+
+    @staticmethod
+    def reaction_counter_field(reaction):
+        # LIKE -> like_count, HAHA -> haha_count, LOVE -> love_count
+        return f'{ReactionType(int(reaction)).name.lower()}_count'
+
+    def get_subtype(self):
+        """Trả về instance con (SurveyPost/EventInvitePost) hoặc None nếu là bài viết thường"""
+        if isinstance(self, (SurveyPost, EventInvitePost)):
+            return self
+        object_type = self.__dict__.get('object_type')
+        if object_type == 'post':
+            return None
+        # Nếu đã select_related thì hasattr đọc từ cache, không phát sinh query
+        for related_name in ('surveypost', 'eventinvitepost'):
+            if hasattr(self, related_name):
+                return getattr(self, related_name)
+        return None
+
+    def get_object_type(self):
+        object_type = self.__dict__.get('object_type')
+        if object_type:
+            return object_type
+        subtype = self.get_subtype()
+        if isinstance(subtype, SurveyPost):
+            return 'survey'
+        if isinstance(subtype, EventInvitePost):
+            return 'invitation'
+        return 'post'
+
+
+class EmailEvent(models.TextChoices):
+    ACCOUNT_VERIFIED = 'account_verified', 'Tài khoản đã được xác thực'
+    TEACHER_ACCOUNT_CREATED = 'teacher_account_created', 'Cấp tài khoản giảng viên'
+
+
+class EmailDelivery(models.Model):
+    """Mỗi (user, event) chỉ gửi email 1 lần, kể cả khi task bị retry hoặc enqueue lặp"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='email_deliveries')
+    event = models.CharField(max_length=50, choices=EmailEvent.choices)
+    created_date = models.DateTimeField(auto_now_add=True)
+    sent_date = models.DateTimeField(null=True, blank=True)
+    # Task đang gửi dòng này (claim_token) và từ lúc nào; claim quá hạn thì task khác được nhận lại
+    claim_token = models.UUIDField(null=True, blank=True, db_index=True)
+    claimed_date = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('user', 'event')
+
+    def __str__(self):
+        return f"{self.event} -> {self.user_id}"
+
+
+class SearchTerm(models.Model):
+    """1 dòng của chỉ mục đảo: từ đã chuẩn hóa (không dấu, chữ thường) và số lần xuất hiện"""
+    term = models.CharField(max_length=64)
+    frequency = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        abstract = True
+
+
+class PostSearchTerm(SearchTerm):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='search_terms')
+
+    class Meta:
+        # Index (term, post) phục vụ cả tìm chính xác lẫn tìm theo tiền tố
+        unique_together = ('term', 'post')
+
+
+class UserSearchTerm(SearchTerm):
+    """Chỉ mục họ tên người dùng, đồng bộ khi lưu User"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='search_terms')
+
+    class Meta:
+        unique_together = ('term', 'user')
+
 
 class PostImage(models.Model):
     image = CloudinaryField('Post Image', null=True, blank=True, folder='socialnetwork')
@@ -97,6 +212,119 @@ class SurveyType(IntEnum):
 class SurveyPost(Post):
     end_time=models.DateTimeField()
     survey_type=models.IntegerField(choices=SurveyType.choices(),default=SurveyType.TRAINING_PROGRAM.value)
+    # Số người đã nộp, cập nhật cùng transaction với submit (rebuild: manage.py rebuild_survey_tallies)
+    respondent_count=models.IntegerField(default=0)
+
+    @property
+    def cache_version(self):
+        """Phiên bản nội dung khảo sát (đổi mỗi lần sửa) để làm key cache"""
+        return int(self.updated_date.timestamp() * 1_000_000) if self.updated_date else 0
+
+    @staticmethod
+    def _sync_id(data, name):
+        # id gửi lên dạng form/JSON có thể là chuỗi; không có id nghĩa là thêm mới
+        value = data.get('id')
+        if value is None or value == '':
+            return None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ValidationError(f"Invalid {name} id: {value!r}.")
+
+    def sync_questions(self, questions_data):
+        """
+        Đồng bộ câu hỏi/lựa chọn theo dữ liệu gửi lên, so khớp theo id: có id thì sửa tại chỗ (giữ câu trả lời đã chọn),
+        không id thì thêm mới, id không còn trong dữ liệu thì xóa. Ghi bằng bulk_create/bulk_update trong 1 transaction.
+        id không thuộc khảo sát (hoặc lựa chọn không thuộc câu hỏi đó) -> ValidationError.
+        """
+        questions = {question.id: question for question in self.questions.all()}
+        options = {option.id: option for option in SurveyOption.objects.filter(survey_question__survey_post=self)}
+
+        kept_question_ids, kept_option_ids = set(), set()
+        new_questions, changed_questions, changed_options = [], [], []
+        pending_options = []  # (câu hỏi, dữ liệu lựa chọn mới), câu hỏi mới chưa có id
+        for question_data in questions_data:
+            question_id = self._sync_id(question_data, 'question')
+            if question_id is not None and question_id not in questions:
+                raise ValidationError(f"Question {question_id} does not belong to this survey.")
+            question = questions.get(question_id)
+            text, multi_choice = question_data.get('question', ''), bool(question_data.get('multi_choice', False))
+            if question is None:
+                question = SurveyQuestion(survey_post=self, question=text, multi_choice=multi_choice)
+                new_questions.append(question)
+            else:
+                kept_question_ids.add(question.id)
+                if (question.question, question.multi_choice) != (text, multi_choice):
+                    question.question, question.multi_choice = text, multi_choice
+                    changed_questions.append(question)
+
+            for option_data in question_data.get('options', []):
+                option_id = self._sync_id(option_data, 'option')
+                if option_id is None:
+                    pending_options.append((question, option_data.get('option', '')))
+                    continue
+                option = options.get(option_id)
+                # Lựa chọn chỉ được giữ id trong đúng câu hỏi cũ của nó
+                if option is None or option.survey_question_id != question.id:
+                    raise ValidationError(f"Option {option_id} does not belong to this question.")
+                kept_option_ids.add(option.id)
+                if option.option != option_data.get('option', option.option):
+                    option.option = option_data['option']
+                    changed_options.append(option)
+
+        removed_option_ids = options.keys() - kept_option_ids
+        with transaction.atomic():
+            # Người đã chọn lựa chọn sắp xóa: nếu không còn câu trả lời nào khác thì không còn tính là đã nộp
+            affected_user_ids = set(UserSurveyOption.objects.filter(survey_option_id__in=removed_option_ids)
+                                    .values_list('user_id', flat=True))
+            # Xóa câu hỏi/lựa chọn bị bỏ (kèm câu trả lời của chúng)
+            SurveyOption.objects.filter(pk__in=removed_option_ids).delete()
+            SurveyQuestion.objects.filter(pk__in=questions.keys() - kept_question_ids).delete()
+            if affected_user_ids:
+                self._drop_empty_completions(affected_user_ids)
+            SurveyQuestion.objects.bulk_update(changed_questions, ['question', 'multi_choice'])
+            SurveyOption.objects.bulk_update(changed_options, ['option'])
+            if connection.features.can_return_rows_from_bulk_insert:
+                SurveyQuestion.objects.bulk_create(new_questions)
+            else:
+                # MySQL không trả về id sau bulk_create mà lựa chọn mới cần id câu hỏi
+                for question in new_questions:
+                    question.save()
+            SurveyOption.objects.bulk_create([
+                SurveyOption(survey_question=question, option=text) for question, text in pending_options
+            ])
+
+    def _drop_empty_completions(self, user_ids):
+        """Bỏ đánh dấu đã nộp của các user không còn câu trả lời nào trong khảo sát và trừ respondent_count tương ứng"""
+        answered = UserSurveyOption.objects.filter(user_id__in=user_ids,
+                                                   survey_option__survey_question__survey_post=self)
+        _, deleted = SurveyCompletion.objects.filter(survey_post=self, user_id__in=user_ids)\
+            .exclude(user_id__in=answered.values('user_id')).delete()
+        removed = deleted.get(SurveyCompletion._meta.label, 0)
+        if removed:
+            SurveyPost.objects.filter(pk=self.pk).update(respondent_count=Greatest(F('respondent_count') - removed, 0))
+            self.refresh_from_db(fields=['respondent_count'])
+
+    def results(self):
+        """Kết quả khảo sát theo từng câu hỏi, đọc từ bộ đếm của SurveyOption trong 1 câu truy vấn"""
+        questions = {}
+        options = SurveyOption.objects.filter(survey_question__survey_post=self)\
+            .select_related('survey_question').order_by('survey_question_id', 'id')
+        for option in options:
+            question = option.survey_question
+            if question.id not in questions:
+                questions[question.id] = {
+                    'id': question.id,
+                    'question': question.question,
+                    'multi_choice': question.multi_choice,
+                    'options': [],
+                }
+            questions[question.id]['options'].append({
+                'id': option.id,
+                'text': option.option,
+                'count': option.response_count,
+            })
+        return list(questions.values())
 
 
 class SurveyQuestion(models.Model):
@@ -115,6 +343,8 @@ class SurveyQuestion(models.Model):
 
 class SurveyOption(models.Model):
     option = models.TextField()
+    # Số lượt chọn, cập nhật cùng transaction với submit (rebuild: manage.py rebuild_survey_tallies)
+    response_count = models.IntegerField(default=0)
 
     survey_question = models.ForeignKey(SurveyQuestion, on_delete=models.CASCADE, related_name='options')
 
@@ -130,6 +360,16 @@ class UserSurveyOption(models.Model):
         unique_together = ('user', 'survey_option')
 
 
+class SurveyCompletion(models.Model):
+    """Đánh dấu user đã nộp khảo sát: kiểm tra hoàn thành chỉ cần 1 lần dò unique index, chặn nộp 2 lần đồng thời"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='survey_completions')
+    survey_post = models.ForeignKey(SurveyPost, on_delete=models.CASCADE, related_name='completions')
+    completed_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'survey_post')
+
+
 class SurveyDraft(models.Model):
     survey_post = models.ForeignKey(SurveyPost, on_delete=models.CASCADE, related_name='drafts')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='drafts')
@@ -144,6 +384,11 @@ class Group(BaseModel):
     group_name = models.CharField(max_length=255, unique=True)
     users = models.ManyToManyField(User, blank=True, related_name='my_groups')
 
+    class Meta(BaseModel.Meta):
+        indexes = [
+            models.Index(fields=['active', 'created_date', 'id']),
+        ]
+
     def __str__(self):
         return self.group_name
 
@@ -181,10 +426,24 @@ class Comment(Interaction):
     image = CloudinaryField('Comment Image', null=True, blank=True, folder='MangXaHoi')
 
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE)
+    # Bình luận gốc của thread (null nếu chính nó là bình luận gốc) để lấy cả thread bằng 1 query
+    root = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='thread_replies')
+    # Số phản hồi đang active trong thread, chỉ dùng cho bình luận gốc
+    reply_count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'root', 'active', 'created_date', 'id']),
+            models.Index(fields=['root', 'active', 'created_date', 'id']),
+        ]
 
     def get_replies(self):
         return Comment.objects.filter(parent=self).order_by("created_date")
 
+    @property
+    def thread_root_id(self):
+        return self.root_id or self.id
+
 
 
 class EventInvitePost(Post):
@@ -196,25 +455,211 @@ class EventInvitePost(Post):
     def __str__(self):
         return self.title
 
+class InvitationDispatch(models.Model):
+    """Tiến trình gửi email mời cho 1 bài đăng sự kiện, chạy nền bằng Celery"""
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Chờ xử lý'
+        RUNNING = 'running', 'Đang gửi'
+        DONE = 'done', 'Hoàn tất'
+        PARTIAL = 'partial', 'Có người nhận bị lỗi'
+
+    post = models.OneToOneField(EventInvitePost, on_delete=models.CASCADE, related_name='dispatch')
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    total = models.IntegerField(default=0)
+    sent_count = models.IntegerField(default=0)
+    failed_count = models.IntegerField(default=0)
+    created_date = models.DateTimeField(auto_now_add=True)
+    updated_date = models.DateTimeField(auto_now=True)
+    finished_date = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Dispatch {self.id} ({self.status})"
+
+
+class InvitationRecipient(models.Model):
+    """Trạng thái gửi của từng người nhận, dùng để tiếp tục gửi lại các người nhận bị lỗi"""
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Chờ gửi'
+        SENT = 'sent', 'Đã gửi'
+        FAILED = 'failed', 'Lỗi'
+
+    dispatch = models.ForeignKey(InvitationDispatch, on_delete=models.CASCADE, related_name='recipients')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='invitation_receipts')
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    error = models.TextField(blank=True, default='')
+    sent_date = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('dispatch', 'user')
+        indexes = [
+            models.Index(fields=['dispatch', 'status', 'id']),
+        ]
+
+
+class ChatRoomQuerySet(models.QuerySet):
+    def with_read_state(self, user):
+        """Join con trỏ đã đọc của user trong từng phòng (my_last_read_message_id, my_unread_count) trong cùng 1 câu SQL"""
+        return self.annotate(
+            my_participant=FilteredRelation('participants', condition=Q(participants__user=user)),
+        ).annotate(
+            my_last_read_message_id=F('my_participant__last_read_message_id'),
+            my_unread_count=F('my_participant__unread_count'),
+        )
+
+    def between(self, user_a, user_b):
+        """Phòng chat của 2 user: 1 lần dò unique index (user1, user2) vì phòng luôn lưu user1 < user2"""
+        return self.filter(**ChatRoom.ordered_users(user_a, user_b))
+
+
 class ChatRoom(BaseModel):
     user1 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_rooms_as_user1')
     user2 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_rooms_as_user2')
     last_message = models.TextField(null=True, blank=True)
     last_message_time = models.DateTimeField(null=True, blank=True)
+    # Id và người gửi tin nhắn cuối, để so với con trỏ đã đọc của từng người mà không cần truy vấn Message
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    last_message_sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    objects = ChatRoomQuerySet.as_manager()
     
     def __str__(self):
         return f"Chat Room {self.id}"
 
+    @staticmethod
+    def ordered_users(user_a, user_b):
+        """Cặp user của phòng theo thứ tự chuẩn (id nhỏ là user1) để mỗi cặp chỉ có 1 phòng"""
+        user1, user2 = sorted((user_a, user_b), key=lambda user: user.pk)
+        return {'user1': user1, 'user2': user2}
+
+    def read_state_for(self, user):
+        """(last_read_message_id, unread_count) của user trong phòng; dùng annotate của with_read_state nếu có"""
+        if hasattr(self, 'my_unread_count'):
+            return self.my_last_read_message_id or 0, self.my_unread_count or 0
+        participant = self.participants.filter(user=user).first()
+        if participant is None:
+            return 0, 0
+        return participant.last_read_message_id, participant.unread_count
+
+    def is_read_by(self, user):
+        if self.last_message_id is None or self.last_message_sender_id == user.id:
+            return True
+        last_read_message_id, _ = self.read_state_for(user)
+        return last_read_message_id >= self.last_message_id
+
     class Meta:
         unique_together = ('user1', 'user2')
+        constraints = [
+            models.CheckConstraint(condition=Q(user1__lt=F('user2')), name='chatroom_user1_lt_user2'),
+        ]
 
 class Message(BaseModel):
     chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     content = models.TextField()
+    # Không còn cập nhật khi đọc, trạng thái đã đọc lấy theo ChatParticipant.last_read_message_id
     is_read = models.BooleanField(default=False)
+
+    class Meta(BaseModel.Meta):
+        indexes = [
+            # Phân trang lịch sử tin nhắn: WHERE chat_room = ? AND id < ? ORDER BY id DESC
+            models.Index(fields=['chat_room', 'id']),
+        ]
     
     def __str__(self):
         return f"Message from {self.sender.username} in Room {self.chat_room.id}"
 
 
+class ChatParticipant(models.Model):
+    """
+    Hộp thư chat của 1 user: mỗi (user, phòng) 1 dòng, chứa sẵn thông tin hiển thị của người còn lại và tin nhắn cuối,
+    để danh sách phòng chat chỉ cần đọc bảng này theo index (user, last_message_time).
+    Con trỏ đã đọc: tin nhắn có id <= last_read_message_id là đã đọc.
+    last_message_time luôn có giá trị (phòng chưa có tin nhắn lấy thời điểm tạo phòng) để phân trang keyset.
+    """
+    chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='participants')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_participations')
+    last_read_message_id = models.BigIntegerField(default=0)
+    unread_count = models.IntegerField(default=0)
+    updated_date = models.DateTimeField(auto_now=True)
+
+    # Người còn lại trong phòng (sao chép để không phải join User)
+    other_user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, related_name='+')
+    other_username = models.CharField(max_length=150, blank=True, default='')
+    other_first_name = models.CharField(max_length=150, blank=True, default='')
+    other_last_name = models.CharField(max_length=150, blank=True, default='')
+    other_avatar = models.CharField(max_length=500, null=True, blank=True)
+    # Họ tên + username của người còn lại đã chuẩn hóa (không dấu, chữ thường) để tìm kiếm
+    other_search_name = models.CharField(max_length=500, blank=True, default='')
+
+    # Tin nhắn cuối của phòng
+    last_message = models.TextField(null=True, blank=True)
+    last_message_time = models.DateTimeField(null=True, blank=True)
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    last_message_sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        unique_together = ('chat_room', 'user')
+        indexes = [
+            models.Index(fields=['user', 'last_message_time', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} in Room {self.chat_room_id}"
+
+    @staticmethod
+    def other_user_fields(other_user):
+        """Các trường hiển thị của người còn lại, dùng khi tạo phòng và khi người đó đổi thông tin"""
+        from .search import normalize
+
+        # Instance vừa gán ảnh có thể đang giữ chuỗi public id thay vì CloudinaryResource
+        avatar = User._meta.get_field('avatar').to_python(other_user.avatar)
+        return {
+            'other_username': other_user.username,
+            'other_first_name': other_user.first_name,
+            'other_last_name': other_user.last_name,
+            'other_avatar': avatar.url if avatar else None,
+            'other_search_name': normalize(f'{other_user.first_name} {other_user.last_name} {other_user.username}'),
+        }
+
+    @classmethod
+    def build(cls, chat_room, user, other_user):
+        return cls(chat_room=chat_room, user=user, other_user=other_user,
+                   last_message_time=chat_room.last_message_time or chat_room.created_date,
+                   **cls.other_user_fields(other_user))
+
+    @property
+    def is_read(self):
+        if self.last_message_id is None or self.last_message_sender_id == self.user_id:
+            return True
+        return self.last_read_message_id >= self.last_message_id
+
+
+class ChatOutbox(models.Model):
+    """
+    Sự kiện chat cần đồng bộ lên Firestore, ghi cùng transaction với ChatRoom/Message.
+    Worker xử lý theo thứ tự id trong từng phòng rồi đánh dấu processed_date.
+    """
+
+    class Kind(models.TextChoices):
+        CREATE_ROOM = 'create_room', 'Tạo phòng chat'
+        MESSAGE = 'message', 'Tin nhắn mới'
+        MARK_READ = 'mark_read', 'Đánh dấu đã đọc'
+
+    chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='outbox')
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    payload = models.JSONField(default=dict)
+    created_date = models.DateTimeField(auto_now_add=True)
+    processed_date = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['chat_room', 'processed_date', 'id']),
+            models.Index(fields=['processed_date', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} (room {self.chat_room_id})"
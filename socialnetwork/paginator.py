@@ -1,24 +1,228 @@
+import base64
+import json
 
+from django.db import models
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
-from rest_framework.pagination import PageNumberPagination
 
-class UserPagination(PageNumberPagination):
+class KeysetPagination(BasePagination):
+    """
+    Phân trang theo con trỏ (keyset) trên bộ khóa ordering, vd ('-created_date', '-id').
+    Không dùng OFFSET và chỉ đếm tổng khi client gửi ?count=true.
+    Dòng có giá trị NULL ở trường ordering bị loại ra vì so sánh tuple không thể đi qua chúng.
+    """
+    page_size = 10
+    ordering = ('-created_date', '-id')
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Cursor không hợp lệ.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.count = None
+        if str(request.query_params.get(self.count_query_param, '')).lower() in ('1', 'true'):
+            self.count = queryset.count()
+
+        model_fields = [queryset.model._meta.get_field(field.lstrip('-')) for field in self.ordering]
+        queryset = queryset.filter(**{f'{f.name}__isnull': False for f in model_fields if f.null})
+        queryset = queryset.order_by(*self.ordering)
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            queryset = queryset.filter(self.get_cursor_filter(self.decode_cursor(encoded, model_fields)))
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_cursor_filter(self, values):
+        # (a, b) < (va, vb)  <=>  a < va OR (a = va AND b < vb)
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def encode_cursor(self, instance):
+        values = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip('-'))
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, encoded, model_fields):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return [self.decode_value(field, value) for field, value in zip(model_fields, values)]
+
+    def decode_value(self, field, value):
+        """Kiểm tra kiểu từng giá trị trong cursor theo trường model tương ứng"""
+        if isinstance(field, models.DateTimeField):
+            # Giá trị datetime được lưu dạng ISO trong cursor
+            try:
+                parsed = parse_datetime(value) if isinstance(value, str) else None
+            except ValueError:
+                parsed = None
+            if parsed is None:
+                raise NotFound(self.invalid_cursor_message)
+            return parsed
+        if isinstance(field, (models.IntegerField, models.AutoField)):
+            if not isinstance(value, int) or isinstance(value, bool):
+                raise NotFound(self.invalid_cursor_message)
+            return value
+        if not isinstance(value, str):
+            raise NotFound(self.invalid_cursor_message)
+        return value
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        response = {'next': self.get_next_link(), 'previous': None, 'results': data}
+        if self.count is not None:
+            response = {'count': self.count, **response}
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer'},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class KeysetModeMixin:
+    """
+    Cho phép class PageNumberPagination chuyển sang chế độ keyset khi request có ?cursor=
+    (?cursor= rỗng là trang đầu tiên). Không có cursor, hoặc khi đang tìm kiếm (?q=, xếp theo độ liên quan),
+    thì vẫn phân trang theo số trang như cũ.
+    """
+    keyset_ordering = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        # Kết quả tìm kiếm xếp theo độ liên quan (search_rank) nên không phân trang keyset theo ngày được
+        ranked = 'search_rank' in queryset.query.annotations
+        if self.keyset_ordering and not ranked and KeysetPagination.cursor_query_param in request.query_params:
+            self.keyset = KeysetPagination()
+            self.keyset.page_size = self.page_size
+            self.keyset.ordering = self.keyset_ordering
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_next_link(self):
+        if getattr(self, 'keyset', None) is not None:
+            return self.keyset.get_next_link()
+        return super().get_next_link()
+
+
+class UserPagination(KeysetModeMixin, PageNumberPagination):
     page_size = 9
+    keyset_ordering = ('-date_joined', '-id')
 
 class OptionUserPagination(PageNumberPagination):
     page_size = 7
 
-class PostPagination(PageNumberPagination):
+class PostPagination(KeysetModeMixin, PageNumberPagination):
     page_size = 5
+    keyset_ordering = ('-created_date', '-id')
 
 class CommentPagination(PageNumberPagination):
     page_size = 5
 
-class GroupPagination(PageNumberPagination):
+class GroupPagination(KeysetModeMixin, PageNumberPagination):
     page_size = 6
+    keyset_ordering = ('-created_date', '-id')
 
-class MessagePagination(PageNumberPagination):
+class MessagePagination(BasePagination):
+    """
+    Phân trang tin nhắn theo id giảm dần: ?before_id=<id> lấy các tin nhắn cũ hơn id đó.
+    Dùng index (chat_room, id), không đếm tổng; next_before là id để lấy trang tiếp theo.
+    """
     page_size = 8
+    before_query_param = 'before_id'
+    invalid_cursor_message = 'before_id không hợp lệ.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        queryset = queryset.order_by('-id')
+        before_id = request.query_params.get(self.before_query_param)
+        if before_id:
+            try:
+                queryset = queryset.filter(id__lt=int(before_id))
+            except ValueError:
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_next_before(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.page[-1].id
+
+    def get_next_link(self):
+        next_before = self.get_next_before()
+        if next_before is None:
+            return None
+        return replace_query_param(self.base_url, self.before_query_param, next_before)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next_before': self.get_next_before(),
+            'next': self.get_next_link(),
+            'previous': None,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next_before': {'type': 'integer', 'nullable': True},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+class ChatRoomPagination(KeysetPagination):
+    """Hộp thư chat theo thời điểm hoạt động gần nhất, phòng chưa có tin nhắn xếp theo thời điểm tạo phòng"""
+    page_size = 8
+    ordering = ('-last_message_time', '-id')
+
+class CommentThreadPagination(KeysetPagination):
+    page_size = 5
+    ordering = ('created_date', 'id')
 
-class ChatRoomPagination(PageNumberPagination):
-    page_size = 8
\ No newline at end of file
+class CommentReplyPagination(KeysetPagination):
+    page_size = 10
+    ordering = ('created_date', 'id')
@@ -0,0 +1,198 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+logger = logging.getLogger(__name__)
+
+FEED_CHANNEL = 'feed'
+# Số sự kiện tối đa chờ gửi cho 1 client, client đọc quá chậm sẽ bị bỏ bớt sự kiện
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+class InMemoryBroker:
+    """
+    Broker trong process, dùng cho triển khai 1 node và cho test.
+    publish có thể gọi từ bất kỳ thread nào (view sync, on_commit), sự kiện được đẩy vào event loop của subscriber.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._put, queue, event)
+
+    @staticmethod
+    def _put(queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    async def subscribe(self, channels, heartbeat):
+        """Async iterator các sự kiện của channels; trả về None khi không có sự kiện sau heartbeat giây"""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE))
+        with self._lock:
+            for channel in channels:
+                self._subscribers[channel].add(subscriber)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscriber[1].get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                for channel in channels:
+                    self._subscribers[channel].discard(subscriber)
+                    if not self._subscribers[channel]:
+                        del self._subscribers[channel]
+
+
+class RedisBroker:
+    """Broker qua Redis pub/sub cho triển khai nhiều node (REALTIME_BROKER = 'socialnetwork.realtime.RedisBroker')"""
+    prefix = 'realtime:'
+
+    def __init__(self, url=None):
+        self.url = url or getattr(settings, 'REALTIME_REDIS_URL', 'redis://localhost:6379/2')
+        self._client = None
+
+    def publish(self, channel, event):
+        import redis
+
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url)
+        self._client.publish(self.prefix + channel, json.dumps(event, cls=DjangoJSONEncoder))
+
+    async def subscribe(self, channels, heartbeat):
+        import redis.asyncio as aioredis
+
+        client = aioredis.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(*[self.prefix + channel for channel in channels])
+        try:
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=heartbeat)
+                yield json.loads(message['data']) if message else None
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
+
+
+@lru_cache(maxsize=1)
+def get_broker():
+    broker_class = import_string(getattr(settings, 'REALTIME_BROKER', 'socialnetwork.realtime.InMemoryBroker'))
+    return broker_class()
+
+
+def publish(channel, event):
+    try:
+        get_broker().publish(channel, event)
+    except Exception:
+        # Realtime chỉ là kênh phụ, lỗi broker không được làm hỏng request
+        logger.exception('Không đẩy được sự kiện realtime lên %s', channel)
+
+
+def publish_on_commit(channels, event):
+    """Đẩy sự kiện tới các channel sau khi transaction hiện tại commit"""
+    def send():
+        for channel in channels:
+            publish(channel, event)
+
+    transaction.on_commit(send)
+
+
+def publish_post_created(post, object_type='post'):
+    """Báo bài viết mới cho các client đang theo dõi feed (client tự tải bài viết theo id)"""
+    publish_on_commit([FEED_CHANNEL], {
+        'type': 'post.created',
+        'post_id': post.id,
+        'object_type': object_type,
+        'user_id': post.user_id,
+    })
+
+
+def publish_chat_message(chat_room, message):
+    publish_on_commit([user_channel(chat_room.user1_id), user_channel(chat_room.user2_id)], {
+        'type': 'chat.message',
+        'room_id': chat_room.id,
+        'message': {
+            'id': message.id,
+            'sender_id': message.sender_id,
+            'content': message.content,
+            'created_date': message.created_date,
+        },
+    })
+
+
+def publish_chat_read(chat_room, user_id, last_read_message_id):
+    publish_on_commit([user_channel(chat_room.user1_id), user_channel(chat_room.user2_id)], {
+        'type': 'chat.read',
+        'room_id': chat_room.id,
+        'user_id': user_id,
+        'last_read_message_id': last_read_message_id,
+    })
+
+
+def _authenticate(request):
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        return drf_request.user
+    except APIException:
+        return None
+
+
+def _format_event(event):
+    return f"event: {event.get('type', 'message')}\ndata: {json.dumps(event, cls=DjangoJSONEncoder)}\n\n"
+
+
+async def realtime_stream(request):
+    """
+    Server-Sent Events (cần chạy dưới ASGI): đẩy tin nhắn mới, thay đổi con trỏ đã đọc (topic chat)
+    và bài viết mới (topic feed) cho user đã đăng nhập. ?topics=chat,feed (mặc định cả 2).
+    """
+    user = await sync_to_async(_authenticate)(request)
+    if user is None or not user.is_authenticated:
+        return JsonResponse({'error': 'Chưa xác thực user'}, status=401)
+
+    topics = set((request.GET.get('topics') or 'chat,feed').split(','))
+    channels = []
+    if 'chat' in topics:
+        channels.append(user_channel(user.id))
+    if 'feed' in topics:
+        channels.append(FEED_CHANNEL)
+    if not channels:
+        return JsonResponse({'error': 'topics không hợp lệ'}, status=400)
+
+    heartbeat = getattr(settings, 'REALTIME_HEARTBEAT_SECONDS', 15)
+
+    async def stream():
+        yield f'retry: {heartbeat * 1000}\n\n'
+        async for event in get_broker().subscribe(channels, heartbeat):
+            # Comment giữ kết nối qua proxy khi không có sự kiện
+            yield _format_event(event) if event is not None else ': ping\n\n'
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
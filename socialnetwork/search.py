@@ -0,0 +1,105 @@
+import re
+import unicodedata
+from collections import Counter
+
+from django.db.models import OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+TOKEN_RE = re.compile(r'\w+')
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 8
+
+
+def normalize(text):
+    """
+    Chuẩn hóa chuỗi để tìm kiếm không dấu: bỏ dấu tiếng Việt (kể cả đ -> d), NFKD (ký tự full-width -> thường)
+    và casefold (ß -> ss), để các từ MySQL coi là bằng nhau (collation không phân biệt hoa thường/dấu) trùng nhau ở đây.
+    """
+    text = (text or '').replace('đ', 'd').replace('Đ', 'D')
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in text if unicodedata.category(c) != 'Mn').casefold()
+
+
+def tokenize(text):
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(normalize(text))]
+
+
+def build_terms(text):
+    """Đếm số lần xuất hiện của mỗi từ (đã chuẩn hóa) trong văn bản"""
+    return Counter(tokenize(text))
+
+
+def search_by_terms(queryset, term_queryset, owner_field, query, rank_field=None):
+    """
+    Lọc queryset theo bảng chỉ mục từ (term, owner). Mọi từ trong query đều phải khớp,
+    từ cuối cùng khớp theo tiền tố để hỗ trợ gõ tới đâu tìm tới đó.
+    Nếu truyền rank_field thì annotate điểm liên quan = tổng tần suất các từ khớp.
+    """
+    tokens = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not tokens:
+        return queryset
+
+    matched = Q()
+    for i, token in enumerate(tokens):
+        lookup = Q(term__startswith=token) if i == len(tokens) - 1 else Q(term=token)
+        queryset = queryset.filter(pk__in=term_queryset.filter(lookup).values(owner_field))
+        matched |= lookup
+
+    if rank_field:
+        rank = term_queryset.filter(matched, **{owner_field: OuterRef('pk')})\
+            .order_by().values(owner_field)\
+            .annotate(total=Sum('frequency'))\
+            .values('total')
+        queryset = queryset.annotate(**{rank_field: Coalesce(Subquery(rank), Value(0))})
+    return queryset
+
+
+def post_search_text(post):
+    subtype = post.get_subtype()
+    title = getattr(subtype, 'title', '') if subtype is not None else ''
+    return f'{title} {post.content}'
+
+
+def index_post(post):
+    """Cập nhật chỉ mục tìm kiếm của 1 bài viết (xóa khỏi chỉ mục nếu bài viết đã bị xóa mềm)"""
+    from .models import PostSearchTerm
+
+    PostSearchTerm.objects.filter(post_id=post.pk).delete()
+    if not post.active:
+        return
+    # Bỏ qua từ còn trùng theo collation của DB (vd ký tự đặc biệt mà normalize chưa gộp)
+    PostSearchTerm.objects.bulk_create([
+        PostSearchTerm(post_id=post.pk, term=term, frequency=frequency)
+        for term, frequency in build_terms(post_search_text(post)).items()
+    ], ignore_conflicts=True)
+
+
+def search_posts(queryset, query):
+    from .models import PostSearchTerm
+
+    queryset = search_by_terms(queryset, PostSearchTerm.objects.all(), 'post', query, rank_field='search_rank')
+    if 'search_rank' in queryset.query.annotations:
+        queryset = queryset.order_by('-search_rank', '-id')
+    return queryset
+
+
+def user_search_text(user):
+    return f'{user.first_name} {user.last_name}'
+
+
+def index_user(user):
+    """Cập nhật chỉ mục họ tên của 1 người dùng"""
+    from .models import UserSearchTerm
+
+    UserSearchTerm.objects.filter(user_id=user.pk).delete()
+    UserSearchTerm.objects.bulk_create([
+        UserSearchTerm(user_id=user.pk, term=term, frequency=frequency)
+        for term, frequency in build_terms(user_search_text(user)).items()
+    ], ignore_conflicts=True)
+
+
+def search_users(queryset, query):
+    """Lọc người dùng theo họ tên, không phân biệt dấu và thứ tự họ/tên, giữ nguyên ordering của queryset"""
+    from .models import UserSearchTerm
+
+    return search_by_terms(queryset, UserSearchTerm.objects.all(), 'user', query)
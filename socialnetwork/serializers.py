@@ -6,17 +6,109 @@ from rest_framework.serializers import ModelSerializer
 from cloudinary.uploader import upload as cloudinary_upload
 import os
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.db import transaction
-
-
-
-class UserSerializer(serializers.ModelSerializer):
+from django.db.models import Prefetch
+from .uploads import ImageUploadError, register_upload_owner, upload_images, verify_upload
+
+
+class DynamicFieldsMixin:
+    """
+    Cho client chọn shape của response:
+      ?fields=id,content  chỉ trả về các trường này
+      ?expand=user,post   trả object lồng đầy đủ, trường lồng không được expand chỉ trả id
+    Chỉ áp dụng cho serializer ngoài cùng khi có request trong context; serializer lồng bên trong
+    dùng default_expand của nó. Không có request thì giữ nguyên hành vi cũ (trả đầy đủ).
+    """
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+    # Các trường lồng được trả đầy đủ khi client không gửi ?expand=
+    default_expand = ()
+    # tên trường -> (select_related, prefetch_related) cần để serialize trường đó mà không phát sinh N+1
+    related_paths = {}
+
+    @staticmethod
+    def _split_param(request, param):
+        value = request.query_params.get(param) if request is not None else None
+        if value is None:
+            return None
+        return {name.strip() for name in value.split(',') if name.strip()}
+
+    @classmethod
+    def requested_fields(cls, request):
+        return cls._split_param(request, cls.fields_query_param)
+
+    @classmethod
+    def requested_expand(cls, request):
+        expand = cls._split_param(request, cls.expand_query_param)
+        return set(cls.default_expand) if expand is None else expand
+
+    @classmethod
+    def optimize_queryset(cls, queryset, request):
+        """Chỉ select_related/prefetch những quan hệ mà shape được yêu cầu thực sự cần"""
+        only = cls.requested_fields(request)
+        expand = cls.requested_expand(request)
+        for name, (select, prefetch) in cls.related_paths.items():
+            if only is not None and name not in only:
+                continue
+            declared = cls._declared_fields.get(name)
+            if isinstance(declared, serializers.BaseSerializer) and name not in expand:
+                # Quan hệ nhiều bị thu gọn thành danh sách id vẫn phải đọc bảng liên quan: prefetch 1 lần cho cả trang
+                if isinstance(declared, serializers.ListSerializer):
+                    queryset = queryset.prefetch_related(declared.source or name)
+                continue
+            if select:
+                queryset = queryset.select_related(*select)
+            if prefetch:
+                queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+    def _is_root(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None
+
+    def _shape_request(self):
+        # Chỉ serializer ngoài cùng mới đọc ?fields/?expand
+        return self.context.get('request') if self._is_root() else None
+
+    def wants_field(self, name):
+        only = self.requested_fields(self._shape_request())
+        return only is None or name in only
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if 'request' not in self.context:
+            return fields
+
+        request = self._shape_request()
+        expand = self.requested_expand(request)
+        for name, field in list(fields.items()):
+            if isinstance(field, serializers.BaseSerializer) and name not in expand:
+                many = isinstance(field, serializers.ListSerializer)
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True, many=many)
+
+        only = self.requested_fields(request)
+        if only is not None:
+            fields = {name: field for name, field in fields.items() if name in only}
+        return fields
+
+
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     avatar = serializers.ImageField(required=True)
     cover = serializers.ImageField(required=False)
     is_verified = serializers.SerializerMethodField()
     password_reset_time = serializers.SerializerMethodField()
     must_change_password = serializers.SerializerMethodField()
     mssv = serializers.SerializerMethodField()
+    related_paths = {
+        'is_verified': (['alumni'], []),
+        'mssv': (['alumni'], []),
+        'password_reset_time': (['teacher'], []),
+        'must_change_password': (['teacher'], []),
+    }
     class Meta:
         model = User
         fields = ['id','username', 'password', 'email', 'first_name', 'last_name', 'avatar', 'cover', 'role', 'is_verified', 'password_reset_time', 'must_change_password', 'mssv']
@@ -64,14 +156,29 @@ class UserSerializer(serializers.ModelSerializer):
 class UserRegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
     mssv = serializers.CharField(write_only=True, required=True)
-    avatar = serializers.ImageField(required=True)
+    avatar = serializers.ImageField(required=False)
     cover = serializers.ImageField(required=False)
+    # Có thể gửi tham chiếu ảnh đã upload thẳng lên Cloudinary ({public_id, version, signature, format}) thay cho file,
+    # kèm upload_token nhận từ /upload/sign-register/
+    avatar_upload = serializers.JSONField(write_only=True, required=False)
+    cover_upload = serializers.JSONField(write_only=True, required=False)
+    upload_token = serializers.CharField(write_only=True, required=False)
 
     class Meta:
         model = User
-        fields = ['id','username', 'password', 'email', 'first_name', 'last_name', 'avatar', 'cover', 'mssv']
+        fields = ['id','username', 'password', 'email', 'first_name', 'last_name', 'avatar', 'cover', 'mssv',
+                  'avatar_upload', 'cover_upload', 'upload_token']
 
     def validate(self, data):
+        # Ưu tiên ảnh đã upload thẳng lên Cloudinary, chỉ nhận ảnh trong thư mục của upload_token
+        upload_token = data.pop('upload_token', None)
+        for field in ('avatar', 'cover'):
+            reference = data.pop(f'{field}_upload', None)
+            if reference is not None:
+                try:
+                    data[field] = verify_upload(reference, register_upload_owner(upload_token))
+                except ImageUploadError as e:
+                    raise serializers.ValidationError({f'{field}_upload': str(e)})
         # Kiểm tra MSSV
         if not data.get('mssv'):
             raise serializers.ValidationError({'mssv': 'Vui lòng cung cấp MSSV cho cựu sinh viên.'})
@@ -167,54 +274,153 @@ class PostImageSerializer(ModelSerializer):
         model = PostImage
         fields = ['id', 'image']
 
-class PostSerializer(ModelSerializer):
+class PostSerializer(DynamicFieldsMixin, ModelSerializer):
     images = PostImageSerializer(many=True, required=False)
     user = UserSerializer(read_only=True)
     object_type = serializers.SerializerMethodField()
+    default_expand = ('user', 'images')
+    related_paths = {
+        'user': (['user__alumni', 'user__teacher'], []),
+        'images': ([], ['images']),
+    }
 
     class Meta:
         model = Post
-        fields = ['id', 'content', 'images', 'lock_comment', 'user', 'created_date', 'updated_date', 'object_type']
+        fields = ['id', 'content', 'images', 'lock_comment', 'user', 'created_date', 'updated_date', 'object_type',
+                  'comment_count', 'like_count', 'haha_count', 'love_count']
+        read_only_fields = ['comment_count', 'like_count', 'haha_count', 'love_count']
 
     def get_object_type(self, obj):
-        if SurveyPost.objects.filter(pk=obj.pk).exists():
-            return "survey"
-        elif EventInvitePost.objects.filter(pk=obj.pk).exists():
-            return "invitation"
-        return "post"
+        # Dùng annotation/select_related từ Post.objects.with_subtype() nên không tốn thêm query cho mỗi bài viết
+        return obj.get_object_type()
 
-class CommentSerializer(ModelSerializer):
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Trả kèm trường riêng của bài khảo sát/thư mời nếu đã được join sẵn
+        subtype = instance.get_subtype()
+        if isinstance(subtype, SurveyPost) and self.wants_field('end_time'):
+            data.setdefault('end_time', serializers.DateTimeField().to_representation(subtype.end_time))
+        elif isinstance(subtype, EventInvitePost) and self.wants_field('title'):
+            data.setdefault('title', subtype.title)
+        return data
+
+# Quan hệ cần join khi PostSerializer được lồng trong Comment/Reaction (theo default_expand của PostSerializer)
+NESTED_POST_SELECT_RELATED = ['post__user__alumni', 'post__user__teacher', 'post__surveypost', 'post__eventinvitepost']
+
+
+class CommentSerializer(DynamicFieldsMixin, ModelSerializer):
     user = UserSerializer(read_only=True)
     post = PostSerializer(read_only=True)
+    default_expand = ('user',)
+    related_paths = {
+        'user': (['user__alumni', 'user__teacher'], []),
+        'post': (NESTED_POST_SELECT_RELATED, ['post__images']),
+    }
 
     class Meta:
         model = Comment
         fields = ['id', 'user', 'content', 'image', 'post', 'parent', 'created_date', 'updated_date']
 
-class ReactionSerializer(ModelSerializer):
+class UserSummarySerializer(ModelSerializer):
+    avatar = serializers.ImageField(read_only=True)
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'first_name', 'last_name', 'avatar']
+
+
+class CommentReplySerializer(DynamicFieldsMixin, ModelSerializer):
+    user = UserSummarySerializer(read_only=True)
+    default_expand = ('user',)
+
+    class Meta:
+        model = Comment
+        fields = ['id', 'user', 'content', 'image', 'parent', 'root', 'created_date', 'updated_date']
+
+
+class CommentThreadSerializer(DynamicFieldsMixin, ModelSerializer):
+    """Bình luận gốc kèm N phản hồi đầu tiên (view gán sẵn first_replies, replies_next)"""
+    user = UserSummarySerializer(read_only=True)
+    replies = serializers.SerializerMethodField()
+    default_expand = ('user',)
+    replies_next = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Comment
+        fields = ['id', 'user', 'content', 'image', 'created_date', 'updated_date', 'reply_count', 'replies',
+                  'replies_next']
+
+    def get_replies(self, obj):
+        # Không truyền request: serializer tạo trong SerializerMethodField không có parent nên sẽ bị coi là
+        # serializer ngoài cùng và áp ?fields/?expand của comment gốc lên phản hồi
+        context = {key: value for key, value in self.context.items() if key != 'request'}
+        return CommentReplySerializer(getattr(obj, 'first_replies', []), many=True, context=context).data
+
+    def get_replies_next(self, obj):
+        return getattr(obj, 'replies_next', None)
+
+
+class ReactionSerializer(DynamicFieldsMixin, ModelSerializer):
     user = UserSerializer(read_only=True)
     post = PostSerializer(read_only=True)
+    default_expand = ('user',)
+    related_paths = CommentSerializer.related_paths
 
     class Meta:
         model = Reaction
         fields = ['id', 'reaction', 'user', 'post', 'created_date', 'updated_date']
 
 class SurveyOptionSerializer(serializers.ModelSerializer):
+    # Ghi được để khi sửa khảo sát so khớp lựa chọn cũ theo id
+    id = serializers.IntegerField(required=False)
+
     class Meta:
         model = SurveyOption
         fields = ['id', 'option']
 
 
+# Cây câu hỏi được cache theo phiên bản (id, updated_date) nên chỉ cần hết hạn để dọn phiên bản cũ
+SURVEY_QUESTIONS_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+class CachedSurveyQuestionListSerializer(serializers.ListSerializer):
+    """
+    Cây câu hỏi/lựa chọn của 1 khảo sát, gần như không đổi sau khi đăng nên được cache theo phiên bản:
+    sửa khảo sát đổi updated_date nên tự dùng key mới. Chỉ truy vấn DB (2 câu) khi cache chưa có.
+    """
+
+    def get_attribute(self, instance):
+        return instance
+
+    def to_representation(self, survey_post):
+        key = f'survey-questions:{survey_post.pk}:{survey_post.cache_version}'
+        data = cache.get(key)
+        if data is None:
+            questions = SurveyQuestion.objects.filter(survey_post=survey_post).order_by('id')\
+                .prefetch_related(Prefetch('options', queryset=SurveyOption.objects.order_by('id')))
+            data = [self.child.to_representation(question) for question in questions]
+            cache.set(key, data, SURVEY_QUESTIONS_CACHE_TIMEOUT)
+        return data
+
+
 class SurveyQuestionSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(required=False)
     options = SurveyOptionSerializer(many=True, required=True)
 
     class Meta:
         model = SurveyQuestion
         fields = ['id', 'question', 'multi_choice', 'options']
+        list_serializer_class = CachedSurveyQuestionListSerializer
 
 
 class SurveyPostSerializer(PostSerializer):
     questions = SurveyQuestionSerializer(many=True, required=False)
+    default_expand = ('user', 'images', 'questions')
+    related_paths = {
+        **PostSerializer.related_paths,
+        # Câu hỏi lấy từ cache theo phiên bản khảo sát, không prefetch
+        'questions': ([], []),
+    }
 
     class Meta(PostSerializer.Meta):
         model = SurveyPost
@@ -223,15 +429,12 @@ class SurveyPostSerializer(PostSerializer):
 
     def create(self, validated_data):
         questions_data = validated_data.pop('questions', [])
-        survey_post = SurveyPost.objects.create(**validated_data)
-
-        for question_data in questions_data:
-            options_data = question_data.pop('options', [])
-            question = SurveyQuestion.objects.create(survey_post=survey_post, **question_data)
-
-            for option_data in options_data:
-                SurveyOption.objects.create(survey_question=question, **option_data)  # Sửa ở đây
-
+        try:
+            with transaction.atomic():
+                survey_post = SurveyPost.objects.create(**validated_data)
+                survey_post.sync_questions(questions_data)
+        except DjangoValidationError as e:
+            raise serializers.ValidationError({'questions': e.messages})
         return survey_post
 
     def update(self, instance, validated_data):
@@ -240,15 +443,13 @@ class SurveyPostSerializer(PostSerializer):
         instance.content = validated_data.get('content', instance.content)
         instance.survey_type = validated_data.get('survey_type', instance.survey_type)
         instance.end_time = validated_data.get('end_time', instance.end_time)
-        instance.save()
-
-        if questions_data is not None:
-            instance.questions.all().delete()
-            for question_data in questions_data:
-                options_data = question_data.pop('options', [])
-                question = SurveyQuestion.objects.create(survey_post=instance, **question_data)
-                for option_data in options_data:
-                    SurveyOption.objects.create(survey_question=question, **option_data)
+        try:
+            with transaction.atomic():
+                instance.save(update_fields=['content', 'survey_type', 'end_time', 'updated_date'])
+                if questions_data is not None:
+                    instance.sync_questions(questions_data)
+        except DjangoValidationError as e:
+            raise serializers.ValidationError({'questions': e.messages})
 
         return instance
 
@@ -264,14 +465,15 @@ class SurveyDraftSerializer(serializers.ModelSerializer):
         fields = ['id', 'survey_post', 'user', 'answers', 'drafted_at']
 
 
-class GroupSerializer(serializers.ModelSerializer):
+class GroupSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user_count= serializers.IntegerField(read_only=True)
     class Meta:
         model = Group
         fields = ['id', 'group_name', 'user_count','users', 'created_date', 'updated_date']
 
-class GroupDetailSerializer(serializers.ModelSerializer):
+class GroupDetailSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     users = UserSerializer(many=True, read_only=True)
+    default_expand = ('users',)
     class Meta:
         model = Group
         fields = ['id', 'group_name', 'users', 'created_date', 'updated_date']
@@ -288,30 +490,45 @@ class EventInvitePostSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         groups = validated_data.pop('groups', [])
         individuals = validated_data.pop('individuals', [])
+        validated_data.pop('images', None)
         images_data = self.context['request'].FILES.getlist('images')
 
-        post = EventInvitePost.objects.create(**validated_data)
+        # Upload song song ảnh trước, chỉ tạo bài viết khi toàn bộ ảnh đã upload xong
+        try:
+            image_urls = upload_images(images_data)
+        except ImageUploadError as e:
+            raise serializers.ValidationError({'images': f'Lỗi tải ảnh: {str(e)}'})
 
-        # Gán quan hệ many-to-many
-        post.groups.set(groups)
-        post.individuals.set(individuals)
+        with transaction.atomic():
+            post = EventInvitePost.objects.create(**validated_data)
+
+            # Gán quan hệ many-to-many
+            post.groups.set(groups)
+            post.individuals.set(individuals)
 
-        for image in images_data:
-            PostImage.objects.create(post=post, image=image)
+            PostImage.objects.bulk_create([PostImage(post=post, image=url) for url in image_urls])
 
         return post
 
-class ChatRoomSerializer(serializers.ModelSerializer):
+class InvitationDispatchSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = InvitationDispatch
+        fields = ['id', 'post', 'status', 'total', 'sent_count', 'failed_count', 'created_date', 'finished_date']
+        read_only_fields = fields
+
+class ChatRoomSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     other_user = serializers.SerializerMethodField()
     last_message = serializers.CharField(read_only=True)
     last_message_time = serializers.DateTimeField(read_only=True)
     last_message_sender_id = serializers.SerializerMethodField()
     is_read = serializers.SerializerMethodField()
+    unread_count = serializers.SerializerMethodField()
 
     class Meta:
         model = ChatRoom
-        fields = ['id', 'other_user', 'last_message', 'last_message_time', 'last_message_sender_id', 'is_read']
-        read_only_fields = ['last_message', 'last_message_time', 'last_message_sender_id', 'is_read']
+        fields = ['id', 'other_user', 'last_message', 'last_message_time', 'last_message_sender_id', 'is_read',
+                  'unread_count']
+        read_only_fields = ['last_message', 'last_message_time', 'last_message_sender_id', 'is_read', 'unread_count']
 
     def get_other_user(self, obj):
         request = self.context.get('request')
@@ -328,31 +545,66 @@ class ChatRoomSerializer(serializers.ModelSerializer):
         }
 
     def get_last_message_sender_id(self, obj):
-        latest_message_list = getattr(obj, 'latest_message', [])
-        if latest_message_list:
-            latest_message = latest_message_list[0]
-            if latest_message and hasattr(latest_message, 'sender'):
-                return latest_message.sender.id
-        return None
+        return obj.last_message_sender_id
 
     def get_is_read(self, obj):
         request = self.context.get('request')
         if not request or not request.user.is_authenticated:
             return True
-        user = request.user
-        latest_message_list = getattr(obj, 'latest_message', [])
-        if not latest_message_list:
-            return True
-        latest_message = latest_message_list[0]
-        if latest_message.sender == user:
-            return True
-        return latest_message.is_read
+        return obj.is_read_by(request.user)
 
-class MessageSerializer(serializers.ModelSerializer):
+    def get_unread_count(self, obj):
+        request = self.context.get('request')
+        if not request or not request.user.is_authenticated:
+            return 0
+        return obj.read_state_for(request.user)[1]
+
+class ChatInboxSerializer(serializers.ModelSerializer):
+    """1 dòng hộp thư chat (ChatParticipant), trả về cùng dạng với ChatRoomSerializer"""
+    id = serializers.IntegerField(source='chat_room_id', read_only=True)
+    other_user = serializers.SerializerMethodField()
+    last_message_time = serializers.SerializerMethodField()
+    last_message_sender_id = serializers.IntegerField(read_only=True)
+    is_read = serializers.BooleanField(read_only=True)
+
+    class Meta:
+        model = ChatParticipant
+        fields = ['id', 'other_user', 'last_message', 'last_message_time', 'last_message_sender_id', 'is_read',
+                  'unread_count']
+        read_only_fields = fields
+
+    def get_other_user(self, obj):
+        return {
+            'id': obj.other_user_id,
+            'username': obj.other_username,
+            'first_name': obj.other_first_name,
+            'last_name': obj.other_last_name,
+            'avatar': obj.other_avatar
+        }
+
+    def get_last_message_time(self, obj):
+        # Phòng chưa có tin nhắn lưu thời điểm tạo phòng để sắp xếp, không trả ra như thời điểm tin nhắn
+        if obj.last_message_id is None:
+            return None
+        return serializers.DateTimeField().to_representation(obj.last_message_time)
+
+class MessageSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
+    is_read = serializers.SerializerMethodField()
+    default_expand = ('sender',)
+    related_paths = {
+        'sender': (['sender__alumni', 'sender__teacher'], []),
+    }
     
     class Meta:
         model = Message
         fields = ['id', 'chat_room', 'sender', 'content', 'is_read', 'created_date']
 
+    def get_is_read(self, obj):
+        # read_cursors: {user_id: last_read_message_id} của các thành viên phòng, do view truyền vào context
+        read_cursors = self.context.get('read_cursors')
+        if read_cursors is None:
+            return obj.is_read
+        return any(obj.id <= cursor for user_id, cursor in read_cursors.items() if user_id != obj.sender_id)
+
 
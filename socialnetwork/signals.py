@@ -0,0 +1,37 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import ChatParticipant, Post, User
+from .search import index_post, index_user
+
+# Chỉ những trường ảnh hưởng tới nội dung tìm kiếm mới cần cập nhật chỉ mục
+POST_SEARCH_FIELDS = {'content', 'title', 'active'}
+USER_SEARCH_FIELDS = {'first_name', 'last_name'}
+# Các trường của user được sao chép vào hộp thư chat của người khác
+CHAT_INBOX_USER_FIELDS = {'username', 'first_name', 'last_name', 'avatar'}
+
+
+@receiver(post_save)
+def update_post_search_index(sender, instance, update_fields=None, **kwargs):
+    # post_save của SurveyPost/EventInvitePost gửi với sender là class con nên không lọc theo sender
+    if not isinstance(instance, Post):
+        return
+    if update_fields and not POST_SEARCH_FIELDS & set(update_fields):
+        return
+    index_post(instance)
+
+
+@receiver(post_save, sender=User)
+def update_user_search_index(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not USER_SEARCH_FIELDS & set(update_fields):
+        return
+    index_user(instance)
+
+
+@receiver(post_save, sender=User)
+def update_chat_inbox_other_user(sender, instance, created=False, update_fields=None, **kwargs):
+    if created:
+        return
+    if update_fields and not CHAT_INBOX_USER_FIELDS & set(update_fields):
+        return
+    ChatParticipant.objects.filter(other_user=instance).update(**ChatParticipant.other_user_fields(instance))
@@ -5,5 +5,428 @@ from django.core.mail import send_mail
 from django.utils import timezone
 from datetime import timedelta
 from django.db import DatabaseError
+from django.db.models import F, Q
 from django.apps import apps
 import logging
+import uuid
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils.html import escape
+from sendgrid import SendGridAPIClient
+from sendgrid.helpers.mail import Mail, Personalization, Substitution, To
+
+logger = logging.getLogger(__name__)
+
+# SendGrid cho phép tối đa 1000 personalizations trong 1 request
+SENDGRID_BATCH_SIZE = 1000
+# Lô email đã nhận mà chưa gửi xong sau thời gian này (worker chết giữa chừng) thì task khác được nhận lại
+EMAIL_CLAIM_TIMEOUT = timedelta(minutes=10)
+
+EMAIL_SUBJECTS = {
+    'account_verified': 'TÀI KHOẢN CỦA BẠN ĐÃ ĐƯỢC XÁC THỰC',
+    'teacher_account_created': 'THÔNG TIN TÀI KHOẢN ALUMNISNW CỦA GIẢNG VIÊN',
+}
+
+
+def email_substitutions(user):
+    return {
+        'full_name': f'{user.first_name} {user.last_name}',
+        'username': user.username,
+    }
+
+
+@lru_cache(maxsize=None)
+def get_email_template(event):
+    """
+    Render template email 1 lần cho mỗi event với các placeholder -full_name-, -username-...
+    Giá trị riêng của từng người nhận được SendGrid thay vào qua substitutions.
+    """
+    placeholders = {key: f'-{key}-' for key in ('full_name', 'username')}
+    return render_to_string(f'emails/{event}.html', placeholders)
+
+
+@lru_cache(maxsize=1)
+def get_sendgrid_client():
+    # Dùng lại 1 client cho cả worker process thay vì tạo mới mỗi lần gửi
+    return SendGridAPIClient(settings.SENDGRID_API_KEY)
+
+
+def build_mail(event, users):
+    """Gộp nhiều người nhận vào 1 request SendGrid, mỗi người 1 personalization"""
+    mail = Mail(
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        subject=EMAIL_SUBJECTS[event],
+        html_content=get_email_template(event),
+    )
+    for user in users:
+        personalization = Personalization()
+        personalization.add_to(To(user.email))
+        for key, value in email_substitutions(user).items():
+            personalization.add_substitution(Substitution(f'-{key}-', escape(value)))
+        mail.add_personalization(personalization)
+    return mail
+
+
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=True, retry_backoff_max=600,
+             retry_jitter=True, max_retries=5)
+def send_user_emails(self, event, user_ids):
+    """
+    Gửi email theo event cho danh sách user. Idempotent theo (user, event):
+    user nào đã gửi thành công (EmailDelivery.sent_date) sẽ bị bỏ qua khi retry hoặc enqueue lặp.
+    Mỗi lô được nhận (claim) bằng 1 câu UPDATE có điều kiện trước khi gửi, nên 2 task chạy song song
+    cho cùng user không gửi trùng; việc gửi SendGrid nằm ngoài transaction.
+    """
+    EmailDelivery = apps.get_model('socialnetwork', 'EmailDelivery')
+
+    EmailDelivery.objects.bulk_create(
+        [EmailDelivery(user_id=user_id, event=event) for user_id in user_ids],
+        ignore_conflicts=True,
+    )
+
+    sent = 0
+    while True:
+        unclaimed = Q(sent_date__isnull=True) & (
+            Q(claimed_date__isnull=True) | Q(claimed_date__lt=timezone.now() - EMAIL_CLAIM_TIMEOUT)
+        )
+        candidate_ids = list(
+            EmailDelivery.objects.filter(unclaimed, event=event, user_id__in=user_ids).exclude(user__email='')
+            .order_by('id').values_list('id', flat=True)[:SENDGRID_BATCH_SIZE]
+        )
+        if not candidate_ids:
+            return sent
+
+        # UPDATE có điều kiện: chỉ nhận những dòng chưa bị task khác nhận sau lúc đọc ở trên
+        token = uuid.uuid4()
+        EmailDelivery.objects.filter(unclaimed, pk__in=candidate_ids).update(claim_token=token,
+                                                                             claimed_date=timezone.now())
+        batch = list(EmailDelivery.objects.filter(claim_token=token).select_related('user').order_by('id'))
+        if not batch:
+            continue
+
+        claimed = EmailDelivery.objects.filter(claim_token=token)
+        try:
+            get_sendgrid_client().send(build_mail(event, [delivery.user for delivery in batch]))
+        except Exception:
+            # Trả lại lô để lần retry (hoặc task khác) gửi lại ngay, không phải chờ claim hết hạn
+            claimed.update(claim_token=None, claimed_date=None)
+            raise
+        claimed.update(sent_date=timezone.now())
+        sent += len(batch)
+
+
+def enqueue_user_emails(event, user_ids):
+    """Đưa việc gửi email vào hàng đợi Celery, chỉ sau khi transaction hiện tại commit thành công"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+
+    def enqueue():
+        try:
+            send_user_emails.delay(str(event), user_ids)
+        except Exception:
+            # Không để lỗi broker làm hỏng response của request đã commit
+            logger.exception('Không đưa được email %s vào hàng đợi cho user %s', event, user_ids)
+
+    transaction.on_commit(enqueue)
+
+
+INVITATION_SUBJECT = "Thông báo về bài đăng mời tham gia sự kiện sắp tới của Trường Đại Học Mở Thành phố Hồ Chí Minh"
+# Số user id đọc / ghi mỗi lần khi tạo danh sách người nhận
+RECIPIENT_STREAM_CHUNK = 2000
+# Dispatch đang chạy mà không có tiến triển quá thời gian này thì coi như worker đã chết, cho phép resume
+DISPATCH_STALL_TIMEOUT = timedelta(minutes=15)
+
+
+def invitation_recipients(post):
+    """
+    Người nhận lời mời trong 1 câu SQL, không trùng lặp: cá nhân được mời, thành viên các nhóm được mời,
+    hoặc toàn bộ user có email nếu send_to_all.
+    """
+    User = apps.get_model('socialnetwork', 'User')
+    Group = apps.get_model('socialnetwork', 'Group')
+
+    queryset = User.objects.exclude(email__isnull=True).exclude(email__exact='')
+    if not post.send_to_all:
+        group_members = Group.users.through.objects.filter(group__in=post.groups.values('pk')).values('user_id')
+        queryset = queryset.filter(Q(pk__in=post.individuals.values('pk')) | Q(pk__in=group_members))
+    return queryset
+
+
+def render_invitation(post):
+    image_urls = [image.image.url for image in post.images.all()]
+    return render_to_string('emails/event_invitation.html', {
+        'title': post.title or "Sự kiện từ Trường Đại Học Mở Thành phố Hồ Chí Minh",
+        'content': post.content or '',
+        'image_urls': image_urls,
+    })
+
+
+def resolve_invitation_recipients(dispatch):
+    """Ghi danh sách người nhận theo từng chunk (stream id từ DB), chạy lại nhiều lần vẫn an toàn"""
+    InvitationRecipient = apps.get_model('socialnetwork', 'InvitationRecipient')
+
+    user_ids = invitation_recipients(dispatch.post).order_by().values_list('pk', flat=True)
+    chunk = []
+    for user_id in user_ids.iterator(chunk_size=RECIPIENT_STREAM_CHUNK):
+        chunk.append(InvitationRecipient(dispatch=dispatch, user_id=user_id))
+        if len(chunk) >= RECIPIENT_STREAM_CHUNK:
+            InvitationRecipient.objects.bulk_create(chunk, ignore_conflicts=True)
+            chunk = []
+    if chunk:
+        InvitationRecipient.objects.bulk_create(chunk, ignore_conflicts=True)
+
+    dispatch.total = dispatch.recipients.count()
+    dispatch.save(update_fields=['total', 'updated_date'])
+
+
+def build_invitation_mail(html_content, emails):
+    mail = Mail(from_email=settings.DEFAULT_FROM_EMAIL, subject=INVITATION_SUBJECT, html_content=html_content)
+    # Mỗi người nhận 1 personalization nên không ai thấy địa chỉ của người khác
+    for email in emails:
+        personalization = Personalization()
+        personalization.add_to(To(email))
+        mail.add_personalization(personalization)
+    return mail
+
+
+@shared_task(bind=True, autoretry_for=(DatabaseError,), retry_backoff=True, max_retries=5)
+def dispatch_invitation(self, dispatch_id):
+    """
+    Gửi email mời theo từng chunk người nhận còn ở trạng thái chờ. Chunk nào lỗi thì đánh dấu lỗi
+    cho từng người nhận trong chunk và tiếp tục; có thể gọi lại (resume) để gửi lại các người nhận lỗi.
+    Chỉ 1 lượt chạy nhận được dispatch (PENDING -> RUNNING), task bị giao 2 lần hoặc resume bấm 2 lần sẽ bỏ qua.
+    """
+    InvitationDispatch = apps.get_model('socialnetwork', 'InvitationDispatch')
+
+    claimed = InvitationDispatch.objects.filter(pk=dispatch_id, status=InvitationDispatch.Status.PENDING)\
+        .update(status=InvitationDispatch.Status.RUNNING, updated_date=timezone.now())
+    if not claimed:
+        logger.info('Dispatch %s đã được lượt chạy khác nhận, bỏ qua', dispatch_id)
+        return None
+
+    try:
+        return send_invitation_dispatch(dispatch_id)
+    except DatabaseError:
+        # Trả dispatch về PENDING để lượt autoretry nhận lại được
+        InvitationDispatch.objects.filter(pk=dispatch_id, status=InvitationDispatch.Status.RUNNING)\
+            .update(status=InvitationDispatch.Status.PENDING)
+        raise
+
+
+def send_invitation_dispatch(dispatch_id):
+    InvitationDispatch = apps.get_model('socialnetwork', 'InvitationDispatch')
+    Recipient = apps.get_model('socialnetwork', 'InvitationRecipient')
+
+    dispatch = InvitationDispatch.objects.select_related('post').get(pk=dispatch_id)
+    post = dispatch.post
+    # Danh sách người nhận chưa ghi xong (lần chạy đầu hoặc lần trước chết giữa chừng) thì ghi lại
+    if not dispatch.total:
+        resolve_invitation_recipients(dispatch)
+
+    html_content = render_invitation(post)
+    pending = dispatch.recipients.filter(status=Recipient.Status.PENDING).order_by('id')
+    while True:
+        batch = list(pending.values_list('id', 'user__email')[:SENDGRID_BATCH_SIZE])
+        if not batch:
+            break
+        ids = [recipient_id for recipient_id, _ in batch]
+        try:
+            get_sendgrid_client().send(build_invitation_mail(html_content, [email for _, email in batch]))
+        except Exception as e:
+            logger.exception('Lỗi gửi lời mời (dispatch %s, %s người nhận)', dispatch_id, len(ids))
+            Recipient.objects.filter(pk__in=ids).update(status=Recipient.Status.FAILED, error=str(e)[:1000])
+            InvitationDispatch.objects.filter(pk=dispatch_id).update(failed_count=F('failed_count') + len(ids),
+                                                                   updated_date=timezone.now())
+        else:
+            Recipient.objects.filter(pk__in=ids).update(status=Recipient.Status.SENT, error='', sent_date=timezone.now())
+            InvitationDispatch.objects.filter(pk=dispatch_id).update(sent_count=F('sent_count') + len(ids),
+                                                                   updated_date=timezone.now())
+
+    dispatch.refresh_from_db()
+    dispatch.status = dispatch.Status.PARTIAL if dispatch.failed_count else dispatch.Status.DONE
+    dispatch.finished_date = timezone.now()
+    dispatch.save(update_fields=['status', 'finished_date', 'updated_date'])
+    return dispatch.sent_count
+
+
+def start_invitation_dispatch(post):
+    """Tạo tiến trình gửi lời mời cho bài đăng và đưa vào hàng đợi sau khi commit"""
+    InvitationDispatch = apps.get_model('socialnetwork', 'InvitationDispatch')
+
+    dispatch = InvitationDispatch.objects.create(post=post)
+
+    def enqueue():
+        try:
+            dispatch_invitation.delay(dispatch.id)
+        except Exception:
+            # Bài đăng đã commit: dispatch còn PENDING sẽ bị coi là treo và gửi lại được qua dispatch/resume
+            logger.exception('Không đưa được dispatch %s vào hàng đợi', dispatch.id)
+
+    transaction.on_commit(enqueue)
+    return dispatch
+
+
+def is_dispatch_stalled(dispatch):
+    return dispatch.updated_date is None or timezone.now() - dispatch.updated_date > DISPATCH_STALL_TIMEOUT
+
+
+def resume_invitation_dispatch(dispatch):
+    """Đưa các người nhận bị lỗi về trạng thái chờ và gửi lại"""
+    Recipient = apps.get_model('socialnetwork', 'InvitationRecipient')
+
+    with transaction.atomic():
+        failed = dispatch.recipients.filter(status=Recipient.Status.FAILED).update(status=Recipient.Status.PENDING, error='')
+        dispatch.failed_count = max(dispatch.failed_count - failed, 0)
+        # Về PENDING để đúng 1 lượt chạy nhận lại dispatch
+        dispatch.status = dispatch.Status.PENDING
+        dispatch.finished_date = None
+        dispatch.save(update_fields=['failed_count', 'status', 'finished_date', 'updated_date'])
+        transaction.on_commit(lambda: dispatch_invitation.delay(dispatch.id))
+    return failed
+
+
+# Số sự kiện outbox xử lý mỗi lượt cho 1 phòng chat
+CHAT_OUTBOX_BATCH_SIZE = 200
+# Thời gian giữ lock theo phòng, được gia hạn trước mỗi batch nên chỉ cần đủ cho 1 batch
+CHAT_OUTBOX_LOCK_TIMEOUT = 300
+
+
+def chat_outbox_lock_key(room_id):
+    return f'chat-outbox-lock:{room_id}'
+
+
+def chat_outbox_lock():
+    return caches['locks']
+
+
+def renew_chat_outbox_lock(lock_key, token):
+    """Gia hạn lock nếu worker vẫn đang giữ nó; trả về False khi lock đã hết hạn và bị worker khác lấy"""
+    lock = chat_outbox_lock()
+    if lock.get(lock_key) != token:
+        return False
+    return lock.touch(lock_key, CHAT_OUTBOX_LOCK_TIMEOUT)
+
+
+def release_chat_outbox_lock(lock_key, token):
+    lock = chat_outbox_lock()
+    if lock.get(lock_key) == token:
+        lock.delete(lock_key)
+
+
+def apply_chat_events(chat_room, events):
+    """
+    Đồng bộ các sự kiện của 1 phòng lên Firestore theo đúng thứ tự.
+    Các tin nhắn liên tiếp được gộp thành 1 WriteBatch.
+    """
+    from . import firebase_config
+
+    Message = apps.get_model('socialnetwork', 'Message')
+    ChatOutbox = apps.get_model('socialnetwork', 'ChatOutbox')
+
+    message_ids = [event.payload['message_id'] for event in events if event.kind == ChatOutbox.Kind.MESSAGE]
+    read_state = {
+        user_id: (last_read_message_id, unread_count)
+        for user_id, last_read_message_id, unread_count
+        in chat_room.participants.values_list('user_id', 'last_read_message_id', 'unread_count')
+    }
+    messages = {}
+    for message in Message.objects.filter(pk__in=message_ids).values('id', 'sender_id', 'content', 'created_date'):
+        # Đã đọc nếu con trỏ của người nhận đã vượt qua tin nhắn
+        message['is_read'] = any(cursor >= message['id'] for user_id, (cursor, _) in read_state.items()
+                                 if user_id != message['sender_id'])
+        messages[message['id']] = message
+    user_ids = [chat_room.user1_id, chat_room.user2_id]
+
+    pending_messages = []
+
+    def flush_messages():
+        if pending_messages:
+            firebase_config.replicate_messages(chat_room.id, pending_messages, user_ids, read_state=read_state)
+            pending_messages.clear()
+
+    for event in events:
+        if event.kind == ChatOutbox.Kind.MESSAGE:
+            message = messages.get(event.payload['message_id'])
+            if message is not None:  # tin nhắn đã bị xóa khỏi DB thì bỏ qua
+                pending_messages.append(message)
+            continue
+
+        flush_messages()
+        if event.kind == ChatOutbox.Kind.CREATE_ROOM:
+            firebase_config.create_chat_room(chat_room.id, [chat_room.user1, chat_room.user2])
+        elif event.kind == ChatOutbox.Kind.MARK_READ:
+            firebase_config.update_read_cursor(chat_room.id, event.payload['user_id'],
+                                               event.payload.get('last_read_message_id', 0))
+            # Giữ cờ is_read trên từng document cho client cũ (chạy nền, commit theo batch)
+            firebase_config.mark_messages_as_read(chat_room.id, event.payload['user_id'],
+                                                  sender_ids=event.payload.get('sender_ids'))
+    flush_messages()
+
+
+@shared_task(bind=True, max_retries=None)
+def replicate_chat_room(self, room_id):
+    """
+    Đồng bộ outbox của 1 phòng chat lên Firestore. Mỗi phòng chỉ có 1 worker xử lý tại 1 thời điểm
+    (lock trong cache) để giữ thứ tự; gặp lỗi thì dừng ở sự kiện lỗi và retry với backoff.
+    """
+    ChatRoom = apps.get_model('socialnetwork', 'ChatRoom')
+    ChatOutbox = apps.get_model('socialnetwork', 'ChatOutbox')
+
+    lock_key = chat_outbox_lock_key(room_id)
+    token = self.request.id or uuid.uuid4().hex
+    if not chat_outbox_lock().add(lock_key, token, CHAT_OUTBOX_LOCK_TIMEOUT):
+        # Worker khác đang xử lý phòng này, thử lại sau để không bỏ sót sự kiện vừa ghi
+        raise self.retry(countdown=2, max_retries=30)
+
+    try:
+        chat_room = ChatRoom.objects.select_related('user1', 'user2').filter(pk=room_id).first()
+        if chat_room is None:
+            return 0
+
+        processed = 0
+        while True:
+            # Batch trước chạy quá lâu làm lock hết hạn thì dừng, để không chạy song song với worker khác
+            if not renew_chat_outbox_lock(lock_key, token):
+                logger.warning('Mất lock đồng bộ chat của phòng %s, dừng lượt xử lý', room_id)
+                raise self.retry(countdown=2, max_retries=30)
+            events = list(ChatOutbox.objects.filter(chat_room_id=room_id, processed_date__isnull=True)
+                          .order_by('id')[:CHAT_OUTBOX_BATCH_SIZE])
+            if not events:
+                return processed
+            try:
+                apply_chat_events(chat_room, events)
+            except Exception as e:
+                logger.exception('Lỗi đồng bộ chat lên Firestore (phòng %s)', room_id)
+                ChatOutbox.objects.filter(pk__in=[event.pk for event in events])\
+                    .update(attempts=F('attempts') + 1, last_error=str(e)[:1000])
+                attempts = events[0].attempts + 1
+                raise self.retry(exc=e, countdown=min(2 ** attempts, 600), max_retries=None)
+            ChatOutbox.objects.filter(pk__in=[event.pk for event in events]).update(processed_date=timezone.now())
+            processed += len(events)
+    finally:
+        release_chat_outbox_lock(lock_key, token)
+
+
+def enqueue_chat_replication(room_id):
+    """Sau khi transaction commit, đưa phòng chat vào hàng đợi đồng bộ Firestore"""
+    def enqueue():
+        try:
+            replicate_chat_room.delay(room_id)
+        except Exception:
+            # Sự kiện vẫn nằm trong outbox, lệnh replicate_chat_outbox sẽ xử lý sau
+            logger.exception('Không đưa được phòng chat %s vào hàng đợi đồng bộ', room_id)
+
+    transaction.on_commit(enqueue)
+
+
+def record_chat_event(chat_room, kind, **payload):
+    """Ghi sự kiện vào outbox (trong transaction của request) và hẹn đồng bộ sau khi commit"""
+    ChatOutbox = apps.get_model('socialnetwork', 'ChatOutbox')
+
+    event = ChatOutbox.objects.create(chat_room=chat_room, kind=kind, payload=payload)
+    enqueue_chat_replication(chat_room.pk)
+    return event
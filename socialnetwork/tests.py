@@ -1,3 +1,895 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import json
+import uuid
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import analytics, firebase_config, realtime, tasks, views
+from .models import (ChatOutbox, ChatParticipant, ChatRoom, Comment, EmailDelivery, EventInvitePost, Group,
+                     InvitationDispatch, InvitationRecipient, Post, PostImage, PostSearchTerm, SurveyCompletion,
+                     SurveyOption, SurveyPost, SurveyQuestion, User, UserSurveyOption)
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alumni', email='alumni@example.com', role=1)
+        self.posts = [Post.objects.create(user=self.user, content=f'bài viết số {i}') for i in range(7)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_cursor_pages_cover_every_post_once(self):
+        ids = []
+        url = '/post/?cursor='
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [post['id'] for post in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, [post.id for post in reversed(self.posts)])
+
+    def test_null_created_date_is_skipped(self):
+        Post.objects.filter(pk=self.posts[0].pk).update(created_date=None)
+        response = self.client.get('/post/?cursor=')
+        ids = [post['id'] for post in response.data['results']]
+        next_ids = [post['id'] for post in self.client.get(response.data['next']).data['results']]
+        self.assertNotIn(self.posts[0].id, ids + next_ids)
+
+    def test_invalid_cursor_returns_404(self):
+        for values in (['abc', 5], ['2024-01-01T00:00:00+00:00', '5'], [None, 5], ['2024-01-01T00:00:00+00:00'],
+                       ['2024-01-01T00:00:00+00:00', True], {'a': 1}):
+            response = self.client.get(f'/post/?cursor={encode_cursor(values)}')
+            self.assertEqual(response.status_code, 404, values)
+        self.assertEqual(self.client.get('/post/?cursor=!!!').status_code, 404)
+
+    def test_search_keeps_relevance_order(self):
+        relevant = Post.objects.create(user=self.user, content='tuyển dụng tuyển dụng tuyển dụng')
+        Post.objects.create(user=self.user, content='tuyển dụng')
+        response = self.client.get('/post/?q=tuyen dung&cursor=')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['id'], relevant.id)
+
+
+class SearchIndexTests(TestCase):
+    def test_terms_equal_under_db_collation_are_merged(self):
+        user = User.objects.create(username='alumni', email='alumni@example.com', role=1)
+        post = Post.objects.create(user=user, content='Straße strasse ＳＴＲＡＳＳＥ Đường duong')
+        terms = dict(PostSearchTerm.objects.filter(post=post).values_list('term', 'frequency'))
+        self.assertEqual(terms, {'strasse': 3, 'duong': 2})
+
+
+class CommentThreadTests(TestCase):
+    def test_shape_params_only_apply_to_root_comments(self):
+        user = User.objects.create(username='alumni', email='alumni@example.com', role=1)
+        post = Post.objects.create(user=user, content='bài viết')
+        root = Comment.objects.create(user=user, post=post, content='gốc')
+        Comment.objects.create(user=user, post=post, content='phản hồi', parent=root, root=root)
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.get(f'/post/{post.id}/comment-threads/?fields=id,replies')
+        self.assertEqual(response.status_code, 200)
+        thread = response.data['results'][0]
+        self.assertEqual(set(thread), {'id', 'replies'})
+        self.assertEqual(thread['replies'][0]['content'], 'phản hồi')
+        self.assertEqual(thread['replies'][0]['user']['id'], user.id)
+
+
+class SurveySyncQuestionsTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='admin', email='admin@example.com', role=0)
+        self.survey = SurveyPost.objects.create(user=self.admin, content='khảo sát', end_time=timezone.now())
+        self.question = SurveyQuestion.objects.create(survey_post=self.survey, question='Bạn làm ngành gì?')
+        self.kept = SurveyOption.objects.create(survey_question=self.question, option='IT')
+        self.removed = SurveyOption.objects.create(survey_question=self.question, option='Khác')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def answer(self, username, option):
+        user = User.objects.create(username=username, email=f'{username}@example.com', role=1)
+        SurveyCompletion.objects.create(user=user, survey_post=self.survey)
+        UserSurveyOption.objects.create(user=user, survey_option=option)
+        SurveyPost.objects.filter(pk=self.survey.pk).update(respondent_count=F('respondent_count') + 1)
+        return user
+
+    def put_questions(self, questions):
+        return self.client.put(f'/survey/{self.survey.id}/', {'questions': questions}, format='json')
+
+    def test_string_ids_update_in_place_and_keep_answers(self):
+        user = self.answer('it', self.kept)
+        response = self.put_questions([{'id': str(self.question.id), 'question': 'Ngành nghề?', 'options': [
+            {'id': str(self.kept.id), 'option': 'CNTT'}, {'id': str(self.removed.id), 'option': 'Khác'},
+        ]}])
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(SurveyOption.objects.get(pk=self.kept.pk).option, 'CNTT')
+        self.assertEqual(SurveyOption.objects.count(), 2)
+        self.assertTrue(UserSurveyOption.objects.filter(user=user, survey_option=self.kept).exists())
+
+    def test_unknown_ids_are_rejected(self):
+        other = SurveyPost.objects.create(user=self.admin, content='khác', end_time=timezone.now())
+        other_question = SurveyQuestion.objects.create(survey_post=other, question='?')
+        other_option = SurveyOption.objects.create(survey_question=other_question, option='?')
+        for questions in ([{'id': other_question.id, 'question': '?', 'options': []}],
+                          [{'id': self.question.id, 'question': '?', 'options': [{'id': other_option.id, 'option': '?'}]}],
+                          [{'id': 'abc', 'question': '?', 'options': []}]):
+            response = self.put_questions(questions)
+            self.assertEqual(response.status_code, 400, questions)
+        self.assertEqual(SurveyOption.objects.filter(survey_question=self.question).count(), 2)
+        self.assertEqual(SurveyQuestion.objects.get(pk=other_question.pk).question, '?')
+
+    def test_removing_options_recomputes_completions(self):
+        self.answer('it', self.kept)
+        removed_user = self.answer('khac', self.removed)
+        response = self.put_questions([{'id': self.question.id, 'question': self.question.question,
+                                        'options': [{'id': self.kept.id, 'option': 'IT'}]}])
+        self.assertEqual(response.status_code, 200, response.data)
+        self.survey.refresh_from_db()
+        self.assertEqual(self.survey.respondent_count, 1)
+        self.assertFalse(SurveyCompletion.objects.filter(user=removed_user).exists())
+        self.assertEqual(SurveyCompletion.objects.filter(survey_post=self.survey).count(), 1)
+
+
+class SurveyQuestionCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin', email='admin@example.com', role=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.surveys = []
+        for i in range(2):
+            survey = SurveyPost.objects.create(user=self.admin, content=f'khảo sát {i}', end_time=timezone.now())
+            for j in range(3):
+                question = SurveyQuestion.objects.create(survey_post=survey, question=f'Câu {j}?')
+                for text in ('Có', 'Không'):
+                    SurveyOption.objects.create(survey_question=question, option=text)
+            self.surveys.append(survey)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries.captured_queries), response.data
+
+    def test_reads_serve_questions_from_cache(self):
+        for url in ('/survey/', f'/survey/{self.surveys[0].id}/'):
+            cache.clear()
+            cold, data = self.count_queries(url)
+            warm, cached = self.count_queries(url)
+            self.assertEqual(cached, data)
+            # Mỗi khảo sát đọc cây câu hỏi bằng 2 truy vấn (câu hỏi + lựa chọn) khi cache chưa có
+            surveys = len(data) if isinstance(data, list) else 1
+            self.assertEqual(cold - warm, 2 * surveys, url)
+
+    def test_update_bumps_version_and_invalidates_cache(self):
+        survey = self.surveys[0]
+        url = f'/survey/{survey.id}/'
+        self.count_queries(url)
+        version = SurveyPost.objects.get(pk=survey.pk).cache_version
+        question = survey.questions.order_by('id').first()
+        options = [{'id': option.id, 'option': option.option} for option in question.options.order_by('id')]
+
+        response = self.client.put(url, {'questions': [{'id': question.id, 'question': 'Câu đã sửa?',
+                                                        'options': options}]}, format='json')
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertGreater(SurveyPost.objects.get(pk=survey.pk).cache_version, version)
+        _, data = self.count_queries(url)
+        self.assertEqual([q['question'] for q in data['questions']], ['Câu đã sửa?'])
+
+class ChatInboxPaginationTests(TestCase):
+    def test_inbox_pages_by_cursor_and_keeps_empty_rooms(self):
+        user = User.objects.create(username='alumni', email='alumni@example.com', role=1)
+        client = APIClient()
+        client.force_authenticate(user)
+        room_ids = []
+        for i in range(10):
+            other = User.objects.create(username=f'friend{i}', email=f'friend{i}@example.com', role=1)
+            room_ids.append(client.post('/chat/', {'user_id': other.id}, format='json').data['id'])
+        client.post(f'/chat/{room_ids[0]}/send_message/', {'content': 'xin chào'}, format='json')
+
+        ids, url = [], '/chat/'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+            ids += [room['id'] for room in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, [room_ids[0]] + room_ids[:0:-1])
+        empty_room = client.get('/chat/').data['results'][1]
+        self.assertIsNone(empty_room['last_message_time'])
+
+
+class SurveyExportTests(TestCase):
+    def test_csv_cells_cannot_start_a_formula(self):
+        admin = User.objects.create(username='admin', email='admin@example.com', role=0)
+        alumni = User.objects.create(username='@alumni', email='alumni@example.com', role=1, first_name='=cmd|',
+                                     last_name='x')
+        survey = SurveyPost.objects.create(user=admin, content='khảo sát', end_time=timezone.now())
+        question = SurveyQuestion.objects.create(survey_post=survey, question='+Thu nhập')
+        option = SurveyOption.objects.create(survey_question=question, option='-10 triệu')
+        SurveyCompletion.objects.create(user=alumni, survey_post=survey)
+        UserSurveyOption.objects.create(user=alumni, survey_option=option)
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        response = client.get(f'/survey/{survey.id}/export/')
+        self.assertEqual(response.status_code, 200)
+        header, row = b''.join(response.streaming_content).decode().lstrip('\ufeff').splitlines()
+        self.assertTrue(header.endswith(",'+Thu nhập"))
+        self.assertEqual(row.split(',')[1:], ["'@alumni", "'=cmd| x", '', "'-10 triệu"])
+
+
+    def test_tab_and_carriage_return_prefixes_are_escaped(self):
+        admin = User.objects.create(username='admin', email='admin@example.com', role=0)
+        alumni = User.objects.create(username='alumni', email='alumni@example.com', role=1)
+        survey = SurveyPost.objects.create(user=admin, content='khảo sát', end_time=timezone.now())
+        for text in ('\t=1+1', '\r=1+1'):
+            question = SurveyQuestion.objects.create(survey_post=survey, question=text)
+            UserSurveyOption.objects.create(user=alumni, survey_option=SurveyOption.objects.create(
+                survey_question=question, option=text))
+        SurveyCompletion.objects.create(user=alumni, survey_post=survey)
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        response = client.get(f'/survey/{survey.id}/export/')
+        content = b''.join(response.streaming_content).decode().lstrip('\ufeff')
+        header, row = csv.reader(StringIO(content, newline=''))
+        self.assertEqual(header[-2:], ["'\t=1+1", "'\r=1+1"])
+        self.assertEqual(row[-2:], ["'\t=1+1", "'\r=1+1"])
+
+class PostCounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alumni', email='alumni@example.com', role=1)
+        self.post = Post.objects.create(user=self.user, content='bài viết')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def counters(self):
+        return Post.objects.values('comment_count', 'like_count', 'haha_count', 'love_count').get(pk=self.post.pk)
+
+    def test_reactions_move_between_counters(self):
+        self.assertEqual(self.client.post(f'/post/{self.post.id}/react/', {'reaction': 1}).status_code, 201)
+        self.assertEqual(self.client.post(f'/post/{self.post.id}/react/', {'reaction': 3}).status_code, 200)
+        self.assertEqual(self.client.post(f'/post/{self.post.id}/react/', {'reaction': 9}).status_code, 400)
+        self.assertEqual(self.counters(), {'comment_count': 0, 'like_count': 0, 'haha_count': 0, 'love_count': 1})
+        self.client.delete(f'/post/{self.post.id}/react/')
+        self.assertEqual(self.counters()['love_count'], 0)
+
+    def test_comments_and_replies_are_counted(self):
+        comment_id = self.client.post(f'/post/{self.post.id}/comment/', {'content': 'bình luận'}).data['id']
+        self.client.post(f'/comment/{comment_id}/reply/', {'content': 'phản hồi'})
+        self.assertEqual(self.counters()['comment_count'], 2)
+        self.assertEqual(Comment.objects.get(pk=comment_id).reply_count, 1)
+        self.client.delete(f'/comment/{comment_id}/')
+        self.assertEqual(self.counters()['comment_count'], 1)
+
+    def test_rebuild_command_recounts_from_rows(self):
+        self.client.post(f'/post/{self.post.id}/comment/', {'content': 'bình luận'})
+        self.client.post(f'/post/{self.post.id}/react/', {'reaction': 2})
+        Post.objects.update(comment_count=50, haha_count=0, like_count=7)
+        call_command('rebuild_post_counters', stdout=StringIO())
+        self.assertEqual(self.counters(), {'comment_count': 1, 'like_count': 0, 'haha_count': 1, 'love_count': 0})
+
+
+class MessagePaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alumni', email='alumni@example.com', role=1)
+        friend = User.objects.create(username='friend', email='friend@example.com', role=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room_id = self.client.post('/chat/', {'user_id': friend.id}, format='json').data['id']
+        for i in range(20):
+            self.client.post(f'/chat/{self.room_id}/send_message/', {'content': f'tin {i}'}, format='json')
+
+    def test_before_id_pages_from_newest_to_oldest(self):
+        contents, url = [], f'/chat/{self.room_id}/messages/'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+            contents += [message['content'] for message in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(contents, [f'tin {i}' for i in range(19, -1, -1)])
+
+    def test_invalid_before_id_returns_404(self):
+        for before_id in ('abc', '1.5'):
+            response = self.client.get(f'/chat/{self.room_id}/messages/?before_id={before_id}')
+            self.assertEqual(response.status_code, 404, before_id)
+
+
+class SurveySubmissionTests(TestCase):
+    def setUp(self):
+        admin = User.objects.create(username='admin', email='admin@example.com', role=0)
+        self.user = User.objects.create(username='alumni', email='alumni@example.com', role=1)
+        self.survey = SurveyPost.objects.create(user=admin, content='khảo sát', end_time=timezone.now())
+        self.single = SurveyQuestion.objects.create(survey_post=self.survey, question='Ngành?')
+        self.multi = SurveyQuestion.objects.create(survey_post=self.survey, question='Kỹ năng?', multi_choice=True)
+        self.single_options = [SurveyOption.objects.create(survey_question=self.single, option=text)
+                               for text in ('IT', 'Kinh tế')]
+        self.multi_options = [SurveyOption.objects.create(survey_question=self.multi, option=text)
+                              for text in ('Python', 'SQL')]
+        other = SurveyPost.objects.create(user=admin, content='khác', end_time=timezone.now())
+        self.foreign_option = SurveyOption.objects.create(
+            survey_question=SurveyQuestion.objects.create(survey_post=other, question='?'), option='?')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/survey/{self.survey.id}/submit/'
+
+    def submit(self, single, multi):
+        answers = {str(self.single.id): [o.id for o in single], str(self.multi.id): [o.id for o in multi]}
+        return self.client.post(self.url, {'answers': answers}, format='json')
+
+    def test_invalid_answers_are_rejected_without_writes(self):
+        cases = [
+            ([self.foreign_option], [self.multi_options[0]]),   # lựa chọn của khảo sát khác
+            ([self.multi_options[0]], [self.multi_options[1]]),  # lựa chọn của câu hỏi khác
+            (self.single_options, [self.multi_options[0]]),      # nhiều lựa chọn cho câu chọn 1
+            ([self.single_options[0]], []),                       # bỏ trống câu hỏi
+        ]
+        for single, multi in cases:
+            self.assertEqual(self.submit(single, multi).status_code, 400)
+        self.assertEqual(self.client.post(self.url, {'answers': {'x': [1]}}, format='json').status_code, 400)
+        self.assertFalse(UserSurveyOption.objects.exists())
+        self.assertFalse(SurveyCompletion.objects.exists())
+
+    def test_submission_is_recorded_once(self):
+        response = self.submit([self.single_options[0]], self.multi_options)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(UserSurveyOption.objects.filter(user=self.user).count(), 3)
+        self.assertTrue(SurveyCompletion.objects.filter(user=self.user, survey_post=self.survey).exists())
+        self.assertEqual(self.submit([self.single_options[1]], self.multi_options[:1]).status_code, 400)
+        self.assertEqual(UserSurveyOption.objects.filter(user=self.user).count(), 3)
+
+
+class SurveyTallyTests(TestCase):
+    def setUp(self):
+        admin = User.objects.create(username='admin', email='admin@example.com', role=0)
+        self.survey = SurveyPost.objects.create(user=admin, content='khảo sát', end_time=timezone.now())
+        self.question = SurveyQuestion.objects.create(survey_post=self.survey, question='Kỹ năng?',
+                                                      multi_choice=True)
+        self.options = [SurveyOption.objects.create(survey_question=self.question, option=text)
+                        for text in ('Python', 'SQL')]
+        for i, chosen in enumerate((self.options, self.options[:1])):
+            client = APIClient()
+            client.force_authenticate(User.objects.create(username=f'alumni{i}', email=f'alumni{i}@example.com',
+                                                          role=1))
+            answers = {str(self.question.id): [option.id for option in chosen]}
+            client.post(f'/survey/{self.survey.id}/submit/', {'answers': answers}, format='json')
+
+    def test_submit_updates_counters_and_results(self):
+        self.survey.refresh_from_db()
+        self.assertEqual(self.survey.respondent_count, 2)
+        with CaptureQueriesContext(connection) as queries:
+            results = self.survey.results()
+        self.assertEqual(len(queries.captured_queries), 1)
+        self.assertEqual([(o['text'], o['count']) for o in results[0]['options']], [('Python', 2), ('SQL', 1)])
+
+        client = APIClient()
+        client.force_authenticate(self.survey.user)
+        response = client.get(f'/survey/{self.survey.id}/results/')
+        self.assertEqual(response.data['respondent_count'], 2)
+
+    def test_rebuild_command_recounts_from_answers(self):
+        SurveyOption.objects.update(response_count=9)
+        SurveyPost.objects.update(respondent_count=5)
+        call_command('rebuild_survey_tallies', stdout=StringIO())
+        self.survey.refresh_from_db()
+        self.assertEqual(self.survey.respondent_count, 2)
+        self.assertEqual(list(SurveyOption.objects.order_by('id').values_list('response_count', flat=True)), [2, 1])
+
+
+class SurveyCrosstabTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        admin = User.objects.create(username='admin', email='admin@example.com', role=0)
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+        career = SurveyPost.objects.create(user=admin, content='Nghề nghiệp', end_time=timezone.now())
+        job = SurveyPost.objects.create(user=admin, content='Việc làm', end_time=timezone.now())
+        self.graduated = SurveyQuestion.objects.create(survey_post=career, question='Đã tốt nghiệp?')
+        self.skills = SurveyQuestion.objects.create(survey_post=career, question='Kỹ năng?', multi_choice=True)
+        self.status = SurveyQuestion.objects.create(survey_post=job, question='Tình trạng?')
+        self.yes, self.no = self.options(self.graduated, 'Có', 'Chưa')
+        self.python, self.sql, self.go = self.options(self.skills, 'Python', 'SQL', 'Go')
+        self.employed, self.studying = self.options(self.status, 'Đi làm', 'Học tiếp')
+        answers = [
+            [self.yes, self.python, self.sql, self.employed],
+            [self.yes, self.sql, self.studying],
+            [self.no, self.python, self.employed],
+            [self.no, self.go],
+            [self.employed],
+        ]
+        for i, chosen in enumerate(answers):
+            user = User.objects.create(username=f'alumni{i}', email=f'alumni{i}@example.com', role=1)
+            UserSurveyOption.objects.bulk_create(UserSurveyOption(user=user, survey_option_id=option) for option in chosen)
+
+    @staticmethod
+    def options(question, *texts):
+        return [SurveyOption.objects.create(survey_question=question, option=text).id for text in texts]
+
+    def crosstab(self, row, column=None, filters=()):
+        params = {'row': row, 'filters': ','.join(map(str, filters))}
+        if column is not None:
+            params['column'] = column
+        return self.client.get('/survey/crosstab/', params)
+
+    def test_single_question_counts_respondents_of_its_survey(self):
+        response = self.crosstab(self.skills.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['respondents'], 4)
+        self.assertEqual([option['id'] for option in response.data['rows']], [self.python, self.sql, self.go])
+        self.assertEqual(response.data['row_totals'], [2, 2, 1])
+        self.assertNotIn('counts', response.data)
+
+    def test_row_by_column_counts(self):
+        response = self.crosstab(self.graduated.id, self.skills.id)
+        self.assertEqual(response.data['counts'], [[1, 2, 0], [1, 0, 1]])
+        self.assertEqual(response.data['row_totals'], [2, 2])
+        self.assertEqual(response.data['column_totals'], [2, 2, 1])
+
+    def test_cross_survey_counts_only_respondents_of_both(self):
+        response = self.crosstab(self.graduated.id, self.status.id)
+        self.assertEqual(response.data['respondents'], 3)
+        self.assertEqual(response.data['counts'], [[1, 1], [1, 0]])
+
+    def test_filters_or_within_question_and_across_questions(self):
+        response = self.crosstab(self.graduated.id, filters=[self.python, self.go])
+        self.assertEqual((response.data['respondents'], response.data['row_totals']), (3, [1, 2]))
+
+        response = self.crosstab(self.graduated.id, filters=[self.sql, self.employed])
+        self.assertEqual((response.data['respondents'], response.data['row_totals']), (1, [1, 0]))
+
+    def test_unknown_ids_are_rejected(self):
+        self.assertEqual(self.crosstab(self.graduated.id, 0).status_code, 400)
+        self.assertEqual(self.crosstab(0).status_code, 400)
+        self.assertEqual(self.crosstab(self.graduated.id, filters=[0]).status_code, 400)
+        self.assertEqual(self.crosstab('abc').status_code, 400)
+        with self.assertRaises(analytics.AnalyticsError):
+            analytics.crosstab(self.graduated.id, filter_option_ids=[self.python, 0])
+
+class PostShapeQueryCountTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alumni', email='alumni@example.com', role=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_posts(self, count):
+        for i in range(count):
+            post = Post.objects.create(user=self.user, content=f'bài viết {i}')
+            PostImage.objects.create(post=post, image=f'socialnetwork/{i}')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries.captured_queries), response.data['results']
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        shapes = ['', '&expand=', '&expand=user', '&expand=images', '&fields=id,images', '&fields=id,content']
+        self.add_posts(2)
+        few = {shape: self.count_queries(f'/post/?cursor={shape}')[0] for shape in shapes}
+        self.add_posts(3)
+        for shape in shapes:
+            queries, results = self.count_queries(f'/post/?cursor={shape}')
+            self.assertEqual(len(results), 5)
+            self.assertEqual(queries, few[shape], shape)
+
+    def test_query_count_is_the_same_for_every_post_type(self):
+        self.add_posts(1)
+        baseline, _ = self.count_queries('/post/?cursor=')
+        SurveyPost.objects.create(user=self.user, content='khảo sát', end_time=timezone.now())
+        EventInvitePost.objects.create(user=self.user, content='thư mời', title='Hội thảo')
+        self.add_posts(1)
+
+        with self.assertNumQueries(baseline):
+            response = self.client.get('/post/?cursor=')
+        results = {post['object_type']: post for post in response.data['results']}
+        self.assertEqual(set(results), {'post', 'survey', 'invitation'})
+        self.assertIn('end_time', results['survey'])
+        self.assertEqual(results['invitation']['title'], 'Hội thảo')
+
+    def test_collapsed_images_are_ids(self):
+        self.add_posts(1)
+        _, results = self.count_queries('/post/?cursor=&expand=')
+        self.assertEqual(results[0]['images'], list(PostImage.objects.values_list('id', flat=True)))
+
+
+class ChatMarkAsReadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alumni', email='alumni@example.com', role=1)
+        self.friend = User.objects.create(username='friend', email='friend@example.com', role=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.friend_client = APIClient()
+        self.friend_client.force_authenticate(self.friend)
+        self.room_id = self.client.post('/chat/', {'user_id': self.friend.id}, format='json').data['id']
+
+    def send(self, client, content):
+        return client.post(f'/chat/{self.room_id}/send_message/', {'content': content}, format='json').data['id']
+
+    def participant(self):
+        return ChatParticipant.objects.get(chat_room_id=self.room_id, user=self.user)
+
+    def test_mark_as_read_clears_unread(self):
+        self.send(self.friend_client, 'một')
+        last_id = self.send(self.friend_client, 'hai')
+        self.assertEqual(self.participant().unread_count, 2)
+        response = self.client.post(f'/chat/{self.room_id}/mark_as_read/')
+        self.assertEqual(response.data, {'is_read': True, 'unread_count': 0, 'last_read_message_id': last_id})
+
+    def test_message_arriving_during_mark_as_read_stays_unread(self):
+        seen_id = self.send(self.friend_client, 'một')
+        get_room = views.get_object_or_404
+
+        def get_room_then_receive(*args, **kwargs):
+            # Tin nhắn mới tới sau khi view đã đọc phòng (và last_message_id), trước câu UPDATE
+            room = get_room(*args, **kwargs)
+            with mock.patch.object(views, 'get_object_or_404', get_room):
+                self.send(self.friend_client, 'hai')
+            return room
+
+        with mock.patch.object(views, 'get_object_or_404', get_room_then_receive):
+            response = self.client.post(f'/chat/{self.room_id}/mark_as_read/')
+        self.assertEqual(response.data, {'is_read': False, 'unread_count': 1, 'last_read_message_id': seen_id})
+        participant = self.participant()
+        self.assertEqual((participant.last_read_message_id, participant.unread_count), (seen_id, 1))
+
+
+class SendUserEmailsTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f'alumni{i}', email=f'alumni{i}@example.com', role=1)
+                      for i in range(3)]
+        self.user_ids = [user.id for user in self.users]
+        self.sendgrid = mock.Mock()
+        patcher = mock.patch.object(tasks, 'get_sendgrid_client', return_value=self.sendgrid)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def recipients(self):
+        return [sorted(p['to'][0]['email'] for p in call.args[0].get()['personalizations'])
+                for call in self.sendgrid.send.call_args_list]
+
+    def test_each_user_is_sent_once(self):
+        self.assertEqual(tasks.send_user_emails.apply(('account_verified', self.user_ids)).get(), 3)
+        self.assertEqual(tasks.send_user_emails.apply(('account_verified', self.user_ids)).get(), 0)
+        self.assertEqual(len(self.recipients()), 1)
+        self.assertFalse(EmailDelivery.objects.filter(sent_date__isnull=True).exists())
+
+    def test_rows_claimed_by_another_task_are_skipped_until_the_claim_expires(self):
+        EmailDelivery.objects.bulk_create([EmailDelivery(user=user, event='account_verified') for user in self.users])
+        EmailDelivery.objects.filter(user=self.users[0]).update(claim_token=uuid.uuid4(), claimed_date=timezone.now())
+        EmailDelivery.objects.filter(user=self.users[1]).update(
+            claim_token=uuid.uuid4(), claimed_date=timezone.now() - tasks.EMAIL_CLAIM_TIMEOUT * 2)
+
+        self.assertEqual(tasks.send_user_emails.apply(('account_verified', self.user_ids)).get(), 2)
+        self.assertEqual(self.recipients(), [['alumni1@example.com', 'alumni2@example.com']])
+        self.assertFalse(EmailDelivery.objects.filter(user=self.users[0], sent_date__isnull=False).exists())
+
+    def test_failed_send_releases_the_claim(self):
+        self.sendgrid.send.side_effect = RuntimeError('SendGrid down')
+        with mock.patch.object(tasks.send_user_emails, 'retry', side_effect=RuntimeError('retry')):
+            tasks.send_user_emails.apply(('account_verified', self.user_ids))
+        self.assertEqual(EmailDelivery.objects.filter(claim_token__isnull=True, sent_date__isnull=True).count(), 3)
+
+        self.sendgrid.send.side_effect = None
+        self.assertEqual(tasks.send_user_emails.apply(('account_verified', self.user_ids)).get(), 3)
+
+
+class InvitationDispatchTests(TestCase):
+    def setUp(self):
+        admin = User.objects.create(username='admin', email='admin@example.com', role=0)
+        self.users = [User.objects.create(username=f'alumni{i}', email=f'alumni{i}@example.com', role=1)
+                      for i in range(4)]
+        group = Group.objects.create(group_name='K2020')
+        group.users.set(self.users[1:3])
+        self.post = EventInvitePost.objects.create(user=admin, title='Hội thảo', content='Mời tham dự')
+        # alumni1 vừa được mời riêng vừa thuộc nhóm
+        self.post.individuals.set(self.users[:2])
+        self.post.groups.add(group)
+        self.dispatch = InvitationDispatch.objects.create(post=self.post)
+        self.sendgrid = mock.Mock()
+        patcher = mock.patch.object(tasks, 'get_sendgrid_client', return_value=self.sendgrid)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def recipients(self):
+        return sorted(p['to'][0]['email'] for call in self.sendgrid.send.call_args_list
+                      for p in call.args[0].get()['personalizations'])
+
+    def run_dispatch(self):
+        return tasks.dispatch_invitation.apply((self.dispatch.id,)).get()
+
+    def test_recipients_are_deduplicated(self):
+        self.assertEqual(self.run_dispatch(), 3)
+        self.assertEqual(self.recipients(), ['alumni0@example.com', 'alumni1@example.com', 'alumni2@example.com'])
+        self.dispatch.refresh_from_db()
+        self.assertEqual((self.dispatch.status, self.dispatch.total), (InvitationDispatch.Status.DONE, 3))
+
+    def test_resume_resends_only_failed_recipients(self):
+        self.sendgrid.send.side_effect = [RuntimeError('SendGrid down'), None, None]
+        with mock.patch.object(tasks, 'SENDGRID_BATCH_SIZE', 2):
+            self.assertEqual(self.run_dispatch(), 1)
+        self.dispatch.refresh_from_db()
+        self.assertEqual((self.dispatch.status, self.dispatch.failed_count), (InvitationDispatch.Status.PARTIAL, 2))
+        failed = set(self.dispatch.recipients.filter(status=InvitationRecipient.Status.FAILED).values_list('user_id', flat=True))
+
+        self.sendgrid.send.reset_mock()
+        with mock.patch.object(tasks.dispatch_invitation, 'delay', side_effect=lambda pk: tasks.dispatch_invitation.apply((pk,))), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(tasks.resume_invitation_dispatch(self.dispatch), 2)
+
+        self.assertEqual(self.recipients(), sorted(User.objects.get(pk=pk).email for pk in failed))
+        self.dispatch.refresh_from_db()
+        self.assertEqual((self.dispatch.status, self.dispatch.sent_count, self.dispatch.failed_count),
+                         (InvitationDispatch.Status.DONE, 3, 0))
+        self.assertEqual(InvitationRecipient.objects.filter(status=InvitationRecipient.Status.SENT).count(), 3)
+
+    def test_second_run_does_not_send_again(self):
+        InvitationDispatch.objects.filter(pk=self.dispatch.pk).update(status=InvitationDispatch.Status.RUNNING)
+        self.assertIsNone(self.run_dispatch())
+        self.sendgrid.send.assert_not_called()
+
+        InvitationDispatch.objects.filter(pk=self.dispatch.pk).update(status=InvitationDispatch.Status.PENDING)
+        self.assertEqual(self.run_dispatch(), 3)
+        self.assertIsNone(self.run_dispatch())
+        self.assertEqual(self.sendgrid.send.call_count, 1)
+
+class RecordingBroker:
+    def __init__(self):
+        self.events = []
+
+    def publish(self, channel, event):
+        self.events.append((channel, event['type']))
+
+
+class RealtimeTests(TestCase):
+    def setUp(self):
+        self.broker = RecordingBroker()
+        for patcher in (mock.patch.object(realtime, 'get_broker', return_value=self.broker),
+                        # Không đẩy việc đồng bộ Firestore lên Celery khi chạy on_commit
+                        mock.patch.object(tasks.replicate_chat_room, 'delay')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = User.objects.create(username='alumni', email='alumni@example.com', role=1)
+        self.friend = User.objects.create(username='friend', email='friend@example.com', role=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_events_are_published_only_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                realtime.publish_on_commit(['feed'], {'type': 'post.created'})
+                self.assertEqual(self.broker.events, [])
+        self.assertEqual(self.broker.events, [('feed', 'post.created')])
+
+    def test_nothing_is_published_on_rollback(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    realtime.publish_on_commit(['feed'], {'type': 'post.created'})
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.broker.events, [])
+
+    def test_chat_events_fan_out_to_both_users_and_posts_to_the_feed(self):
+        room_id = self.client.post('/chat/', {'user_id': self.friend.id}, format='json').data['id']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/chat/{room_id}/send_message/', {'content': 'xin chào'}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/chat/{room_id}/mark_as_read/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/post/', {'content': 'bài viết mới'}, format='json')
+        users = {f'user:{self.user.id}', f'user:{self.friend.id}'}
+        self.assertEqual({channel for channel, kind in self.broker.events if kind == 'chat.message'}, users)
+        self.assertEqual({channel for channel, kind in self.broker.events if kind == 'chat.read'}, users)
+        self.assertEqual([channel for channel, kind in self.broker.events if kind == 'post.created'], ['feed'])
+
+    def test_stream_rejects_anonymous_users(self):
+        response = self.client_class().get('/realtime/stream/')
+        self.assertEqual(response.status_code, 401)
+
+
+class InMemoryBrokerTests(TestCase):
+    def test_subscriber_only_receives_its_channels(self):
+        broker = realtime.InMemoryBroker()
+
+        async def run():
+            events = broker.subscribe(['user:1'], heartbeat=0.05)
+            self.assertIsNone(await events.__anext__())  # chưa có sự kiện -> heartbeat
+            received = asyncio.ensure_future(events.__anext__())
+            await asyncio.sleep(0.01)
+            broker.publish('user:2', {'type': 'chat.message', 'room_id': 2})
+            broker.publish('user:1', {'type': 'chat.message', 'room_id': 1})
+            self.assertEqual(await received, {'type': 'chat.message', 'room_id': 1})
+            await events.aclose()
+
+        asyncio.run(run())
+        self.assertEqual(dict(broker._subscribers), {})
+
+
+class Retried(Exception):
+    pass
+
+
+class ChatOutboxReplicationTests(TestCase):
+    def setUp(self):
+        caches['locks'].clear()
+        self.calls = []
+        self.failures = []
+        for name in ('create_chat_room', 'replicate_messages', 'update_read_cursor', 'mark_messages_as_read'):
+            patcher = mock.patch.object(firebase_config, name, side_effect=self.recorder(name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for patcher in (mock.patch.object(tasks.replicate_chat_room, 'delay'),
+                        mock.patch.object(tasks.replicate_chat_room, 'retry', side_effect=Retried)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        user = User.objects.create(username='alumni', email='alumni@example.com', role=1)
+        friend = User.objects.create(username='friend', email='friend@example.com', role=1)
+        client, friend_client = APIClient(), APIClient()
+        client.force_authenticate(user)
+        friend_client.force_authenticate(friend)
+        self.room_id = client.post('/chat/', {'user_id': friend.id}, format='json').data['id']
+        send = lambda content: client.post(f'/chat/{self.room_id}/send_message/', {'content': content}, format='json')
+        self.message_ids = [send('một').data['id'], send('hai').data['id']]
+        friend_client.post(f'/chat/{self.room_id}/mark_as_read/')
+        self.message_ids.append(send('ba').data['id'])
+
+    def recorder(self, name):
+        def record(room_id, *args, **kwargs):
+            if self.failures:
+                raise self.failures.pop(0)
+            if name == 'replicate_messages':
+                self.calls.append((name, [message['id'] for message in args[0]]))
+            else:
+                self.calls.append((name,))
+        return record
+
+    def replicate(self):
+        return tasks.replicate_chat_room.apply(args=(self.room_id,), throw=True).get()
+
+    def pending(self):
+        return ChatOutbox.objects.filter(chat_room_id=self.room_id, processed_date__isnull=True)
+
+    def test_events_are_applied_in_order_per_room(self):
+        self.assertEqual(self.replicate(), 5)
+        first, second, third = self.message_ids
+        self.assertEqual(self.calls, [('create_chat_room',), ('replicate_messages', [first, second]),
+                                      ('update_read_cursor',), ('mark_messages_as_read',),
+                                      ('replicate_messages', [third])])
+        self.assertFalse(self.pending().exists())
+
+    def test_failed_write_keeps_events_pending_and_retries_from_there(self):
+        self.failures.append(RuntimeError('Firestore down'))
+        with self.assertRaises(Retried):
+            self.replicate()
+        self.assertEqual(self.pending().count(), 5)
+        self.assertEqual(set(self.pending().values_list('attempts', flat=True)), {1})
+        self.assertEqual(caches['locks'].get(tasks.chat_outbox_lock_key(self.room_id)), None)
+
+        self.assertEqual(self.replicate(), 5)
+        self.assertEqual(self.calls[0], ('create_chat_room',))
+        self.assertFalse(self.pending().exists())
+
+    def test_lock_is_renewed_before_each_batch(self):
+        renew = mock.Mock(wraps=tasks.renew_chat_outbox_lock)
+        with mock.patch.object(tasks, 'CHAT_OUTBOX_BATCH_SIZE', 2), \
+                mock.patch.object(tasks, 'renew_chat_outbox_lock', renew):
+            self.assertEqual(self.replicate(), 5)
+        # 3 batch + 1 lần đọc thấy outbox đã hết
+        self.assertEqual(renew.call_count, 4)
+
+    def test_worker_stops_when_its_lock_was_taken_over(self):
+        apply_events = tasks.apply_chat_events
+
+        def apply_then_lose_lock(chat_room, events):
+            apply_events(chat_room, events)
+            caches['locks'].set(tasks.chat_outbox_lock_key(self.room_id), 'other-worker')
+
+        with mock.patch.object(tasks, 'CHAT_OUTBOX_BATCH_SIZE', 2), \
+                mock.patch.object(tasks, 'apply_chat_events', apply_then_lose_lock):
+            with self.assertRaises(Retried):
+                self.replicate()
+        self.assertEqual(self.pending().count(), 3)
+        self.assertEqual(caches['locks'].get(tasks.chat_outbox_lock_key(self.room_id)), 'other-worker')
+
+    def test_second_worker_does_not_process_a_locked_room(self):
+        caches['locks'].add(tasks.chat_outbox_lock_key(self.room_id), 'other-worker', 60)
+        with self.assertRaises(Retried):
+            self.replicate()
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.pending().count(), 5)
+
+
+class ChatRoomCreateTests(TestCase):
+    def test_concurrent_create_returns_the_existing_room(self):
+        user = User.objects.create(username='alumni', email='alumni@example.com', role=1)
+        friend = User.objects.create(username='friend', email='friend@example.com', role=1)
+        # Request song song đã tạo phòng sau lúc request này kiểm tra between()
+        room = ChatRoom.objects.create(**ChatRoom.ordered_users(user, friend))
+        between = ChatRoom.objects.between
+        lookups = iter([ChatRoom.objects.none()])
+        client = APIClient()
+        client.force_authenticate(user)
+
+        with mock.patch.object(ChatRoom.objects, 'between', side_effect=lambda *users: next(lookups, None) or between(*users)):
+            response = client.post('/chat/', {'user_id': friend.id}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], room.id)
+        self.assertEqual(ChatRoom.objects.count(), 1)
+        self.assertFalse(ChatParticipant.objects.exists())
+        self.assertFalse(ChatOutbox.objects.exists())
+
+
+class MergeDuplicateChatRoomsMigrationTests(TransactionTestCase):
+    migrate_from = [('socialnetwork', '0033_message_keyset_index')]
+    migrate_to = [('socialnetwork', '0034_chatroom_canonical_pair')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_rooms_of_the_same_pair_are_merged_into_the_oldest(self):
+        apps = self.migrate(self.migrate_from)
+        HistoricalUser = apps.get_model('socialnetwork', 'User')
+        HistoricalRoom = apps.get_model('socialnetwork', 'ChatRoom')
+        HistoricalParticipant = apps.get_model('socialnetwork', 'ChatParticipant')
+        HistoricalMessage = apps.get_model('socialnetwork', 'Message')
+        user = HistoricalUser.objects.create(username='alumni', email='alumni@example.com', role=1)
+        friend = HistoricalUser.objects.create(username='friend', email='friend@example.com', role=1)
+        # Phòng cũ chỉ có hộp thư của user, phòng trùng lưu ngược thứ tự có hộp thư của cả 2
+        keeper = HistoricalRoom.objects.create(user1=friend, user2=user)
+        duplicate = HistoricalRoom.objects.create(user1=user, user2=friend)
+        HistoricalParticipant.objects.create(chat_room=keeper, user=user, other_user=friend)
+        HistoricalParticipant.objects.create(chat_room=duplicate, user=user, other_user=friend)
+        moved = HistoricalParticipant.objects.create(chat_room=duplicate, user=friend, other_user=user)
+        first = HistoricalMessage.objects.create(chat_room=keeper, sender=user, content='một')
+        second = HistoricalMessage.objects.create(chat_room=duplicate, sender=friend, content='hai')
+        third = HistoricalMessage.objects.create(chat_room=duplicate, sender=user, content='ba')
+
+        apps = self.migrate(self.migrate_to)
+        Room = apps.get_model('socialnetwork', 'ChatRoom')
+        Participant = apps.get_model('socialnetwork', 'ChatParticipant')
+        Message = apps.get_model('socialnetwork', 'Message')
+        Outbox = apps.get_model('socialnetwork', 'ChatOutbox')
+
+        room = Room.objects.get()
+        self.assertEqual(room.pk, keeper.pk)
+        self.assertEqual((room.user1_id, room.user2_id), tuple(sorted((user.pk, friend.pk))))
+        self.assertEqual((room.last_message_id, room.last_message_sender_id), (third.pk, user.pk))
+        self.assertEqual(set(Message.objects.values_list('pk', 'chat_room_id')),
+                         {(first.pk, room.pk), (second.pk, room.pk), (third.pk, room.pk)})
+        participants = {participant.user_id: participant for participant in Participant.objects.all()}
+        self.assertEqual(set(participants), {user.pk, friend.pk})
+        self.assertEqual(participants[friend.pk].pk, moved.pk)
+        self.assertEqual(participants[friend.pk].chat_room_id, room.pk)
+        self.assertEqual(participants[friend.pk].unread_count, 2)
+        self.assertEqual(participants[user.pk].unread_count, 1)
+        self.assertEqual(sorted(Outbox.objects.filter(kind='message').values_list('payload__message_id', flat=True)),
+                         [second.pk, third.pk])
@@ -0,0 +1,140 @@
+import json
+import logging
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cloudinary
+from cloudinary import CloudinaryResource
+from cloudinary.uploader import destroy, upload
+from cloudinary.utils import api_sign_request, verify_api_response_signature
+from django.conf import settings
+from django.core import signing
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_FOLDER = 'MangXaHoi'
+ALLOWED_FORMATS = 'jpg,jpeg,png,gif,webp,heic'
+# upload_token cấp cho form đăng ký (chưa đăng nhập) chỉ dùng được trong khoảng thời gian này
+REGISTER_UPLOAD_TOKEN_MAX_AGE = 60 * 60
+REGISTER_UPLOAD_TOKEN_SALT = 'socialnetwork.uploads.register'
+
+# Pool dùng chung cho cả process để giới hạn số upload Cloudinary chạy đồng thời
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'CLOUDINARY_UPLOAD_WORKERS', 8),
+    thread_name_prefix='cloudinary-upload',
+)
+
+
+class ImageUploadError(Exception):
+    pass
+
+
+def upload_images(files, folder=UPLOAD_FOLDER):
+    """
+    Upload song song nhiều ảnh lên Cloudinary, trả về danh sách secure_url theo đúng thứ tự.
+    Nếu 1 ảnh lỗi thì xóa các ảnh đã upload thành công rồi raise ImageUploadError,
+    để caller chỉ ghi DB khi toàn bộ ảnh đã sẵn sàng.
+    """
+    files = [f for f in files if f]
+    if not files:
+        return []
+
+    futures = [_executor.submit(upload, f, folder=folder) for f in files]
+    results, error = [], None
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            error = error or e
+
+    if error is not None:
+        for result in results:
+            try:
+                destroy(result['public_id'])
+            except Exception:
+                logger.exception('Không xóa được ảnh %s trên Cloudinary', result.get('public_id'))
+        raise ImageUploadError(str(error))
+
+    return [result.get('secure_url') for result in results]
+
+
+def upload_image(file, folder=UPLOAD_FOLDER):
+    """Upload 1 ảnh, trả về None nếu không có file"""
+    urls = upload_images([file], folder=folder)
+    return urls[0] if urls else None
+
+
+def upload_owner(user):
+    """Thư mục con chứa ảnh upload thẳng của user, để user khác không dùng lại được tham chiếu ảnh"""
+    return f'u{user.pk}'
+
+
+def new_register_upload_owner():
+    """Thư mục ngẫu nhiên cho 1 lượt đăng ký, kèm upload_token có chữ ký để gửi lại cùng form đăng ký"""
+    owner = f'r{secrets.token_hex(16)}'
+    return owner, signing.dumps(owner, salt=REGISTER_UPLOAD_TOKEN_SALT)
+
+
+def register_upload_owner(token):
+    """Đọc thư mục đăng ký từ upload_token, raise ImageUploadError nếu token sai hoặc hết hạn"""
+    if not token:
+        raise ImageUploadError('Thiếu upload_token của ảnh')
+    try:
+        return signing.loads(token, salt=REGISTER_UPLOAD_TOKEN_SALT, max_age=REGISTER_UPLOAD_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        raise ImageUploadError('upload_token không hợp lệ hoặc đã hết hạn')
+
+
+def sign_upload_params(owner):
+    """
+    Tạo tham số upload có chữ ký để client upload ảnh thẳng lên Cloudinary (không đi qua Django).
+    Ảnh nằm trong thư mục riêng của owner (upload_owner/new_register_upload_owner).
+    Client gửi các tham số này kèm file tới upload_url, sau đó gửi lại public_id/version/signature
+    mà Cloudinary trả về để server xác nhận bằng verify_upload với cùng owner.
+    """
+    config = cloudinary.config()
+    params = {
+        'timestamp': int(time.time()),
+        'folder': f'{UPLOAD_FOLDER}/{owner}',
+        'allowed_formats': ALLOWED_FORMATS,
+    }
+    params['signature'] = api_sign_request(params, config.api_secret)
+    params['api_key'] = config.api_key
+    params['cloud_name'] = config.cloud_name
+    params['upload_url'] = f'https://api.cloudinary.com/v1_1/{config.cloud_name}/image/upload'
+    return params
+
+
+def verify_upload(reference, owner):
+    """
+    Xác nhận ảnh owner đã upload thẳng lên Cloudinary.
+    reference là dict (hoặc chuỗi JSON) gồm public_id, version, signature (và format) lấy từ response của Cloudinary.
+    Trả về CloudinaryResource để gán vào CloudinaryField, raise ImageUploadError nếu không hợp lệ.
+    """
+    if isinstance(reference, str):
+        try:
+            reference = json.loads(reference)
+        except ValueError:
+            raise ImageUploadError('Tham chiếu ảnh không hợp lệ')
+    if not isinstance(reference, dict):
+        raise ImageUploadError('Tham chiếu ảnh không hợp lệ')
+
+    public_id = reference.get('public_id')
+    version = reference.get('version')
+    signature = reference.get('signature')
+    if not public_id or not version or not signature:
+        raise ImageUploadError('Thiếu public_id, version hoặc signature của ảnh')
+    # Chỉ chấp nhận ảnh nằm trong thư mục đã ký cho chính owner này
+    if not str(public_id).startswith(f'{UPLOAD_FOLDER}/{owner}/'):
+        raise ImageUploadError('Ảnh không thuộc thư mục cho phép')
+    if not verify_api_response_signature(public_id, version, signature):
+        raise ImageUploadError('Chữ ký ảnh không hợp lệ')
+
+    return CloudinaryResource(public_id, format=reference.get('format'), version=version,
+                              type='upload', resource_type='image')
+
+
+def verify_uploads(references, owner):
+    """Xác nhận nhiều ảnh đã upload thẳng, trả về danh sách secure_url theo đúng thứ tự"""
+    return [verify_upload(reference, owner).build_url(secure=True) for reference in references if reference]
@@ -2,7 +2,8 @@ from xml.etree.ElementInclude import include
 
 from django.urls import path, include
 from rest_framework import routers
-from .views import RegisterAPIView, GroupViewSet, UserViewSet, EventInviteViewSet, PostViewSet, CommentViewSet, ReactionViewSet, SurveyPostViewSet, ChatViewSet, GoogleRegisterViewSet
+from .realtime import realtime_stream
+from .views import RegisterAPIView, GroupViewSet, UserViewSet, EventInviteViewSet, PostViewSet, CommentViewSet, ReactionViewSet, SurveyPostViewSet, ChatViewSet, GoogleRegisterViewSet, UploadViewSet
 
 router = routers.DefaultRouter()
 
@@ -15,7 +16,10 @@ router.register(r'google-register', GoogleRegisterViewSet, basename='google-regi
 router.register(r'groups', GroupViewSet, basename='groups')
 router.register(r'event_invite', EventInviteViewSet, basename='event_invite')
 router.register(r'chat', ChatViewSet, basename='chat')
+router.register(r'upload', UploadViewSet, basename='upload')
 
 urlpatterns = [
     path('', include(router.urls)),
+    # Server-Sent Events cho chat và feed (cần chạy dưới ASGI)
+    path('realtime/stream/', realtime_stream, name='realtime-stream'),
 ]
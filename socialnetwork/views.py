@@ -1,33 +1,41 @@
 from datetime import timedelta
 import json
-from django.db.models.functions.text import Concat
-from django.db.models import Value,CharField
 from rest_framework.parsers import MultiPartParser,JSONParser
 from email.message import EmailMessage
 from django.core.mail import EmailMessage
 from rest_framework.decorators import action
 from rest_framework import parsers, viewsets, generics, permissions, status,filters
-from django.db.models import Count,Q
+from django.db.models import Case,Count,OuterRef,Q,F,Subquery,Value,When,Window
+from django.db.models.functions import Coalesce, Greatest, RowNumber
+from django.urls import reverse
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.throttling import AnonRateThrottle
 
 from SocialNetworkApp import settings
-from .firebase_config import create_chat_room, send_message, mark_messages_as_read, get_last_message,update_last_message_is_read
-from socialnetwork.paginator import UserPagination,PostPagination,GroupPagination,OptionUserPagination,MessagePagination,ChatRoomPagination
+from .firebase_config import get_last_message
+from socialnetwork.paginator import UserPagination,PostPagination,GroupPagination,OptionUserPagination,MessagePagination,ChatRoomPagination,\
+    CommentThreadPagination,CommentReplyPagination
 from rest_framework.pagination import PageNumberPagination
 from django.db.models import Prefetch
-from .models import User,Post,Comment,Reaction,Group,PostImage,SurveyPost,SurveyType,SurveyDraft,SurveyOption,SurveyQuestion,UserSurveyOption,Role, Group, EventInvitePost, Alumni, ChatRoom, Message
+from .models import User,Post,Comment,Reaction,ReactionType,Group,PostImage,SurveyPost,SurveyType,SurveyCompletion,SurveyDraft,SurveyOption,SurveyQuestion,UserSurveyOption,Role, Group, EventInvitePost, Alumni, ChatRoom, Message, EmailEvent, InvitationDispatch, ChatOutbox, ChatParticipant
 from .serializers import UserSerializer,UserRegisterSerializer,GoogleRegisterSerializer,TeacherCreateSerializer,PostSerializer,CommentSerializer,SurveyPostSerializer, UserSerializer, SurveyDraftSerializer, \
-    ReactionSerializer, GroupSerializer,GroupDetailSerializer,EventInvitePostSerializer, ChatRoomSerializer, MessageSerializer
+    ReactionSerializer, GroupSerializer,GroupDetailSerializer,EventInvitePostSerializer, ChatRoomSerializer, MessageSerializer, \
+    CommentThreadSerializer, CommentReplySerializer, InvitationDispatchSerializer, ChatInboxSerializer
 from .perms import RolePermission,OwnerPermission,CommentDeletePermission,IsOwnerOrAdmin,IsChatParticipant
-from cloudinary.uploader import upload
+from . import analytics
+from .realtime import publish_chat_message, publish_chat_read, publish_post_created
+from .search import normalize, search_posts, search_users
+from .tasks import enqueue_user_emails, is_dispatch_stalled, record_chat_event, resume_invitation_dispatch, \
+    start_invitation_dispatch
+from .uploads import ImageUploadError, new_register_upload_owner, sign_upload_params, upload_image, upload_images, \
+    upload_owner, verify_upload, verify_uploads
 from socialnetwork.perms import  IsSelf, IsOwner, IsAuthenticatedUser, AllowAll,IsAdmin
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
 from django.utils import timezone
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth import authenticate
 from social_django.utils import load_strategy, load_backend
 from django.core.files.uploadedfile import SimpleUploadedFile
@@ -42,8 +50,7 @@ User = get_user_model()
 
 class UserViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIView):
     queryset = User.objects.filter(is_active=True)\
-        .order_by('-date_joined')\
-        .select_related('alumni', 'teacher')
+        .order_by('-date_joined')
     serializer_class = UserSerializer
     parser_classes = [parsers.MultiPartParser,parsers.JSONParser]
     pagination_class = UserPagination
@@ -65,13 +72,13 @@ class UserViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIVi
 
         if self.action in ['list', 'retrieve']:
             return [IsAuthenticated()]
-        elif self.action in ['destroy','unverified_users', 'verify_user','create_teacher','set_password_reset_time','teachers_expired_password_reset']:
+        elif self.action in ['destroy','unverified_users', 'verify_user', 'verify_users','create_teacher','set_password_reset_time','teachers_expired_password_reset']:
             return [RolePermission([0])]
         else:
             return [IsSelf()]
 
     def get_queryset(self):
-        queryset = self.queryset
+        queryset = UserSerializer.optimize_queryset(self.queryset, self.request)
         q = self.request.query_params.get('q')
         role = self.request.query_params.get('role')
         
@@ -89,79 +96,60 @@ class UserViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIVi
             Q(teacher__isnull=True) | Q(teacher__must_change_password=False) | Q(teacher__password_reset_time__gte=now)
         )
 
-        # Tìm kiếm theo tên
+        # Tìm kiếm theo tên qua chỉ mục họ tên (không dấu, khớp tiền tố)
         if q:
-            queryset = queryset.annotate(
-                full_name=Concat('first_name', Value(' '), 'last_name', output_field=CharField())
-            ).filter(full_name__icontains=q)
+            queryset = search_users(queryset, q)
             
         return queryset
     @action(methods=['get'], url_path='current_user', detail=False)
     def get_current_user(self, request):
         if not request.user.is_authenticated:
             return Response({'error': 'Chưa xác thực user'}, status=status.HTTP_401_UNAUTHORIZED)
-        return Response(UserSerializer(request.user).data, status=status.HTTP_200_OK)
+        return Response(UserSerializer(request.user, context={'request': request}).data, status=status.HTTP_200_OK)
 
     @action(methods=['patch'], url_path='verify_user', detail=True)
     def verify_user(self, request, pk=None):
         try:
             user = User.objects.get(pk=pk)
-            user.save()
+        except User.DoesNotExist:
+            return Response({'error': 'Không tìm thấy người dùng'}, status=status.HTTP_404_NOT_FOUND)
+
+        with transaction.atomic():
             # Nếu là Alumni thì xác thực trường is_verified
             if hasattr(user, 'alumni'):
                 user.alumni.is_verified = True
                 user.alumni.save(update_fields=['is_verified'])  # Chỉ cập nhật trường is_verified
 
-            # Gửi email thông báo xác thực tài khoản
-            html_content = f"""
-            <div style=\"font-family: Arial, sans-serif; max-width: 600px; margin: auto; border: 1px solid #e0e0e0; border-radius: 8px; overflow: hidden;\">
-                <div style=\"background-color: #1d559f; padding: 20px; color: white; text-align: center;\">
-                    <img src="https://res.cloudinary.com/dx8nciong/image/upload/v1746437801/alumnis_avatar-removebg-preview_ypjmpd.png" alt=\"Logo\" style=\"height: 50px; margin-bottom: 10px;\">
-                    <h1 style=\"margin: 0; font-size: 24px;\">MẠNG XÃ HỘI CỰU SINH VIÊN</h1>
-                </div>
-
-                <div style=\"padding: 20px; background-color: #f9f9f9;\">
-                    <p>Xin chào <strong style=\"color: #3f51b5;\">{user.first_name} {user.last_name}</strong>,</p>
-                    <p>Tài khoản của bạn đã được xác thực thành công.</p>
-                    <p>Bạn có thể truy cập và sử dụng ứng dụng Alumni Social Network kể từ hôm nay.</p>
-                    <div style=\"background-color: #e3f2fd; color: #1565c0; padding: 15px; margin-top: 20px; border-left: 5px solid #1976d2;\">
-                        🎉 <strong>Chúc bạn có những trải nghiệm tuyệt vời cùng cộng đồng cựu sinh viên!</strong>
-                    </div>
-                    <p style=\"margin-top: 20px;\">Nếu có bất kỳ thắc mắc nào, xin vui lòng liên hệ bộ phận hỗ trợ.</p>
-                    <hr style=\"border: none; border-top: 1px solid #ccc; margin: 20px 0;\">
-                    <p style=\"font-size: 12px; color: #888;\">Email này được gửi tự động từ hệ thống. Vui lòng không phản hồi email này.</p>
-                </div>
-
-                <div style=\"background-color: #eeeeee; padding: 10px; text-align: center; font-size: 13px;\">
-                    © 2025 AlumniSocialNetwork | <a href=\"https://alumnisnw.com\" style=\"color: #3f51b5;\">Truy cập hệ thống</a>
-                </div>
-            </div>
-            """
-            try:
-                message = Mail(
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    to_emails=user.email,
-                    subject='TÀI KHOẢN CỦA BẠN ĐÃ ĐƯỢC XÁC THỰC',
-                    html_content=html_content
-                )
-                sg = SendGridAPIClient(settings.SENDGRID_API_KEY)
-                sg.send(message)
-            except Exception as e:
-                pass  # Không làm gián đoạn flow xác thực nếu gửi mail lỗi
+            # Email thông báo được gửi bởi Celery sau khi commit, không chặn request
+            enqueue_user_emails(EmailEvent.ACCOUNT_VERIFIED, [user.id])
 
-            return Response({'message': 'Tài khoản đã được xác thực'}, status=status.HTTP_200_OK)
-        except User.DoesNotExist:
-            return Response({'error': 'Không tìm thấy người dùng'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'message': 'Tài khoản đã được xác thực'}, status=status.HTTP_200_OK)
+
+    # Xác thực nhiều cựu sinh viên cùng lúc, email được gộp vào 1 request SendGrid
+    @action(methods=['patch'], url_path='verify_users', detail=False)
+    def verify_users(self, request):
+        user_ids = request.data.get('user_ids')
+        if not isinstance(user_ids, list) or not user_ids:
+            return Response({'error': 'Vui lòng cung cấp danh sách user_ids'}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            verified_ids = list(Alumni.objects.select_for_update()
+                                .filter(user_id__in=user_ids, is_verified=False)
+                                .values_list('user_id', flat=True))
+            Alumni.objects.filter(user_id__in=verified_ids).update(is_verified=True)
+            enqueue_user_emails(EmailEvent.ACCOUNT_VERIFIED, verified_ids)
+
+        return Response({'message': f'Đã xác thực {len(verified_ids)} tài khoản', 'user_ids': verified_ids},
+                        status=status.HTTP_200_OK)
 
     # Lấy những user chưa dc xác thực (dành cho admin)
     @action(detail=False, methods=['get'], url_path='list_unverified_users')
     def list_unverified_users(self, request):
         q = request.query_params.get('q')
-        queryset = User.objects.select_related('alumni').filter(alumni__is_verified=False).order_by('-date_joined')
+        queryset = User.objects.filter(alumni__is_verified=False).order_by('-date_joined')
+        queryset = UserSerializer.optimize_queryset(queryset, request)
         if q:
-            queryset = queryset.annotate(
-                full_name=Concat('last_name', Value(' '), 'first_name', output_field=CharField())
-            ).filter(full_name__icontains=q)
+            queryset = search_users(queryset, q)
         paginator = OptionUserPagination()
         page = paginator.paginate_queryset(queryset, request)
         if page is not None:
@@ -191,11 +179,19 @@ class UserViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIVi
         return Response({'message': 'Đổi mật khẩu thành công'}, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['patch'], url_path='update_avatar',
-            parser_classes=[parsers.MultiPartParser])
+            parser_classes=[parsers.MultiPartParser, parsers.JSONParser])
     def update_avatar(self, request):
         user = request.user
         avatar = request.FILES.get('avatar')
 
+        # Ảnh đã được client upload thẳng lên Cloudinary qua /upload/sign/
+        reference = request.data.get('avatar_upload')
+        if reference:
+            try:
+                avatar = verify_upload(reference, upload_owner(user))
+            except ImageUploadError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         if not avatar:
             return Response({'error': 'Vui lòng chọn ảnh avatar'}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -204,11 +200,19 @@ class UserViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIVi
         return Response({'message': 'Cập nhật avatar thành công', 'avatar': user.avatar.url}, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['patch'], url_path='update_cover',
-            parser_classes=[parsers.MultiPartParser])
+            parser_classes=[parsers.MultiPartParser, parsers.JSONParser])
     def update_cover(self, request):
         user = request.user
         cover = request.FILES.get('cover')
 
+        # Ảnh đã được client upload thẳng lên Cloudinary qua /upload/sign/
+        reference = request.data.get('cover_upload')
+        if reference:
+            try:
+                cover = verify_upload(reference, upload_owner(user))
+            except ImageUploadError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         if not cover:
             return Response({'error': 'Vui lòng chọn ảnh cover'}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -237,66 +241,10 @@ class UserViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIVi
     def create_teacher(self, request):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
-            user = serializer.save()
-
-            # Soạn nội dung HTML
-            html_content = f"""
-            <div style="font-family: Arial, sans-serif; max-width: 600px; margin: auto; border: 1px solid #e0e0e0; border-radius: 8px; overflow: hidden;">
-                <div style="background-color: #1d559f; padding: 20px; color: white; text-align: center;">
-                    <img src="https://res.cloudinary.com/dx8nciong/image/upload/v1746437801/alumnis_avatar-removebg-preview_ypjmpd.png" alt="Logo" style="height: 50px; margin-bottom: 10px;">
-                    <h1 style="margin: 0; font-size: 24px;">MẠNG XÃ HỘI CỰU SINH VIÊN</h1>
-                </div>
-
-                <div style="padding: 20px; background-color: #f9f9f9;">
-                    <p>Quý thầy/cô <strong style="color: #3f51b5;">{user.first_name} {user.last_name}</strong> thân mến,</p>
-                    <p>Hệ thống đã khởi tạo tài khoản giảng viên cho thầy/cô với thông tin như sau:</p>
-
-                    <table style="width: 100%; border-collapse: collapse;">
-                        <tr>
-                            <td style="padding: 8px;"><strong>👤 Họ tên:</strong></td>
-                            <td style="padding: 8px;">{user.first_name} {user.last_name}</td>
-                        </tr>
-                        <tr style="background-color: #efefef;">
-                            <td style="padding: 8px;"><strong>🧾 Username:</strong></td>
-                            <td style="padding: 8px;">{user.username}</td>
-                        </tr>
-                        <tr>
-                            <td style="padding: 8px;"><strong>🔑 Mật khẩu:</strong></td>
-                            <td style="padding: 8px;"><code>ou@123</code></td>
-                        </tr>
-                    </table>
-
-                    <div style="background-color: #ffebee; color: #c62828; padding: 15px; margin-top: 20px; border-left: 5px solid #d32f2f;">
-                        ⚠️ <strong>Lưu ý bảo mật:</strong><br>
-                        Vui lòng đăng nhập và đổi mật khẩu trong vòng <strong>24 giờ</strong> để tránh bị khóa tài khoản.
-                    </div>
-
-                    <p style="margin-top: 20px;">Nếu có bất kỳ thắc mắc nào, xin vui lòng liên hệ bộ phận hỗ trợ.</p>
-
-                    <hr style="border: none; border-top: 1px solid #ccc; margin: 20px 0;">
-
-                    <p style="font-size: 12px; color: #888;">Email này được gửi tự động từ hệ thống. Vui lòng không phản hồi email này.</p>
-                </div>
-
-                <div style="background-color: #eeeeee; padding: 10px; text-align: center; font-size: 13px;">
-                    © 2025 AlumniSocialNetwork | <a href="https://your-university.edu.vn" style="color: #3f51b5;">Truy cập hệ thống</a>
-                </div>
-            </div>
-            """
-
-            # Tạo email
-            message = Mail(
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                to_emails=user.email,
-                subject='THÔNG TIN TÀI KHOẢN ALUMNISNW CỦA GIẢNG VIÊN',
-                html_content=html_content
-            )
-
-            try:
-                sg = SendGridAPIClient(settings.SENDGRID_API_KEY)
-                sg.send(message)
-            except Exception as e:
-                return Response({'error': f'Lỗi gửi email: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            with transaction.atomic():
+                user = serializer.save()
+                # Email thông tin tài khoản được gửi bởi Celery sau khi commit
+                enqueue_user_emails(EmailEvent.TEACHER_ACCOUNT_CREATED, [user.id])
 
             return Response({
                 'message': 'Đã cấp tài khoản giảng viên và gửi email thông báo',
@@ -311,14 +259,13 @@ class UserViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIVi
         now = timezone.now()
         # Lọc các giáo viên có password_reset_time đã quá 24h
         q = request.query_params.get('q')
-        queryset = User.objects.select_related('teacher').filter(
+        queryset = User.objects.filter(
             is_active=True,
             teacher__must_change_password=True,
-            teacher__password_reset_time__lt=now).order_by('-date_joined')  
+            teacher__password_reset_time__lt=now).order_by('-date_joined')
+        queryset = UserSerializer.optimize_queryset(queryset, request)
         if q:
-            queryset = queryset.annotate(
-                full_name=Concat('last_name', Value(' '), 'first_name', output_field=CharField())
-            ).filter(full_name__icontains=q)
+            queryset = search_users(queryset, q)
         paginator = OptionUserPagination()
         page = paginator.paginate_queryset(queryset, request)
         if page is not None:
@@ -420,10 +367,33 @@ class GoogleRegisterViewSet(viewsets.ViewSet):
             return resp.json()
         return None
 
+class RegisterUploadRateThrottle(AnonRateThrottle):
+    scope = 'register_upload'
+
+
+class UploadViewSet(viewsets.ViewSet):
+    permission_classes = [IsAuthenticated]
+
+    @action(detail=False, methods=['post'], url_path='sign')
+    def sign(self, request):
+        """Cấp tham số upload có chữ ký để client upload ảnh thẳng lên Cloudinary, vào thư mục riêng của user"""
+        return Response(sign_upload_params(upload_owner(request.user)), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='sign-register', permission_classes=[AllowAll],
+            throttle_classes=[RegisterUploadRateThrottle])
+    def sign_register(self, request):
+        """
+        Cho form đăng ký (chưa đăng nhập): ký upload vào 1 thư mục ngẫu nhiên, trả kèm upload_token
+        phải gửi lại cùng form đăng ký để dùng được ảnh trong thư mục đó
+        """
+        owner, upload_token = new_register_upload_owner()
+        return Response({**sign_upload_params(owner), 'upload_token': upload_token}, status=status.HTTP_200_OK)
+
+
 class RegisterAPIView(viewsets.ViewSet, generics.CreateAPIView):
     serializer_class = UserRegisterSerializer
     permission_classes = [AllowAll]
-    parser_classes = [parsers.MultiPartParser]
+    parser_classes = [parsers.MultiPartParser, parsers.JSONParser]
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -435,20 +405,29 @@ class RegisterAPIView(viewsets.ViewSet, generics.CreateAPIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class CustomSearchFilter(filters.SearchFilter):
+class PostFullTextSearchFilter(filters.BaseFilterBackend):
+    """Tìm bài viết qua chỉ mục từ (không dấu, khớp tiền tố từ cuối), sắp xếp theo độ liên quan"""
     search_param = 'q'
 
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param)
+        if not query:
+            return queryset
+        return search_posts(queryset, query)
+
 class PostViewSet(viewsets.ViewSet, generics.RetrieveAPIView, generics.ListAPIView):
-    queryset = Post.objects.filter(active=True)
+    queryset = Post.objects.filter(active=True).with_subtype()
     serializer_class = PostSerializer
     pagination_class = PostPagination
-    filter_backends = [CustomSearchFilter]
-    search_fields = ['content']
+    filter_backends = [PostFullTextSearchFilter]
     def get_parser_classes(self):
         if self.action in ['create', 'update']:
             return [JSONParser, MultiPartParser]
         return [JSONParser]  # Chỉ sử dụng JSONParser cho các phương thức khá
 
+    def get_queryset(self):
+        return PostSerializer.optimize_queryset(self.queryset, self.request)
+
     def get_permissions(self):
         if self.action == "create":
             return [IsAuthenticated()]
@@ -461,26 +440,26 @@ class PostViewSet(viewsets.ViewSet, generics.RetrieveAPIView, generics.ListAPIVi
 
         content = request.data.get('content')
         images = request.FILES.getlist('images')  # Lấy tất cả các tệp ảnh
+        # Tham chiếu ảnh client đã upload thẳng lên Cloudinary qua /upload/sign/
+        if hasattr(request.data, 'getlist'):
+            image_uploads = request.data.getlist('image_uploads')
+        else:
+            image_uploads = request.data.get('image_uploads') or []
 
         if not content:
             return Response({"error": "Nội dung bài viết không được để trống."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Tạo bài viết
-        post = Post.objects.create(content=content, lock_comment=True, user=request.user)
-
-        # Xử lý ảnh nếu có
-        if images:
-            for image in images:
-                try:
-                    # Tải ảnh lên và lấy URL của ảnh
-                    upload_result = upload(image, folder='MangXaHoi')  # Phương thức upload ảnh (Cloudinary hoặc khác)
-                    image_url = upload_result.get('secure_url')
-
-                    # Lưu ảnh vào model PostImage liên kết với bài viết
-                    PostImage.objects.create(post=post, image=image_url)
+        # Upload song song toàn bộ ảnh trước, chỉ ghi DB khi tất cả đã thành công
+        try:
+            image_urls = verify_uploads(image_uploads, upload_owner(request.user)) + upload_images(images)
+        except ImageUploadError as e:
+            return Response({"error": f"Lỗi tải ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
 
-                except Exception as e:
-                    return Response({"error": f"Lỗi tải ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+        # Tạo bài viết và ảnh trong cùng 1 transaction
+        with transaction.atomic():
+            post = Post.objects.create(content=content, lock_comment=True, user=request.user)
+            PostImage.objects.bulk_create([PostImage(post=post, image=url) for url in image_urls])
+            publish_post_created(post)
 
         # Serialize bài viết và trả về kết quả
         serializer = self.get_serializer(post)
@@ -494,20 +473,21 @@ class PostViewSet(viewsets.ViewSet, generics.RetrieveAPIView, generics.ListAPIVi
         image_file = request.FILES.get('image')
 
         try:
+            image_url = upload_image(image_file)
+        except ImageUploadError as e:
+            return Response({"error": f"Lỗi cập nhật ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
             post.content = content
             post.save(update_fields=['content'])
 
-            if image_file:
+            if image_url:
                 # Tạo ảnh mới liên kết với post
-                upload_result = upload(image_file, folder='MangXaHoi')
-                PostImage.objects.create(post=post, image=upload_result.get('secure_url'))
+                PostImage.objects.create(post=post, image=image_url)
             elif 'image' in request.data and request.data['image'] == '':
                 # Nếu client gửi image = '' thì xoá tất cả ảnh của post
                 post.images.all().delete()
 
-        except Exception as e:
-            return Response({"error": f"Lỗi cập nhật ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
-
         return Response({'message': 'Chỉnh sửa bài viết thành công.'}, status=status.HTTP_200_OK)
 
     def destroy(self, request, pk=None):
@@ -521,7 +501,8 @@ class PostViewSet(viewsets.ViewSet, generics.RetrieveAPIView, generics.ListAPIVi
     @action(methods=['get'], url_path='my-posts', detail=False)
     def get_my_posts(self, request):
         self.check_permissions(request)
-        posts = Post.objects.filter(user=request.user, active=True)
+        posts = PostSerializer.optimize_queryset(
+            Post.objects.filter(user=request.user, active=True).with_subtype(), request)
         serializer = self.get_serializer(posts, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -536,15 +517,14 @@ class PostViewSet(viewsets.ViewSet, generics.RetrieveAPIView, generics.ListAPIVi
         content = request.data.get('content')
         image = request.FILES.get('image')
 
-        image_url = None
-        if image:
-            try:
-                upload_result = upload(image, folder='MangXaHoi')
-                image_url = upload_result.get('secure_url')
-            except Exception as e:
-                return Response({"error": f"Lỗi đăng ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            image_url = upload_image(image)
+        except ImageUploadError as e:
+            return Response({"error": f"Lỗi đăng ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
 
-        comment = Comment.objects.create(content=content, image=image_url, user=request.user, post=post)
+        with transaction.atomic():
+            comment = Comment.objects.create(content=content, image=image_url, user=request.user, post=post)
+            Post.update_counters(post.id, comment_count=1)
         serializer = CommentSerializer(comment)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -560,8 +540,9 @@ class PostViewSet(viewsets.ViewSet, generics.RetrieveAPIView, generics.ListAPIVi
     @action(methods=['get'], detail=True, url_path='reacts')
     def reacts(self, request, pk=None):
         post = get_object_or_404(Post, pk=pk, active=True)
-        reactions = Reaction.objects.filter(post=post, user__is_active=True)
-        serializer = ReactionSerializer(reactions, many=True)
+        reactions = ReactionSerializer.optimize_queryset(
+            Reaction.objects.filter(post=post, user__is_active=True), request)
+        serializer = ReactionSerializer(reactions, many=True, context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     @action(methods=['post', 'delete'], detail=True, url_path='react', permission_classes=[IsAuthenticated])
@@ -569,35 +550,86 @@ class PostViewSet(viewsets.ViewSet, generics.RetrieveAPIView, generics.ListAPIVi
         post = get_object_or_404(Post, pk=pk, active=True)
 
         if request.method == 'DELETE':
-            try:
-                reaction = Reaction.objects.get(user=request.user, post=post)
+            with transaction.atomic():
+                try:
+                    reaction = Reaction.objects.get(user=request.user, post=post)
+                except Reaction.DoesNotExist:
+                    return Response({"detail": "Reaction không tồn tại."}, status=status.HTTP_404_NOT_FOUND)
                 reaction.delete()
-                return Response({"message": "Reaction đã được xóa."}, status=status.HTTP_200_OK)
-            except Reaction.DoesNotExist:
-                return Response({"detail": "Reaction không tồn tại."}, status=status.HTTP_404_NOT_FOUND)
+                Post.update_counters(post.id, **{Post.reaction_counter_field(reaction.reaction): -1})
+            return Response({"message": "Reaction đã được xóa."}, status=status.HTTP_200_OK)
 
         elif request.method == 'POST':
             reaction_id = request.data.get("reaction")
-            try:
-                reaction = Reaction.objects.get(user=request.user, post=post)
+            if reaction_id and str(reaction_id) not in [str(r.value) for r in ReactionType]:
+                return Response({"detail": "Reaction không hợp lệ."}, status=status.HTTP_400_BAD_REQUEST)
+            with transaction.atomic():
+                try:
+                    reaction = Reaction.objects.get(user=request.user, post=post)
+                except Reaction.DoesNotExist:
+                    if not reaction_id:
+                        return Response({"detail": "Không có reaction để xóa."}, status=status.HTTP_400_BAD_REQUEST)
+                    reaction = Reaction.objects.create(user=request.user, post=post, reaction=int(reaction_id))
+                    Post.update_counters(post.id, **{Post.reaction_counter_field(reaction.reaction): 1})
+                    return Response(ReactionSerializer(reaction).data, status=status.HTTP_201_CREATED)
+
+                old_field = Post.reaction_counter_field(reaction.reaction)
                 if not reaction_id:
                     reaction.delete()
+                    Post.update_counters(post.id, **{old_field: -1})
                     return Response({"message": "Reaction đã được xóa."}, status=status.HTTP_200_OK)
-                else:
-                    reaction.reaction = reaction_id
-                    reaction.save()
-                    return Response(ReactionSerializer(reaction).data, status=status.HTTP_200_OK)
-            except Reaction.DoesNotExist:
-                if not reaction_id:
-                    return Response({"detail": "Không có reaction để xóa."}, status=status.HTTP_400_BAD_REQUEST)
-                reaction = Reaction.objects.create(user=request.user, post=post, reaction=reaction_id)
-                return Response(ReactionSerializer(reaction).data, status=status.HTTP_201_CREATED)
+
+                reaction.reaction = int(reaction_id)
+                reaction.save()
+                new_field = Post.reaction_counter_field(reaction.reaction)
+                if new_field != old_field:
+                    Post.update_counters(post.id, **{old_field: -1, new_field: 1})
+                return Response(ReactionSerializer(reaction).data, status=status.HTTP_200_OK)
+
+    @action(methods=['get'], detail=True, url_path='comment-threads')
+    def get_comment_threads(self, request, pk=None):
+        """Phân trang bình luận gốc, mỗi bình luận kèm ?replies=N (mặc định 3) phản hồi đầu tiên và reply_count"""
+        post = get_object_or_404(Post, pk=pk, active=True)
+        try:
+            replies_per_thread = min(max(int(request.query_params.get('replies', 3)), 0), 20)
+        except ValueError:
+            replies_per_thread = 3
+
+        roots = Comment.objects.filter(post=post, root__isnull=True, active=True).select_related('user')
+        paginator = CommentThreadPagination()
+        page = paginator.paginate_queryset(roots, request)
+
+        # Lấy N phản hồi đầu của tất cả thread trong trang bằng 1 query (ROW_NUMBER theo root)
+        first_replies = {}
+        if page and replies_per_thread:
+            replies = Comment.objects.filter(root__in=[c.id for c in page], active=True)\
+                .select_related('user')\
+                .annotate(position=Window(RowNumber(), partition_by=[F('root')],
+                                          order_by=[F('created_date').asc(), F('id').asc()]))\
+                .filter(position__lte=replies_per_thread)\
+                .order_by('root', 'created_date', 'id')
+            for reply in replies:
+                first_replies.setdefault(reply.root_id, []).append(reply)
+
+        reply_paginator = CommentReplyPagination()
+        for comment in page:
+            comment.first_replies = first_replies.get(comment.id, [])
+            comment.replies_next = None
+            if len(comment.first_replies) < comment.reply_count:
+                # Link tải tiếp phản hồi, bắt đầu sau phản hồi cuối cùng đã trả về
+                comment.replies_next = request.build_absolute_uri(reverse('comment-replies', args=[comment.id]))
+                if comment.first_replies:
+                    comment.replies_next += f'?cursor={reply_paginator.encode_cursor(comment.first_replies[-1])}'
+
+        serializer = CommentThreadSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
 
     @action(methods=['get'], detail=True, url_path='comments')
     def get_comments(self, request, pk=None):
         post = get_object_or_404(Post, pk=pk, active=True)
-        comments = Comment.objects.filter(post=post, active=True).select_related('user').order_by('created_date')
-        serializer = CommentSerializer(comments, many=True)
+        comments = CommentSerializer.optimize_queryset(
+            Comment.objects.filter(post=post, active=True).order_by('created_date'), request)
+        serializer = CommentSerializer(comments, many=True, context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
@@ -620,24 +652,34 @@ class CommentViewSet(viewsets.ViewSet):
         image = request.FILES.get('image')
 
         try:
-            if image:
-                upload_result = upload(image, folder='MangXaHoi')
-                comment.image = upload_result.get('secure_url')
-            else:
-                comment.image = None
-            comment.content = content
-            comment.save(update_fields=['content', 'image'])
-        except Exception as e:
+            comment.image = upload_image(image)
+        except ImageUploadError as e:
             return Response({"error": f"Lỗi đăng ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+        comment.content = content
+        comment.save(update_fields=['content', 'image'])
 
         return Response({'message': 'Chỉnh sửa bình luận thành công.'}, status=status.HTTP_200_OK)
 
     def destroy(self, request, pk=None):
         comment = get_object_or_404(Comment, id=pk, active=True)
         self.check_object_permissions(request, comment)
-        comment.soft_delete()
+        with transaction.atomic():
+            comment.soft_delete()
+            Post.update_counters(comment.post_id, comment_count=-1)
+            if comment.root_id:
+                Comment.objects.filter(pk=comment.root_id).update(reply_count=Greatest(F('reply_count') - 1, 0))
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(methods=['get'], detail=True, url_path='replies')
+    def replies(self, request, pk=None):
+        """Tải thêm phản hồi của 1 thread theo cursor (created_date, id)"""
+        root = get_object_or_404(Comment, id=pk, active=True)
+        replies = Comment.objects.filter(root_id=root.thread_root_id, active=True).select_related('user')
+        paginator = CommentReplyPagination()
+        page = paginator.paginate_queryset(replies, request)
+        serializer = CommentReplySerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
+
     @action(methods=['post'], detail=True, url_path='reply')
     def reply_comment(self, request, pk=None):
         self.check_permissions(request)
@@ -649,16 +691,16 @@ class CommentViewSet(viewsets.ViewSet):
         content = request.data.get('content')
         image = request.FILES.get('image')
 
-        image_url = None
-        if image:
-            try:
-                upload_result = upload(image, folder='MangXaHoi')
-                image_url = upload_result.get('secure_url')
-            except Exception as e:
-                return Response({"error": f"Lỗi đăng ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            image_url = upload_image(image)
+        except ImageUploadError as e:
+            return Response({"error": f"Lỗi đăng ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
 
-        reply = Comment.objects.create(content=content, image=image_url, user=request.user, post=comment.post,
-                                       parent=comment)
+        with transaction.atomic():
+            reply = Comment.objects.create(content=content, image=image_url, user=request.user, post=comment.post,
+                                           parent=comment, root_id=comment.thread_root_id)
+            Post.update_counters(comment.post_id, comment_count=1)
+            Comment.objects.filter(pk=comment.thread_root_id).update(reply_count=F('reply_count') + 1)
 
         serializer = CommentSerializer(reply)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -667,10 +709,17 @@ class ReactionViewSet(viewsets.ViewSet, generics.ListAPIView):
     queryset = Reaction.objects.filter(active=True)
     serializer_class = ReactionSerializer
 
+    def get_queryset(self):
+        return ReactionSerializer.optimize_queryset(self.queryset, self.request)
+
 class SurveyPostViewSet(viewsets.ModelViewSet):
     queryset = SurveyPost.objects.filter(active=True)
     serializer_class = SurveyPostSerializer
 
+    def get_queryset(self):
+        # Join sẵn user, prefetch ảnh; câu hỏi/lựa chọn đọc từ cache theo phiên bản khảo sát
+        return SurveyPostSerializer.optimize_queryset(self.queryset, self.request)
+
     def get_parser_classes(self):
         if self.action in ['create', 'update']:
             return [JSONParser, MultiPartParser]
@@ -683,6 +732,8 @@ class SurveyPostViewSet(viewsets.ModelViewSet):
             return [OwnerPermission()]
         elif self.action in ["draft", "submit_survey"]:
             return [RolePermission([1])]
+        elif self.action in ["crosstab", "export"]:
+            return [RolePermission([0])]
         elif self.action == "resume_survey":
             return [OwnerPermission()]
         return super().get_permissions()
@@ -709,30 +760,30 @@ class SurveyPostViewSet(viewsets.ModelViewSet):
             return Response({"error": "survey_type, end_time và questions là bắt buộc."},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        # Tạo survey post chính
-        survey_post = SurveyPost.objects.create(
-            content=content,
-            user=request.user,
-            survey_type=survey_type,
-            end_time=end_time
-        )
+        # Upload song song ảnh trước khi ghi DB
+        try:
+            image_urls = upload_images(images)
+        except ImageUploadError as e:
+            return Response({"error": f"Lỗi đăng ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Upload ảnh nếu có
-        for image in images:
-            try:
-                upload_result = upload(image, folder='MangXaHoi')
-                image_url = upload_result.get('secure_url')
-                PostImage.objects.create(post=survey_post, image=image_url)
-            except Exception as e:
-                return Response({"error": f"Lỗi đăng ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Tạo câu hỏi + lựa chọn
-        for question_data in questions_data:
-            options_data = question_data.pop('options', [])
-            question = SurveyQuestion.objects.create(survey_post=survey_post, **question_data)
-            for option_data in options_data:
-                SurveyOption.objects.create(survey_question=question, **option_data)
+        try:
+            with transaction.atomic():
+                # Tạo survey post chính
+                survey_post = SurveyPost.objects.create(
+                    content=content,
+                    user=request.user,
+                    survey_type=survey_type,
+                    end_time=end_time
+                )
+                PostImage.objects.bulk_create([PostImage(post=survey_post, image=url) for url in image_urls])
 
+                # Tạo câu hỏi + lựa chọn
+                survey_post.sync_questions(questions_data)
+                publish_post_created(survey_post, 'survey')
+        except ValidationError as e:
+            return Response({"error": e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+
+        survey_post = SurveyPostSerializer.optimize_queryset(SurveyPost.objects.filter(pk=survey_post.pk), request).get()
         serializer = self.get_serializer(survey_post)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -744,64 +795,56 @@ class SurveyPostViewSet(viewsets.ModelViewSet):
         images = request.FILES.getlist('images')
         survey_type = request.data.get('survey_type', survey_post.survey_type)
         end_time = request.data.get('end_time', survey_post.end_time)
-        questions_data = request.data.get('questions', [])
-
-        if isinstance(questions_data, str):
-            questions_data = json.loads(questions_data)
-
-        if not isinstance(questions_data, list):
-            questions_data = []
+        questions_data = request.data.get('questions')
+        # Danh sách id ảnh cũ muốn giữ lại; không gửi thì thay toàn bộ ảnh như trước
+        keep_image_ids = request.data.get('image_ids', [])
 
-        # Cập nhật trường cơ bản của SurveyPost
-        survey_post.content = content
-        survey_post.survey_type = survey_type
-        survey_post.end_time = end_time
-        survey_post.save()
+        try:
+            if isinstance(questions_data, str):
+                questions_data = json.loads(questions_data)
+            if isinstance(keep_image_ids, str):
+                keep_image_ids = json.loads(keep_image_ids)
+        except json.JSONDecodeError as e:
+            return Response({"error": f"Lỗi phân tích cú pháp JSON: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Cập nhật ảnh
-        PostImage.objects.filter(post=survey_post).delete()
-        if images:
-            for image in images:
-                try:
-                    upload_result = upload(image, folder='MangXaHoi')
-                    image_url = upload_result.get('secure_url')
-                    PostImage.objects.create(post=survey_post, image=image_url)
-                except Exception as e:
-                    return Response({"error": f"Lỗi đăng ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Xóa hết câu hỏi + lựa chọn cũ trước khi cập nhật mới
-        for question in survey_post.questions.all():
-            question.options.all().delete()  # xóa option của câu hỏi
-            question.delete()  # xóa câu hỏi
-
-        # Thêm câu hỏi mới và các lựa chọn
-        for q in questions_data:
-            question_text = q.get('question', '')
-            multi_choice = q.get('multi_choice', False)
-            options = q.get('options', [])
-
-            new_question = SurveyQuestion.objects.create(
-                survey_post=survey_post,
-                question=question_text,
-                multi_choice=multi_choice,
-            )
+        if questions_data is not None and not isinstance(questions_data, list):
+            return Response({"error": "questions phải là danh sách."}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(keep_image_ids, list):
+            return Response({"error": "image_ids phải là danh sách."}, status=status.HTTP_400_BAD_REQUEST)
 
-            for opt in options:
-                option_text = opt.get('option', '')
-                SurveyOption.objects.create(
-                    survey_question=new_question,
-                    option=option_text,
-                )
+        # Upload song song ảnh mới trước khi ghi DB
+        try:
+            image_urls = upload_images(images)
+        except ImageUploadError as e:
+            return Response({"error": f"Lỗi đăng ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
 
+        try:
+            with transaction.atomic():
+                # Cập nhật trường cơ bản của SurveyPost
+                survey_post.content = content
+                survey_post.survey_type = survey_type
+                survey_post.end_time = end_time
+                # Không ghi đè respondent_count đang được submit cộng song song
+                survey_post.save(update_fields=['content', 'survey_type', 'end_time', 'updated_date'])
+
+                # Cập nhật ảnh
+                PostImage.objects.filter(post=survey_post).exclude(pk__in=keep_image_ids).delete()
+                PostImage.objects.bulk_create([PostImage(post=survey_post, image=url) for url in image_urls])
+
+                # So khớp câu hỏi/lựa chọn theo id: sửa tại chỗ, giữ nguyên câu trả lời của lựa chọn không đổi
+                if questions_data is not None:
+                    survey_post.sync_questions(questions_data)
+        except ValidationError as e:
+            return Response({"error": e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Đọc lại kèm prefetch câu hỏi/lựa chọn để serialize không tốn 1 truy vấn/câu hỏi
+        survey_post = SurveyPostSerializer.optimize_queryset(SurveyPost.objects.filter(pk=survey_post.pk), request).get()
         serializer = SurveyPostSerializer(survey_post)
         return Response(serializer.data, status=status.HTTP_200_OK)
     @action(detail=True, url_path='draft', methods=['post'])
     def draft(self, request, pk=None):
         self.check_permissions(request)
-        existing_answers = UserSurveyOption.objects.filter(
-            user=request.user, survey_option__survey_question__survey_post=pk
-        )
-        if existing_answers.exists():
+        if SurveyCompletion.objects.filter(user=request.user, survey_post_id=pk).exists():
             return Response({"error": "You had completed this survey."}, status=status.HTTP_400_BAD_REQUEST)
 
         data = request.data
@@ -836,8 +879,7 @@ class SurveyPostViewSet(viewsets.ModelViewSet):
     def resume_survey(self, request, pk=None):
         draft = SurveyDraft.objects.filter(survey_post_id=pk, user=request.user).first()
 
-        has_completed = UserSurveyOption.objects.filter(user=request.user,
-                                                        survey_option__survey_question__survey_post=pk).exists()
+        has_completed = SurveyCompletion.objects.filter(user=request.user, survey_post_id=pk).exists()
 
         if not draft:
             return Response({"answers": None, "has_completed": has_completed}, status=status.HTTP_200_OK)
@@ -854,24 +896,89 @@ class SurveyPostViewSet(viewsets.ModelViewSet):
         survey_post = get_object_or_404(SurveyPost, pk=pk, active=True)
         answers = data.get('answers', {})
 
-        existing_answers = UserSurveyOption.objects.filter(user=user, survey_option__survey_question__survey_post=pk)
-        if existing_answers.exists():
+        if SurveyCompletion.objects.filter(user=user, survey_post=survey_post).exists():
             return Response({"error": "You had completed this survey."}, status=status.HTTP_400_BAD_REQUEST)
 
-        required_question_ids = set(survey_post.questions.values_list('id', flat=True))
-        answered_question_ids = set(int(question_id) for question_id in answers.keys())
+        try:
+            selected = {
+                int(question_id): {int(option_id) for option_id in option_ids}
+                for question_id, option_ids in answers.items()
+            }
+        except (AttributeError, TypeError, ValueError):
+            return Response({"error": "Invalid answers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Kiểm tra mọi lựa chọn thuộc đúng câu hỏi của khảo sát này trong 1 câu truy vấn
+        option_ids = set().union(*selected.values())
+        option_questions = {
+            option_id: (question_id, multi_choice)
+            for option_id, question_id, multi_choice in SurveyOption.objects.filter(
+                pk__in=option_ids, survey_question__survey_post=survey_post,
+            ).values_list('id', 'survey_question_id', 'survey_question__multi_choice')
+        }
+        for question_id, question_option_ids in selected.items():
+            for option_id in question_option_ids:
+                if option_questions.get(option_id, (None,))[0] != question_id:
+                    return Response({"error": f"Option {option_id} does not belong to question {question_id}."},
+                                    status=status.HTTP_400_BAD_REQUEST)
+            if len(question_option_ids) > 1 and not option_questions[next(iter(question_option_ids))][1]:
+                return Response({"error": f"Question {question_id} accepts only one option."},
+                                status=status.HTTP_400_BAD_REQUEST)
 
+        required_question_ids = set(survey_post.questions.values_list('id', flat=True))
+        answered_question_ids = {question_id for question_id, question_option_ids in selected.items() if question_option_ids}
         if required_question_ids - answered_question_ids:
             return Response({"error": "You must answer all questions."}, status=status.HTTP_400_BAD_REQUEST)
 
-        for question_id, selected_option_ids in answers.items():
-            for option_id in selected_option_ids:
-                UserSurveyOption.objects.create(user=user, survey_option_id=option_id)
-
-        SurveyDraft.objects.filter(user=user, survey_post=survey_post).delete()
+        try:
+            with transaction.atomic():
+                # Ghi completion trước: request nộp song song sẽ bị unique (user, survey_post) chặn lại
+                SurveyCompletion.objects.create(user=user, survey_post=survey_post)
+                UserSurveyOption.objects.bulk_create(
+                    [UserSurveyOption(user=user, survey_option_id=option_id) for option_id in option_ids]
+                )
+                SurveyOption.objects.filter(pk__in=option_ids).update(response_count=F('response_count') + 1)
+                SurveyPost.objects.filter(pk=survey_post.pk).update(respondent_count=F('respondent_count') + 1)
+                SurveyDraft.objects.filter(user=user, survey_post=survey_post).delete()
+        except IntegrityError:
+            return Response({"error": "You had completed this survey."}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({"message": "Survey submitted successfully."}, status=status.HTTP_201_CREATED)
 
+    @action(detail=True, url_path='results', methods=['get'])
+    def results(self, request, pk=None):
+        survey_post = get_object_or_404(SurveyPost, pk=pk, active=True)
+        return Response({
+            'survey_post': survey_post.id,
+            'respondent_count': survey_post.respondent_count,
+            'questions': survey_post.results(),
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=False, url_path='crosstab', methods=['get'])
+    def crosstab(self, request):
+        """Bảng chéo giữa 2 câu hỏi (có thể thuộc 2 khảo sát): ?row=<question_id>&column=<question_id>&filters=<option_id>,..."""
+        try:
+            row = int(request.query_params['row'])
+            column = request.query_params.get('column')
+            column = int(column) if column else None
+            filters = [int(option_id) for option_id in request.query_params.get('filters', '').split(',') if option_id]
+        except (KeyError, ValueError):
+            return Response({"error": "row, column và filters phải là id hợp lệ."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            data = analytics.crosstab(row, column, filters)
+        except analytics.AnalyticsError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data, status=status.HTTP_200_OK)
+
+    @action(detail=True, url_path='export', methods=['get'])
+    def export(self, request, pk=None):
+        """Tải câu trả lời của khảo sát, 1 dòng/người: ?type=csv (mặc định) hoặc ?type=ndjson"""
+        survey_post = get_object_or_404(SurveyPost, pk=pk)
+        try:
+            return analytics.export_survey_responses(survey_post, request.query_params.get('type', 'csv'))
+        except analytics.AnalyticsError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
 
 class GroupViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView, generics.RetrieveAPIView, generics.DestroyAPIView):
     queryset = Group.objects.filter(active=True).order_by('-created_date').prefetch_related('users')
@@ -911,15 +1018,11 @@ class GroupViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIVie
         q = request.query_params.get('q')
         
         # Lấy queryset người dùng của nhóm
-        users_queryset = instance.users.all().order_by('-date_joined')
+        users_queryset = UserSerializer.optimize_queryset(instance.users.all().order_by('-date_joined'), request)
         
         # Xử lý tìm kiếm nếu có từ khóa
         if q:
-            users_queryset = users_queryset.annotate(
-                full_name=Concat('last_name', Value(' '), 'first_name', output_field=CharField())
-            ).filter(
-                full_name__icontains=q
-            )
+            users_queryset = search_users(users_queryset, q)
         
         # Sử dụng paginator cho người dùng
         paginator = OptionUserPagination()
@@ -1006,80 +1109,29 @@ class EventInviteViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.List
         return [RolePermission([0])]
 
     def perform_create(self, serializer):
-        post = serializer.save(user=self.request.user)
-
-        subject = "Thông báo về bài đăng mời tham gia sự kiện sắp tới của Trường Đại Học Mở Thành phố Hồ Chí Minh"
-
-        title = post.title or "Sự kiện từ Trường Đại Học Mở Thành phố Hồ Chí Minh"
-        content = post.content or ""
-        content_html = content.replace('\n', '<br>')
-        image_html = ""
-        for image in post.images.all():
-            image_html += f"""
-                <div style="text-align:center; margin: 10px 0;">
-                    <img src="{image.image.url}" alt="Event Image" style="max-width:100%; height:auto; border-radius:8px;">
-                </div>
-            """
-        message = f"""<!DOCTYPE html>
-        <html lang="en">
-        <head>
-          <meta charset="UTF-8">
-          <meta name="viewport" content="width=device-width, initial-scale=1.0">
-          <title>Event Invitation</title>
-          <style>
-            body {{ font-family: Arial, sans-serif; color: #333; margin: 0; padding: 0; }}
-            .email-container {{ max-width: 600px; margin: 0 auto; border: 1px solid #ddd; }}
-            .email-header {{ background-color: #1d559f; padding: 20px; text-align: center; color: white; }}
-            .email-body {{ padding: 20px; background-color: #fff; }}
-            .event-details {{ background-color: #f9f9f9; border-left: 3px solid #1d559f; padding: 15px; margin: 15px 0; }}
-            .cta-button {{ display: inline-block; background-color: #1d559f; color: white; padding: 10px 25px; border-radius: 4px; text-decoration: none; font-weight: bold; }}
-            .email-footer {{ background-color: #f5f5f5; padding: 15px; text-align: center; font-size: 12px; color: #666; }}
-          </style>
-        </head>
-        <body>
-          <div class="email-container">
-            <div class="email-header">
-              <h2>{post.title}</h2>
-            </div>
-            <div class="email-body">
-              <p>{content_html}</p>
-              {image_html}
-              <p>Trân trọng,<br>Trường Đại học Mở TP.HCM</p>
-            </div>
-            <div class="email-footer">
-              <p>© 2025 AlumniSocialNetwork | <a href="#">Liên hệ</a></p>
-            </div>
-          </div>
-        </body>
-        </html>"""
-        from_email = settings.DEFAULT_FROM_EMAIL
-
-        recipient_list = set()
-
-        # Gửi cho từng cá nhân nếu có
-        if hasattr(post, 'individuals'):
-            recipient_list |= set(post.individuals.values_list('email', flat=True))
-
-        # Gửi cho người trong các nhóm nếu có
-        if hasattr(post, 'groups'):
-            for group in post.groups.all():
-                recipient_list |= set(group.users.values_list('email', flat=True))
-
-        # Gửi cho tất cả user nếu đánh dấu gửi tới tất cả
-        if getattr(post, 'send_to_all', False):
-            recipient_list |= set(
-                User.objects.exclude(email__isnull=True).exclude(email__exact='').values_list('email', flat=True))
-
-        # Gửi mail
-        if recipient_list:
-            email = EmailMessage(
-                subject=subject,
-                body=message,
-                from_email=from_email,
-                to=list(recipient_list)
-            )
-            email.content_subtype = "html"  # Đảm bảo email có định dạng HTML
-            email.send(fail_silently=True)  # Hoặc False để debug lỗi gửi mail
+        # Bài đăng và tiến trình gửi lời mời được ghi cùng nhau: không có bài đăng nào thiếu dispatch
+        with transaction.atomic():
+            post = serializer.save(user=self.request.user)
+            # Email mời được gửi nền theo từng chunk (đưa vào hàng đợi sau khi commit), request của admin trả về ngay
+            start_invitation_dispatch(post)
+            publish_post_created(post, 'invitation')
+
+    # Tiến độ gửi email mời của bài đăng
+    @action(detail=True, methods=['get'], url_path='dispatch')
+    def dispatch_status(self, request, pk=None):
+        dispatch = get_object_or_404(InvitationDispatch, post_id=pk)
+        return Response(InvitationDispatchSerializer(dispatch).data, status=status.HTTP_200_OK)
+
+    # Gửi lại cho các người nhận bị lỗi
+    @action(detail=True, methods=['post'], url_path='dispatch/resume')
+    def resume_dispatch(self, request, pk=None):
+        dispatch = get_object_or_404(InvitationDispatch, post_id=pk)
+        if dispatch.status in (InvitationDispatch.Status.PENDING, InvitationDispatch.Status.RUNNING) \
+                and not is_dispatch_stalled(dispatch):
+            return Response({'error': 'Email mời đang được gửi'}, status=status.HTTP_409_CONFLICT)
+        resumed = resume_invitation_dispatch(dispatch)
+        return Response({'message': f'Đang gửi lại cho {resumed} người nhận',
+                         'dispatch': InvitationDispatchSerializer(dispatch).data}, status=status.HTTP_202_ACCEPTED)
 
 
 class ChatViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView, generics.RetrieveAPIView):
@@ -1090,35 +1142,29 @@ class ChatViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView
 
     def get_queryset(self):
         user = self.request.user
+        # Trạng thái đã đọc / số tin chưa đọc lấy từ con trỏ ChatParticipant, không cần prefetch tin nhắn cuối
         queryset = ChatRoom.objects.filter(
             models.Q(user1=user) | models.Q(user2=user)
-        ).select_related('user1', 'user2').prefetch_related(
-            Prefetch(
-                'messages',
-                queryset=Message.objects.order_by('-created_date')[:1],
-                to_attr='latest_message'
-            )
-        ).order_by('-last_message_time')
+        ).select_related('user1', 'user2').with_read_state(user).order_by('-last_message_time')
+        return queryset
+
+    def get_inbox_queryset(self):
+        """Hộp thư của user: chỉ đọc bảng ChatParticipant theo index (user, last_message_time)"""
+        queryset = ChatParticipant.objects.filter(user=self.request.user).order_by('-last_message_time', '-id')
         q = self.request.query_params.get('q')
         if q:
-            queryset = queryset.filter(
-                Q(user1=user, user2__first_name__icontains=q) |
-                Q(user1=user, user2__last_name__icontains=q) |
-                Q(user1=user, user2__username__icontains=q) |
-                Q(user2=user, user1__first_name__icontains=q) |
-                Q(user2=user, user1__last_name__icontains=q) |
-                Q(user2=user, user1__username__icontains=q)
-            )
+            # Tìm theo họ tên / username của người còn lại, không phân biệt dấu
+            for token in normalize(q).split():
+                queryset = queryset.filter(other_search_name__contains=token)
         return queryset
 
-
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
+        queryset = self.get_inbox_queryset()
         page = self.paginate_queryset(queryset)
         if page is not None:
-            serializer = self.get_serializer(page, many=True, context={'request': request})
+            serializer = ChatInboxSerializer(page, many=True, context={'request': request})
             return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(queryset, many=True, context={'request': request})
+        serializer = ChatInboxSerializer(queryset, many=True, context={'request': request})
         return Response(serializer.data)
 
     def create(self, request, *args, **kwargs):
@@ -1129,18 +1175,22 @@ class ChatViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView
             return Response({'error': 'Không thể tạo phòng chat với chính mình.'}, status=status.HTTP_400_BAD_REQUEST)
 
         other_user = get_object_or_404(User, id=user_id)
-        
+
         # Kiểm tra xem phòng chat đã tồn tại chưa
-        existing_room = ChatRoom.objects.filter(
-            models.Q(user1=request.user, user2=other_user) |
-            models.Q(user1=other_user, user2=request.user)
-        ).first()
-        if existing_room:
-            return Response(ChatRoomSerializer(existing_room, context={'request': request}).data)
-
-        chat_room = ChatRoom.objects.create(user1=request.user, user2=other_user)
-        # Tạo phòng chat trong Firebase
-        create_chat_room(chat_room.id, [request.user, other_user])
+        chat_room = ChatRoom.objects.between(request.user, other_user).first()
+        if chat_room is None:
+            try:
+                with transaction.atomic():
+                    chat_room = ChatRoom.objects.create(**ChatRoom.ordered_users(request.user, other_user))
+                    ChatParticipant.objects.bulk_create([
+                        ChatParticipant.build(chat_room, request.user, other_user),
+                        ChatParticipant.build(chat_room, other_user, request.user),
+                    ])
+                    # Phòng chat được tạo trên Firebase bởi worker đồng bộ outbox
+                    record_chat_event(chat_room, ChatOutbox.Kind.CREATE_ROOM)
+            except IntegrityError:
+                # Request song song đã tạo phòng trước, unique (user1, user2) chặn bản ghi thứ 2
+                chat_room = ChatRoom.objects.between(request.user, other_user).get()
         return Response(ChatRoomSerializer(chat_room, context={'request': request}).data)
 
     @action(detail=True, methods=['get'], url_path='messages')
@@ -1152,18 +1202,12 @@ class ChatViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView
             ),
             pk=pk
         )
-        before_id = request.query_params.get('before_id')
-        queryset = chat_room.messages.order_by('-created_date').select_related('sender')
-        if before_id:
-            try:
-                before_message = Message.objects.get(pk=before_id, chat_room=chat_room)
-                queryset = queryset.filter(created_date__lt=before_message.created_date)
-            except Message.DoesNotExist:
-                return Response({'count': 0, 'next': None, 'previous': None, 'results': []}, status=200)
-        # Sử dụng DRF Pagination
+        queryset = MessageSerializer.optimize_queryset(chat_room.messages.all(), request)
+        # Keyset theo (chat_room, id): ?before_id= lấy trang cũ hơn, trả về next_before
         paginator = MessagePagination()
         page = paginator.paginate_queryset(queryset, request)
-        serializer = MessageSerializer(page, many=True)
+        read_cursors = dict(chat_room.participants.values_list('user_id', 'last_read_message_id'))
+        serializer = MessageSerializer(page, many=True, context={'request': request, 'read_cursors': read_cursors})
         return paginator.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['post'], url_path='send_message')
@@ -1178,36 +1222,70 @@ class ChatViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView
         if not content:
             return Response({'error': 'Vui lòng nhập nội dung tin nhắn'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Lưu vào DB để backup/thống kê trước để lấy id
-        db_message = Message.objects.create(
-            chat_room=chat_room,
-            sender=request.user,
-            content=content
-        )
-        user_ids = [chat_room.user1.id, chat_room.user2.id]
-        # Gửi tin nhắn lên Firestore với id trùng DB
-        send_message(pk, request.user.id, content, user_ids=user_ids, message_id=db_message.id)
-        # Cập nhật last_message, last_message_time cho ChatRoom
-        chat_room.last_message = content
-        chat_room.last_message_time = db_message.created_date
-        chat_room.save(update_fields=['last_message', 'last_message_time'])
+        with transaction.atomic():
+            db_message = Message.objects.create(
+                chat_room=chat_room,
+                sender=request.user,
+                content=content
+            )
+            # Cập nhật last_message, last_message_time cho ChatRoom
+            chat_room.last_message = content
+            chat_room.last_message_time = db_message.created_date
+            chat_room.last_message_id = db_message.id
+            chat_room.last_message_sender = request.user
+            chat_room.save(update_fields=['last_message', 'last_message_time', 'last_message_id', 'last_message_sender'])
+            # Cập nhật hộp thư của cả 2 người trong 1 câu UPDATE: tin nhắn cuối,
+            # người gửi đã đọc tới tin nhắn của mình, người còn lại tăng số tin chưa đọc
+            is_sender = Q(user=request.user)
+            ChatParticipant.objects.filter(chat_room=chat_room).update(
+                last_message=content,
+                last_message_time=db_message.created_date,
+                last_message_id=db_message.id,
+                last_message_sender=request.user,
+                last_read_message_id=Case(When(is_sender, then=Value(db_message.id)),
+                                          default=F('last_read_message_id'),
+                                          output_field=models.BigIntegerField()),
+                unread_count=Case(When(is_sender, then=Value(0)), default=F('unread_count') + 1),
+            )
+            # Tin nhắn được đồng bộ lên Firestore (id trùng DB) bởi worker sau khi commit
+            record_chat_event(chat_room, ChatOutbox.Kind.MESSAGE, message_id=db_message.id)
+            publish_chat_message(chat_room, db_message)
 
         return Response(MessageSerializer(db_message).data)
 
     @action(detail=True, methods=['post'], url_path='mark_as_read')
     def mark_as_read(self, request, pk=None):
-        """Đánh dấu tất cả tin nhắn chưa đọc là đã đọc cho user hiện tại (Firestore + DB)"""
+        """Đánh dấu tất cả tin nhắn chưa đọc là đã đọc cho user hiện tại (DB, Firestore được đồng bộ qua outbox)"""
         chat_room = get_object_or_404(
             ChatRoom.objects.filter(
                 models.Q(user1=request.user) | models.Q(user2=request.user)
             ),
             pk=pk
         )
-        mark_messages_as_read(pk, request.user.id)
-        Message.objects.filter(chat_room=chat_room, is_read=False).exclude(sender=request.user).update(is_read=True)
-        # Đồng bộ trạng thái đã đọc lên lastMessages
-        update_last_message_is_read(pk, True)
-        return Response({'is_read': True})
+        other_user_id = chat_room.user2_id if chat_room.user1_id == request.user.id else chat_room.user1_id
+        # Đánh dấu đã đọc tới tin nhắn cuối lúc nhận request; tin nhắn tới sau đó vẫn là chưa đọc nên unread_count
+        # được đếm lại trong cùng câu UPDATE: tin của người kia có id > con trỏ mới
+        cursor = Greatest('last_read_message_id', Value(chat_room.last_message_id or 0),
+                          output_field=models.BigIntegerField())
+        unread = Message.objects.filter(chat_room=OuterRef('chat_room_id'),
+                                        id__gt=Greatest(OuterRef('last_read_message_id'),
+                                                        Value(chat_room.last_message_id or 0),
+                                                        output_field=models.BigIntegerField()))\
+            .exclude(sender=OuterRef('user_id')).order_by().values('chat_room').annotate(total=Count('id')).values('total')
+        participants = ChatParticipant.objects.filter(chat_room=chat_room, user=request.user)
+        with transaction.atomic():
+            # unread_count đứng trước vì MySQL tính các phép gán theo thứ tự, phải dùng con trỏ cũ
+            participants.update(
+                unread_count=Coalesce(Subquery(unread), Value(0)),
+                last_read_message_id=cursor,
+            )
+            last_read_message_id, unread_count = participants.values_list('last_read_message_id', 'unread_count').get()
+            # Con trỏ được đồng bộ lên lastMessages trên Firestore bởi worker
+            record_chat_event(chat_room, ChatOutbox.Kind.MARK_READ, user_id=request.user.id,
+                              sender_ids=[other_user_id], last_read_message_id=last_read_message_id)
+            publish_chat_read(chat_room, request.user.id, last_read_message_id)
+        return Response({'is_read': unread_count == 0, 'unread_count': unread_count,
+                         'last_read_message_id': last_read_message_id})
 
     @action(detail=True, methods=['get'], url_path='last_message')
     def get_last_message(self, request, pk=None):